@@ -2,8 +2,11 @@ CSV_OUTPUT_DIR_RELATIVE := tmp/scrapy
 DB_FILES_DIR_RELATIVE := $(CSV_OUTPUT_DIR_RELATIVE)/mysql
 export CSV_OUTPUT_DIR := $(abspath $(CSV_OUTPUT_DIR_RELATIVE))
 export DB_FILES_DIR := $(abspath $(DB_FILES_DIR_RELATIVE))
+# csv, or dcsv for compact dictionary-encoded files (see src/python/dcsv.py)
+export CSV_OUTPUT_FORMAT ?= csv
 
-CSV_FILENAMES := drug_recommendation.csv gene_haplotype_variant.csv genotype_drug_recommendation.csv genotype_phenotype.csv
+CSV_TABLES := drug_recommendation gene_haplotype_variant genotype_drug_recommendation genotype_phenotype
+CSV_FILENAMES := $(addsuffix .$(CSV_OUTPUT_FORMAT),$(CSV_TABLES))
 CSV_FILES := $(addprefix $(CSV_OUTPUT_DIR_RELATIVE)/,$(CSV_FILENAMES))
 DB_FILES := $(addprefix $(DB_FILES_DIR_RELATIVE)/,$(CSV_FILENAMES))
 
@@ -13,18 +16,24 @@ $(CSV_OUTPUT_DIR_RELATIVE):
 	cd src/python/pharmgkb && scrapy crawl GeneDrugPair
 	touch $(CSV_OUTPUT_DIR)
 
-$(DB_FILES_DIR_RELATIVE)/%.csv: $(CSV_OUTPUT_DIR_RELATIVE)/%.csv
-	mkdir -p $(dir $@)
-	$(SCRIPT)/collapse_scraped_data.py $^ --output $@
+# collapse all the scraped files with one (parallel) invocation, recorded by a stamp file
+$(DB_FILES_DIR_RELATIVE)/.collapsed: $(CSV_FILES)
+	$(SCRIPT)/collapse_scraped_data.py $^ --output-dir $(DB_FILES_DIR_RELATIVE)
+	touch $@
+
+$(DB_FILES): $(DB_FILES_DIR_RELATIVE)/.collapsed ;
 
 dbfiles: $(DB_FILES)
 
 load_haplorec: $(DB_FILES)
 	$(SCRIPT)/load_dsv.py $(HAPLOREC_DB_NAME) \
-		$(DB_FILES_DIR_RELATIVE)/drug_recommendation.csv \
-		$(DB_FILES_DIR_RELATIVE)/gene_haplotype_variant.csv \
-		$(DB_FILES_DIR_RELATIVE)/genotype_phenotype.csv \
-		$(DB_FILES_DIR_RELATIVE)/genotype_drug_recommendation.csv \
+		$(DB_FILES_DIR_RELATIVE)/drug_recommendation.$(CSV_OUTPUT_FORMAT) \
+		$(DB_FILES_DIR_RELATIVE)/gene_haplotype_variant.$(CSV_OUTPUT_FORMAT) \
+		$(DB_FILES_DIR_RELATIVE)/genotype_phenotype.$(CSV_OUTPUT_FORMAT) \
+		$(DB_FILES_DIR_RELATIVE)/genotype_drug_recommendation.$(CSV_OUTPUT_FORMAT) \
+		--batch-size 1000 \
+		--jobs 2 \
+		--delta \
 		--map \
 			"genotype_drug_recommendation: gene_name, haplotype_name1, haplotype_name2, drug_name => drug_recommendation" \
 		--ignore \
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+from scrapy.crawler import Crawler
+from scrapy.settings import CrawlerSettings
+from scrapy.spider import BaseSpider
+from scrapy.http import Request, FormRequest
+from scrapy import signals
+from twisted.internet import reactor
+
+import argparse
+import multiprocessing
+import threading
+import time
+
+import latency_webserver
+
+MODES = {
+    # one DOWNLOAD_DELAY for the whole site
+    'fixed': {'ENDPOINT_THROTTLE_ENABLED': False},
+    # pharmgkb.middlewares.EndpointThrottleMiddleware
+    'adaptive': {'ENDPOINT_THROTTLE_ENABLED': True},
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl a stand-in pharmgkb server with programmable latency (script/latency_webserver.py) using the project settings, once pacing requests with a fixed DOWNLOAD_DELAY and once with per-endpoint adaptive throttling, and report the throughput and error rate of each.  The crawl requests, for each gene, its gene page, --drugs ajaxGuidelinePickerData.action responses, and --genotypes alleleGuidelines.action responses per drug.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--port', '-p', type=int, default=8011)
+    parser.add_argument('--genes', type=int, default=4)
+    parser.add_argument('--drugs', type=int, default=2)
+    parser.add_argument('--genotypes', type=int, default=25)
+    parser.add_argument('--endpoint', nargs=3, action='append', metavar=('REGEX', 'LATENCY', 'CAPACITY'),
+            help="a stand-in endpoint (see latency_webserver.py)")
+    parser.add_argument('--overload', type=float, default=2.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--modes', nargs='+', default=['fixed', 'adaptive'], choices=sorted(MODES))
+    args = parser.parse_args()
+
+    endpoints = latency_webserver.DEFAULT_ENDPOINTS if args.endpoint is None else \
+        [(regex, float(latency), int(capacity)) for regex, latency, capacity in args.endpoint]
+    print "{mode:<9} {requests:>8} {seconds:>8} {rate:>10} {errors:>6} {error_rate:>10}".format(
+        mode='mode', requests='requests', seconds='seconds', rate='requests/s', errors='errors', error_rate='error rate')
+    for mode in args.modes:
+        httpd = latency_webserver.start_webserver(args.port, endpoints, overload=args.overload, error_rate=args.error_rate)
+        server = threading.Thread(target=httpd.serve_forever)
+        server.daemon = True
+        server.start()
+        try:
+            pool = multiprocessing.Pool(1)
+            seconds, stats = pool.apply(crawl, (MODES[mode], 'http://localhost:{port}'.format(port=args.port),
+                args.genes, args.drugs, args.genotypes))
+            pool.close()
+            pool.join()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        responses = stats.get('downloader/response_count', 0)
+        errors = responses - stats.get('downloader/response_status_count/200', 0) + \
+                 stats.get('downloader/exception_count', 0)
+        print "{mode:<9} {requests:>8} {seconds:>8.1f} {rate:>10.2f} {errors:>6} {error_rate:>10.4f}".format(
+            mode=mode,
+            requests=responses,
+            seconds=seconds,
+            rate=responses / seconds,
+            errors=errors,
+            error_rate=float(errors) / max(1, responses))
+        for endpoint in httpd.endpoints:
+            print "    server {summary}".format(summary=endpoint.summary())
+        for key in sorted(stats):
+            if key.startswith(("endpoint_throttle/", "downloader/exception")):
+                print "    {key} = {value}".format(key=key, value=stats[key])
+
+class StandInSpider(BaseSpider):
+    name = 'stand_in'
+
+    def __init__(self, base_url, genes, drugs, genotypes):
+        BaseSpider.__init__(self)
+        self.base_url = base_url
+        self.genes = genes
+        self.drugs = drugs
+        self.genotypes = genotypes
+
+    def start_requests(self):
+        for gene in xrange(self.genes):
+            yield Request(self.base_url + '/gene/PA{gene}'.format(gene=gene))
+            for drug in xrange(self.drugs):
+                annotation_id = str(gene * self.drugs + drug)
+                yield FormRequest(self.base_url + '/views/ajaxGuidelinePickerData.action',
+                        formdata={'annotationId': annotation_id})
+                for genotype in xrange(self.genotypes):
+                    yield FormRequest(self.base_url + '/views/alleleGuidelines.action',
+                            formdata={'annotationId': annotation_id, 'allele1': 'PA{0}'.format(genotype), 'allele2': 'PA0'})
+
+    def parse(self, response):
+        return []
+
+def crawl(overrides, base_url, genes, drugs, genotypes):
+    """
+    Crawl the stand-in server at base_url with the project settings (plus overrides), returning the
+    seconds taken and the crawl stats.
+    """
+    settings = CrawlerSettings(__import__('pharmgkb.settings', fromlist=['settings']))
+    settings.overrides.update({
+        'HTTPCACHE_ENABLED': False,
+        'OFFLINE': False,
+        'ITEM_PIPELINES': [],
+        'EXTENSIONS': {},
+        'LOG_ENABLED': False,
+    })
+    settings.overrides.update(overrides)
+    crawler = Crawler(settings)
+    crawler.configure()
+    crawler.signals.connect(reactor.stop, signal=signals.engine_stopped)
+    crawler.crawl(StandInSpider(base_url, genes, drugs, genotypes))
+    start = time.time()
+    crawler.start()
+    reactor.run()
+    return time.time() - start, crawler.stats.get_stats()
+
+if __name__ == '__main__':
+    main()
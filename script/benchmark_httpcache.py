@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+from scrapy.crawler import Crawler
+from scrapy.settings import Settings, CrawlerSettings
+from scrapy.spider import BaseSpider
+from scrapy.http import FormRequest, HtmlResponse
+from scrapy.utils.misc import load_object
+from scrapy import signals
+from twisted.internet import reactor
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+STORAGES = [
+    'scrapy.contrib.httpcache.DbmCacheStorage',
+    'scrapy.contrib.httpcache.FilesystemCacheStorage',
+    'pharmgkb.httpcache.SqliteCacheStorage',
+]
+
+class Spider(BaseSpider):
+    name = 'benchmark'
+
+    def __init__(self, requests=[]):
+        BaseSpider.__init__(self)
+        self.requests = requests
+
+    def start_requests(self):
+        return self.requests
+
+    def parse(self, response):
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description="Store synthetic alleleGuidelines.action responses (like those requested by HaplotypeGenotypeSpider) in each HTTPCACHE_STORAGE, then report the time taken to store them, to retrieve them all from a warm cache (in a new process, like a rerun of the crawl), to crawl them all from the warm cache with the project settings in OFFLINE mode (so nothing is downloaded), and the size of the cache on disk.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--responses', type=int, default=10000)
+    parser.add_argument('--storages', nargs='+', default=STORAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print "{storage:<48} {responses:>9} {store:>9} {retrieve:>10} {crawl:>7} {disk_mb:>8}".format(
+        storage='storage', responses='responses', store='store s', retrieve='retrieve s', crawl='crawl s', disk_mb='disk MB')
+    for storage in args.storages:
+        directory = tempfile.mkdtemp()
+        try:
+            store_seconds = _in_process(store, storage, directory, args.responses, args.seed)
+            retrieve_seconds = _in_process(retrieve, storage, directory, args.responses, args.seed)
+            crawl_seconds = _in_process(warm_crawl, storage, directory, args.responses, args.seed)
+            print "{storage:<48} {responses:>9} {store:>9.2f} {retrieve:>10.2f} {crawl:>7.2f} {disk_mb:>8.1f}".format(
+                storage=storage,
+                responses=args.responses,
+                store=store_seconds,
+                retrieve=retrieve_seconds,
+                crawl=crawl_seconds,
+                disk_mb=disk_usage(directory) / 1024. / 1024.)
+        finally:
+            shutil.rmtree(directory)
+
+def _in_process(f, *args):
+    pool = multiprocessing.Pool(1)
+    result = pool.apply(f, args)
+    pool.close()
+    pool.join()
+    return result
+
+def store(storage, directory, responses, seed):
+    """
+    Store responses synthetic responses using storage, returning the seconds taken.
+    """
+    cache = load_object(storage)(Settings({'HTTPCACHE_DIR': directory}))
+    spider = Spider()
+    cache.open_spider(spider)
+    start = time.time()
+    for request, response in guideline_responses(responses, seed):
+        cache.store_response(spider, request, response)
+    cache.close_spider(spider)
+    return time.time() - start
+
+def retrieve(storage, directory, responses, seed):
+    """
+    Retrieve the responses stored by store, returning the seconds taken.
+    """
+    requests = [request for request, response in guideline_responses(responses, seed)]
+    cache = load_object(storage)(Settings({'HTTPCACHE_DIR': directory}))
+    spider = Spider()
+    start = time.time()
+    cache.open_spider(spider)
+    for request in requests:
+        if cache.retrieve_response(spider, request) is None:
+            raise RuntimeError("{storage} is missing a response for {request}".format(**locals()))
+    cache.close_spider(spider)
+    return time.time() - start
+
+def warm_crawl(storage, directory, responses, seed):
+    """
+    Crawl the requests of the responses stored by store with the project settings, in OFFLINE mode 
+    (so every response must come from the cache), returning the seconds taken until the last 
+    response was received (not counting the engine noticing it's idle and shutting down).
+    """
+    requests = [request for request, response in guideline_responses(responses, seed)]
+    settings = CrawlerSettings(__import__('pharmgkb.settings', fromlist=['settings']))
+    settings.overrides.update({
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_DIR': directory,
+        'HTTPCACHE_STORAGE': storage,
+        'OFFLINE': True,
+        'OFFLINE_MIRROR_DIR': None,
+        'ITEM_PIPELINES': [],
+        'EXTENSIONS': {},
+        'LOG_ENABLED': False,
+    })
+    crawler = Crawler(settings)
+    crawler.configure()
+    crawler.signals.connect(reactor.stop, signal=signals.engine_stopped)
+    last_response = [None]
+    def response_received(response, request, spider):
+        last_response[0] = time.time()
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    crawler.crawl(Spider(requests))
+    start = time.time()
+    crawler.start()
+    reactor.run()
+    seconds = last_response[0] - start
+    hits = crawler.stats.get_value('httpcache/hit', 0)
+    if hits != responses:
+        raise RuntimeError("{storage} served {hits} of {responses} responses".format(**locals()))
+    return seconds
+
+def guideline_responses(responses, seed, recommendations=50):
+    """
+    Yield (request, response) for alleleGuidelines.action requests of a gene's genotypes, whose
+    bodies are one of a few drug recommendations (like most genotypes of a gene share one).
+    """
+    rand = random.Random(seed)
+    bodies = [GUIDELINE.format(
+        phenotype=rand.choice(['Ultrarapid', 'Extensive', 'Intermediate', 'Poor']),
+        implications=' '.join(rand.choice(WORDS) for i in xrange(40)),
+        strength=rand.choice(['Strong', 'Moderate', 'Optional']),
+        recommendation=' '.join(rand.choice(WORDS) for i in xrange(80)))
+        for r in xrange(recommendations)]
+    for i in xrange(responses):
+        request = FormRequest('http://www.pharmgkb.org/views/alleleGuidelines.action', formdata={
+            'annotationId': '827848453',
+            'allele1': 'PA{i}'.format(i=i // 1000),
+            'allele2': 'PA{i}'.format(i=i % 1000),
+            'location': 'CYP2D6',
+        })
+        yield request, HtmlResponse(request.url, body=rand.choice(bodies), request=request,
+                headers={'Content-Type': 'text/html;charset=UTF-8'})
+
+def disk_usage(directory):
+    return sum(os.stat(os.path.join(root, f)).st_blocks * 512 for root, dirs, files in os.walk(directory) for f in files)
+
+WORDS = ['dose', 'metabolism', 'codeine', 'morphine', 'formation', 'alternative', 'analgesic', 'toxicity', 'consider', 'increased', 'reduced', 'standard', 'therapy', 'avoid', 'use']
+
+GUIDELINE = """<html><head><title>Guideline</title></head><body>
+<dl>
+    <dt><em>
+        Phenotype (Genotype)
+    </em></dt>
+    <dd><p>An individual carrying two functional alleles</p></dd>
+    <dt><em>
+        Metabolizer Status
+    </em></dt>
+    <dd><p>{phenotype} metabolizer</p></dd>
+    <dt><em>
+        Implications
+    </em></dt>
+    <dd><p>{implications}</p></dd>
+    <dt><em>
+        Recommendations
+        (Strength: {strength})
+    </em></dt>
+    <dd><p>{recommendation}</p></dd>
+</dl>
+</body></html>
+"""
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# non-standard libs (download with pip)
+import oursql
+
+import time
+
+import argparsers
+from load_dsv import insert_rows_with_ids
+
+def main():
+    parser = argparsers.sql_parser(description="Compare the rows/sec of inserting rows into an auto_increment table one INSERT per row vs. using batched multi-row INSERT's (the table load_dsv_benchmark is created in, and dropped from, the given database)")
+    parser.add_argument('--rows', '-n', type=int, default=10000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    db = oursql.connect(
+            host=args.host,
+            port=args.port,
+            user=args.user,
+            passwd=args.password,
+            db=args.db)
+
+    print "{mode:<12} {rows:>10} {seconds:>10} {rows_per_sec:>12}".format(mode='mode', rows='rows', seconds='seconds', rows_per_sec='rows/sec')
+    for batch_size in [None] + args.batch_sizes:
+        seconds = benchmark(db, args.rows, batch_size)
+        print "{mode:<12} {rows:>10} {seconds:>10.3f} {rows_per_sec:>12.1f}".format(
+            mode='per-row' if batch_size is None else 'batch={0}'.format(batch_size),
+            rows=args.rows,
+            seconds=seconds,
+            rows_per_sec=args.rows / seconds)
+
+def benchmark(db, n, batch_size, table='load_dsv_benchmark'):
+    """
+    Return the time taken to insert n rows into a freshly created auto_increment table using
+    insert_rows_with_ids.
+    """
+    cursor = db.cursor()
+    cursor.execute("DROP TABLE IF EXISTS {table}".format(**locals()), plain_query=True)
+    cursor.execute("""
+        CREATE TABLE {table} (
+            id bigint not null auto_increment,
+            x text,
+            y text,
+            primary key (id)
+        )""".format(**locals()), plain_query=True)
+    rows = (['x{0}'.format(i), 'y{0}'.format(i)] for i in xrange(n))
+    start = time.time()
+    ids = [id for id in insert_rows_with_ids(cursor, table, ['x', 'y'], rows, batch_size=batch_size)]
+    seconds = time.time() - start
+    cursor.execute("SELECT id FROM {table} ORDER BY id".format(**locals()))
+    if ids != [row[0] for row in cursor]:
+        raise RuntimeError("ids returned for batch_size={batch_size} don't match those in {table}".format(**locals()))
+    cursor.execute("DROP TABLE {table}".format(**locals()), plain_query=True)
+    return seconds
+
+if __name__ == '__main__':
+    main()
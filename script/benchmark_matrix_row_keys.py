@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import matrix_row_keys
+
+# CYP2D6's haplotype table on PharmGKB
+CYP2D6_HAPLOTYPES = 133
+CYP2D6_SNPS = 151
+
+MODES = ['exhaustive', 'greedy', 'panel']
+
+def main():
+    parser = argparse.ArgumentParser(description="Time matrix_row_keys (and its greedy and panel modes) on generated gene-haplotype matrices, measuring peak memory and the number of keys found.  Each case runs in its own process, and results are written as json lines (one per case and mode) so that runs of different versions can be compared with --compare.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--output', '-o', type=argparse.FileType('a'), default=sys.stdout,
+            help="append results to OUTPUT")
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, choices=sorted(CASES))
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--max-key-size', type=int, default=3,
+            help="--max-key-size for the exhaustive mode")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default=_git_revision(),
+            help="label for this run's results (default: the current git revision)")
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+            help="json lines from a previous run to report the change in seconds and peak memory against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare is not None:
+        for line in args.compare:
+            result = json.loads(line)
+            baseline[(result['case'], result['mode'])] = result
+
+    for case in args.cases:
+        for mode in args.modes:
+            pool = multiprocessing.Pool(1)
+            result = pool.apply(run_case, (case, mode, args.seed, args.max_key_size))
+            pool.close()
+            pool.join()
+            result['label'] = args.label
+            print >>args.output, json.dumps(result, sort_keys=True)
+            args.output.flush()
+            old = baseline.get((case, mode))
+            if old is not None:
+                print >>sys.stderr, "{case} {mode}: {seconds:.3f}s ({seconds_ratio:.2f}x {old_label}), {peak_kb} KB ({peak_kb_ratio:.2f}x)".format(
+                    seconds_ratio=result['seconds'] / max(old['seconds'], 1e-9),
+                    peak_kb_ratio=float(result['peak_kb']) / old['peak_kb'],
+                    old_label=old['label'],
+                    **result)
+
+def run_case(case, mode, seed, max_key_size):
+    """
+    Generate case's matrix and run mode on it, returning the time taken, peak memory of this
+    process, and the number of keys (or panel columns) found.
+    """
+    column_names, row_names, rows = CASES[case](random.Random(seed))
+    start = time.time()
+    if mode == 'exhaustive':
+        K = matrix_row_keys.matrix_row_keys(column_names, row_names, rows, max_key_size=max_key_size)
+        keys = sum(len(keys) for keys in K.itervalues())
+    elif mode == 'greedy':
+        K = matrix_row_keys.greedy_row_keys(column_names, row_names, rows)
+        keys = sum(len(keys) for keys in K.itervalues())
+    else:
+        panel, lower_bound = matrix_row_keys.tag_columns(column_names, rows)
+        keys = len(panel)
+    seconds = time.time() - start
+    return {
+        'case': case,
+        'mode': mode,
+        'rows': len(rows),
+        'columns': len(column_names),
+        'max_key_size': max_key_size if mode == 'exhaustive' else None,
+        'numpy': matrix_row_keys.numpy is not None,
+        'seconds': seconds,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'keys': keys,
+    }
+
+def star_alleles(rand, haplotypes=CYP2D6_HAPLOTYPES, snps=CYP2D6_SNPS, core_alleles=40):
+    """
+    Return a matrix resembling a PharmGKB haplotype table: rows are mostly the reference allele,
+    core alleles (*2, *3, ...) are defined by a few variants each, and sub-alleles (*2_41, *2_42, 
+    ...) add a variant or two to their core allele.
+    """
+    reference = [rand.choice('ACGT') for s in xrange(snps)]
+    def variant(s):
+        return rand.choice([a for a in 'ACGT' if a != reference[s]])
+    def with_variants(row, n):
+        row = list(row)
+        for s in rand.sample(xrange(snps), n):
+            row[s] = variant(s)
+        return row
+    names = ['*1']
+    rows = [reference]
+    cores = [('*{i}'.format(i=i + 2), with_variants(reference, rand.randint(1, 4))) for i in xrange(core_alleles)]
+    for name, row in cores:
+        names.append(name)
+        rows.append(row)
+    while len(rows) < haplotypes:
+        name, row = rand.choice(cores)
+        names.append('{name}_{suffix}'.format(name=name, suffix=len(rows)))
+        rows.append(with_variants(row, rand.randint(1, 2)))
+    return ['rs{s}'.format(s=s) for s in xrange(snps)], names, rows
+
+def near_duplicates(rand, haplotypes=60, snps=60, duplicates=5):
+    """
+    Return an adversarial matrix: every row differs from one base row in a single column, so the
+    base row's only key uses a column per other row, and a few rows are exact duplicates (which
+    have no keys at all).
+    """
+    base = [rand.choice('ACGT') for s in xrange(snps)]
+    names = ['base']
+    rows = [base]
+    for i in xrange(haplotypes - 1 - duplicates):
+        row = list(base)
+        s = i % snps
+        row[s] = rand.choice([a for a in 'ACGT' if a != base[s]])
+        names.append('near{i}'.format(i=i))
+        rows.append(row)
+    for i in xrange(duplicates):
+        names.append('dup{i}'.format(i=i))
+        rows.append(list(rows[rand.randint(1, len(rows) - 1)]))
+    return ['rs{s}'.format(s=s) for s in xrange(snps)], names, rows
+
+def uniform(rand, haplotypes=40, snps=60, variant_rate=0.03):
+    """
+    Return a matrix with variants scattered uniformly at random (no shared structure between
+    rows).
+    """
+    reference = [rand.choice('ACGT') for s in xrange(snps)]
+    rows = [[rand.choice('ACGT') if rand.random() < variant_rate else a for a in reference] for h in xrange(haplotypes)]
+    return ['rs{s}'.format(s=s) for s in xrange(snps)], ['h{h}'.format(h=h) for h in xrange(haplotypes)], rows
+
+CASES = {
+    'cyp2d6': star_alleles,
+    'cyp2d6x10': lambda rand: star_alleles(rand, haplotypes=10 * CYP2D6_HAPLOTYPES, snps=10 * CYP2D6_SNPS, core_alleles=400),
+    'near_duplicates': near_duplicates,
+    'uniform': uniform,
+}
+# cyp2d6x10 is for the greedy and panel modes (it's too large to search exhaustively)
+DEFAULT_CASES = ['cyp2d6', 'near_duplicates', 'uniform']
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=open('/dev/null', 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    main()
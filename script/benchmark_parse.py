@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+from scrapy.http import HtmlResponse
+from scrapy.item import BaseItem
+from pharmgkb import settings
+from pharmgkb.spiders import Gene
+
+import argparse
+import os
+import os.path
+import sys
+import time
+import urlparse
+
+PATHS = {
+    'selector': False,
+    'compiled': True,
+}
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'in', 'pharmgkb')
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse a corpus of stored pharmgkb responses (a \"wget -r\" mirror: gene pages and alleleGuidelines.action drug recommendations) with GeneSpider and HaplotypeGenotypeSpider, once using HtmlXPathSelector queries and once using precompiled lxml XPath (settings.COMPILED_XPATH), and report the items/sec of each.  Fails if the paths don't produce identical items.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES,
+            help="directory containing the mirrored www.pharmgkb.org")
+    parser.add_argument('--repeat', type=int, default=20,
+            help="number of times to parse each response")
+    parser.add_argument('--paths', nargs='+', default=['selector', 'compiled'], choices=sorted(PATHS))
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if fixtures == []:
+        parser.error("no responses found in {fixtures}".format(fixtures=args.fixtures))
+    # parse every response, instead of reusing the fields of identical ones
+    Gene.recommendation_cache = Gene.RecommendationCache(0)
+
+    print "{path:<9} {kind:<17} {responses:>9} {items:>7} {seconds:>8} {rate:>10}".format(
+        path='path', kind='page', responses='responses', items='items', seconds='seconds', rate='items/s')
+    parsed = {}
+    for path in args.paths:
+        settings.COMPILED_XPATH = PATHS[path]
+        for kind in ['gene', 'alleleGuidelines']:
+            kind_fixtures = [f for f in fixtures if f[0] == kind]
+            seconds = 0.
+            for i in xrange(args.repeat):
+                # fresh responses, so each one is parsed again
+                responses = [(parse, HtmlResponse(url, body=body, headers={'Content-Type': 'text/html;charset=UTF-8'}))
+                             for k, url, body, parse in kind_fixtures]
+                start = time.time()
+                results = [[i for i in parse(response) if isinstance(i, BaseItem)] for parse, response in responses]
+                seconds += time.time() - start
+            parsed[(path, kind)] = [[(type(i).__name__, sorted(i.items())) for i in result] for result in results]
+            n = sum(len(result) for result in results) * args.repeat
+            print "{path:<9} {kind:<17} {responses:>9} {items:>7} {seconds:>8.2f} {rate:>10.0f}".format(
+                path=path,
+                kind=kind,
+                responses=len(kind_fixtures) * args.repeat,
+                items=n,
+                seconds=seconds,
+                rate=n / seconds)
+    for kind in ['gene', 'alleleGuidelines']:
+        results = [repr(parsed[(path, kind)]) for path in args.paths]
+        if any(r != results[0] for r in results[1:]):
+            print >> sys.stderr, "ERROR: {paths} parsed different {kind} items".format(paths=' and '.join(args.paths), kind=kind)
+            sys.exit(1)
+    print "identical items: yes"
+
+def load_fixtures(directory):
+    """
+    Return (kind, url, body, parse) for each mirrored response in directory, where parse(response)
+    parses it with a new spider.
+    """
+    fixtures = []
+    for root, dirs, files in os.walk(directory):
+        for f in sorted(files):
+            path = os.path.join(root, f)
+            url = 'http://' + os.path.relpath(path, directory)
+            with open(path, 'rb') as fixture:
+                body = fixture.read()
+            if '/gene/' in url:
+                fixtures.append(('gene', url, body, lambda response, url=url: Gene.GeneSpider(start_url=url).parse(response)))
+            elif '/alleleGuidelines.action?' in url:
+                fixtures.append(('alleleGuidelines', url, body, genotype_parser(url)))
+    return fixtures
+
+def genotype_parser(url):
+    query = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+    def parse(response):
+        spider = Gene.HaplotypeGenotypeSpider(
+                annotation_id=query['annotationId'],
+                haplotype_id1=query['allele1'],
+                haplotype_id2=query.get('allele2', query['allele1']),
+                haplotype_name1=query['allele1'],
+                haplotype_name2=query.get('allele2', query['allele1']),
+                gene_name=query['location'],
+                drug_name=query['annotationId'])
+        return spider.parse(response)
+    return parse
+
+if __name__ == '__main__':
+    main()
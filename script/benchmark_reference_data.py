@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# non-standard libs (download with pip)
+import oursql
+import MySQLdb
+
+import multiprocessing
+import os.path
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+import argparsers
+import generate_reference_data
+from load_dsv import load_dsv
+from load_scraped_data import load_csv_file
+
+# same as the load_haplorec target in scrapy_config.mk
+LOAD_DSV_TABLES = ['drug_recommendation', 'gene_haplotype_variant', 'genotype_phenotype', 'genotype_drug_recommendation']
+LOAD_DSV_MAP = [
+    "genotype_drug_recommendation: gene_name, haplotype_name1, haplotype_name2, drug_name => drug_recommendation",
+]
+LOAD_DSV_IGNORE = [
+    "genotype_drug_recommendation.drug_name",
+    "drug_recommendation.gene_name",
+    "drug_recommendation.haplotype_name1",
+    "drug_recommendation.haplotype_name2",
+    "genotype_phenotype.phenotype_genotype",
+]
+
+def main():
+    parser = argparsers.sql_parser(description="Generate synthetic reference data at increasing scales (in number of CYP2D6-sized genes), and report the rows/sec and peak memory of loading it with load_dsv and load_csv_file.  The database DB is dropped and recreated from --schema before each case (so point this at a throwaway database, on either a MySQL server or a local stand-in like a scratch mysqld/MariaDB instance).  Each case runs in its own process, so that peak memory is measured per case.")
+    parser.add_argument('--schema', default='src/sql/mysql/haplorec.sql',
+            help="haplorec schema (render it with make)")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+            help="number of genes to generate data for")
+    parser.add_argument('--haplotypes', type=int, default=generate_reference_data.CYP2D6_HAPLOTYPES)
+    parser.add_argument('--snps', type=int, default=generate_reference_data.CYP2D6_SNPS)
+    parser.add_argument('--cases', nargs='+', default=['load_dsv', 'load_csv_file'], choices=['load_dsv', 'load_csv_file'])
+    parser.add_argument('--batch-size', type=int,
+            help="--batch-size for load_dsv")
+    args = parser.parse_args()
+
+    print "{case:<14} {scale:>6} {rows:>10} {seconds:>10} {rows_per_sec:>12} {peak_mb:>10}".format(
+        case='case', scale='genes', rows='rows', seconds='seconds', rows_per_sec='rows/sec', peak_mb='peak MB')
+    for scale in args.scales:
+        directory = tempfile.mkdtemp()
+        try:
+            generate_reference_data.generate(directory, genes=scale, haplotypes=args.haplotypes, snps=args.snps)
+            for case in args.cases:
+                pool = multiprocessing.Pool(1)
+                rows, seconds, peak_kb = pool.apply(run_case, (case, args, directory))
+                pool.close()
+                pool.join()
+                print "{case:<14} {scale:>6} {rows:>10} {seconds:>10.3f} {rows_per_sec:>12.1f} {peak_mb:>10.1f}".format(
+                    case=case,
+                    scale=scale,
+                    rows=rows,
+                    seconds=seconds,
+                    rows_per_sec=rows / seconds,
+                    peak_mb=peak_kb / 1024.)
+        finally:
+            shutil.rmtree(directory)
+
+def run_case(case, args, directory):
+    """
+    Recreate args.db, then load the files in directory using case.
+    Return (rows loaded, seconds taken, peak memory of this process in KB).
+    """
+    create_database(args)
+    files = [os.path.join(directory, t + '.csv') for t in LOAD_DSV_TABLES]
+    if case == 'load_dsv':
+        db = oursql.connect(host=args.host, port=args.port, user=args.user, passwd=args.password, db=args.db)
+        start = time.time()
+        load_dsv(db, files, LOAD_DSV_MAP, LOAD_DSV_IGNORE, batch_size=args.batch_size)
+        seconds = time.time() - start
+    else:
+        db = MySQLdb.connect(host=args.host, port=args.port, user=args.user, passwd=args.password, db=args.db, local_infile=1)
+        cursor = db.cursor()
+        # LOAD DATA INFILE can only load files whose columns are all in their table
+        files = [f for f in files if set(header(f)).issubset(table_columns(cursor, table(f)))]
+        start = time.time()
+        for f in files:
+            load_csv_file(db, cursor, f)
+        seconds = time.time() - start
+    db.close()
+    rows = sum(sum(1 for line in open(f)) - 1 for f in files)
+    return rows, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def create_database(args):
+    db = oursql.connect(host=args.host, port=args.port, user=args.user, passwd=args.password)
+    cursor = db.cursor()
+    cursor.execute("DROP DATABASE IF EXISTS {db}".format(db=args.db), plain_query=True)
+    cursor.execute("CREATE DATABASE {db}".format(db=args.db), plain_query=True)
+    cursor.execute("USE {db}".format(db=args.db), plain_query=True)
+    for statement in schema_statements(open(args.schema).read()):
+        cursor.execute(statement, plain_query=True)
+    db.close()
+
+def schema_statements(schema):
+    return [s for s in re.sub(r'\s*--.*|\n\s*\n', '', schema).split(';') if not re.match(r'^\s*$', s)]
+
+def table(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def header(filename):
+    with open(filename) as f:
+        return f.readline().rstrip().split(',')
+
+def table_columns(cursor, table):
+    cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+    return set(row[0] for row in cursor.fetchall())
+
+if __name__ == '__main__':
+    main()
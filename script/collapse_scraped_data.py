@@ -1,17 +1,72 @@
 #!/usr/bin/env python
 from pharmgkb import pipelines
+import dcsv
 
 import argparse
 import fileinput
+import multiprocessing
+import os.path
 import sys
+import time
 
 def main():
-    parser = argparse.ArgumentParser(description="post-process a .csv file generated by scrapy, collapsing rows that would otherwise cause duplicate primary keys")
-    parser.add_argument('--output', '-o', type=argparse.FileType('w'), default=sys.stdout)
-    parser.add_argument('file')
+    parser = argparse.ArgumentParser(description="post-process .csv files generated by scrapy, collapsing rows that would otherwise cause duplicate primary keys")
+    parser.add_argument('--output', '-o', type=argparse.FileType('w'),
+            help="write the collapsed FILE to OUTPUT (default: stdout; only for a single FILE)")
+    parser.add_argument('--output-dir', '-d',
+            help="write each collapsed FILE to OUTPUT_DIR/<basename of FILE> (in the same format, csv or dcsv), reporting the time taken for each to stderr")
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+            help="with --output-dir, collapse up to JOBS files at a time in worker processes (default: the number of cpus)")
+    parser.add_argument('files', metavar='file', nargs='+')
     args = parser.parse_args()
 
-    pipelines.collapse_by_key(args.file, args.output, separator=". ")
+    if args.output_dir is None:
+        if len(args.files) != 1:
+            parser.error("use --output-dir to collapse more than one file")
+        pipelines.collapse_by_key(args.files[0], args.output or sys.stdout, separator=". ")
+        return
+    if args.output is not None:
+        parser.error("--output and --output-dir are mutually exclusive")
+
+    collapse_files(args.files, args.output_dir, jobs=args.jobs)
+
+def collapse_files(files, output_dir, jobs=1, log=sys.stderr):
+    """
+    Collapse each of files into output_dir/<basename of file>, up to jobs at a time in worker
+    processes, and write the time taken for each to log.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    outputs = [os.path.join(output_dir, os.path.basename(f)) for f in files]
+    start = time.time()
+    if jobs <= 1 or len(files) <= 1:
+        for input_file, seconds in (collapse_file(f, o) for f, o in zip(files, outputs)):
+            print >>log, "{input_file}: {seconds:.2f}s".format(**locals())
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(files)))
+        try:
+            for input_file, seconds in pool.imap_unordered(_collapse_file, zip(files, outputs)):
+                print >>log, "{input_file}: {seconds:.2f}s".format(**locals())
+            pool.close()
+        except:
+            # don't leave the other workers collapsing files after one of them fails
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    print >>log, "total: {seconds:.2f}s".format(seconds=time.time() - start)
+
+def collapse_file(input_file, output_file):
+    """
+    Collapse input_file into output_file, returning (input_file, seconds taken).
+    """
+    start = time.time()
+    with open(output_file, 'wb') as output:
+        pipelines.collapse_by_key(input_file, output, separator=". ", dcsv_output=dcsv.is_dcsv(output_file))
+    return input_file, time.time() - start
+
+def _collapse_file(input_output):
+    return collapse_file(*input_output)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+from pharmgkb import items
+
+import argparse
+import csv
+import itertools
+import os
+import os.path
+import random
+
+# CYP2D6's haplotype table on PharmGKB
+CYP2D6_HAPLOTYPES = 133
+CYP2D6_SNPS = 151
+
+TABLES = ['drug_recommendation', 'gene_haplotype_variant', 'genotype_phenotype', 'genotype_drug_recommendation']
+
+PHENOTYPES = [
+    ('Ultrarapid metabolizer', 'An individual carrying more than two copies of functional alleles'),
+    ('Extensive metabolizer', 'An individual carrying two functional alleles'),
+    ('Intermediate metabolizer', 'An individual carrying one reduced and one non-functional allele'),
+    ('Poor metabolizer', 'An individual carrying only non-functional alleles'),
+]
+
+CLASSIFICATIONS = ['Strong', 'Moderate', 'Optional']
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic PharmGKB reference data (one <table>.csv per table in OUTPUT_DIR, in the format output by the scrapy pipeline).  Each gene has as many haplotypes and snps as CYP2D6 by default; use --genes to scale the data up by orders of magnitude.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--genes', type=int, default=1)
+    parser.add_argument('--haplotypes', type=int, default=CYP2D6_HAPLOTYPES, help="haplotypes per gene")
+    parser.add_argument('--snps', type=int, default=CYP2D6_SNPS, help="snps per gene")
+    parser.add_argument('--drugs', type=int, default=1, help="drugs with recommendations per gene")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.output_dir, genes=args.genes, haplotypes=args.haplotypes, snps=args.snps, drugs=args.drugs, seed=args.seed)
+
+def generate(output_dir, genes=1, haplotypes=CYP2D6_HAPLOTYPES, snps=CYP2D6_SNPS, drugs=1, seed=0):
+    """
+    Write drug_recommendation.csv, gene_haplotype_variant.csv, genotype_phenotype.csv and
+    genotype_drug_recommendation.csv into output_dir, and return the number of rows written to each.
+    table -> rows
+
+    Every genotype (pair of haplotypes, in sorted order) of a gene has a phenotype, and a drug
+    recommendation for each of the gene's drugs.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    rand = random.Random(seed)
+    files = dict((t, open(os.path.join(output_dir, t + '.csv'), 'wb')) for t in TABLES)
+    writers = dict((t, csv.DictWriter(files[t], fields(t), lineterminator='\n')) for t in TABLES)
+    counts = dict((t, 0) for t in TABLES)
+    def write(t, row):
+        writers[t].writerow(row)
+        counts[t] += 1
+    for w in writers.values():
+        w.writeheader()
+
+    for g in xrange(genes):
+        gene_name = 'GENE{g}'.format(g=g)
+        snp_ids = ['rs{id}'.format(id=g * snps + s + 1) for s in xrange(snps)]
+        haplotype_names = sorted('*{h}'.format(h=h + 1) for h in xrange(haplotypes))
+        reference = [rand.choice('ACGT') for snp_id in snp_ids]
+        for haplotype_name in haplotype_names:
+            for snp_id, allele in zip(snp_ids, reference):
+                # haplotypes differ from the reference at roughly 1 in 10 snps
+                if rand.random() < 0.1:
+                    allele = rand.choice('ACGT')
+                write('gene_haplotype_variant', {
+                    'gene_name': gene_name,
+                    'haplotype_name': haplotype_name,
+                    'snp_id': snp_id,
+                    'allele': allele,
+                })
+        drug_names = ['drug{g}_{d}'.format(g=g, d=d) for d in xrange(drugs)]
+        for haplotype_name1, haplotype_name2 in itertools.combinations_with_replacement(haplotype_names, 2):
+            phenotype_name, genotype = rand.choice(PHENOTYPES)
+            genotype_key = {
+                'gene_name': gene_name,
+                'haplotype_name1': haplotype_name1,
+                'haplotype_name2': haplotype_name2,
+            }
+            write('genotype_phenotype', dict(genotype_key,
+                phenotype_name=phenotype_name,
+                phenotype_genotype='{phenotype_name} ({genotype})'.format(**locals())))
+            for drug_name in drug_names:
+                write('drug_recommendation', dict(genotype_key,
+                    drug_name=drug_name,
+                    implications='{phenotype_name}: altered metabolism of {drug_name}, which may affect efficacy'.format(**locals()),
+                    recommendation='Consider an alternative to {drug_name}, or adjust the dose of {drug_name}'.format(**locals()),
+                    classification=rand.choice(CLASSIFICATIONS),
+                    diplotype_egs='{haplotype_name1}/{haplotype_name2}'.format(**locals())))
+                write('genotype_drug_recommendation', dict(genotype_key, drug_name=drug_name))
+
+    for f in files.values():
+        f.close()
+    return counts
+
+def fields(table):
+    """
+    Return the csv columns for table (the fields of its pharmgkb.items class), primary key first.
+    """
+    item_class = getattr(items, table)
+    return sorted(item_class.primary_key) + sorted(f for f in item_class.fields.keys() if f not in item_class.primary_key)
+
+if __name__ == '__main__':
+    main()
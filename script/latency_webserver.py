@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+import BaseHTTPServer
+import SocketServer
+import argparse
+import collections
+import random
+import re
+import threading
+import time
+
+# (url regex, latency in seconds, concurrent requests served without slowing down), resembling
+# pharmgkb: slow gene pages, and fast ajaxGuidelinePickerData.action and alleleGuidelines.action
+# responses
+DEFAULT_ENDPOINTS = [
+    (r'/gene/PA\d+', 0.3, 1),
+    (r'/views/ajaxGuidelinePickerData\.action', 0.1, 2),
+    (r'/views/alleleGuidelines\.action', 0.05, 4),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Start a stand-in for the pharmgkb web server with programmable latency, for testing how the crawl paces its requests (see pharmgkb.middlewares.EndpointThrottleMiddleware).  Each endpoint answers in LATENCY seconds while serving at most CAPACITY requests at once; past that, requests queue up (latency grows with the number in flight), and past --overload times CAPACITY they're answered with 503 Service Unavailable.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--port', '-p', type=int, default=8011)
+    parser.add_argument('--endpoint', nargs=3, action='append', metavar=('REGEX', 'LATENCY', 'CAPACITY'),
+            help="an endpoint (may be given more than once; default: {endpoints})".format(endpoints=DEFAULT_ENDPOINTS))
+    parser.add_argument('--overload', type=float, default=2.)
+    parser.add_argument('--error-rate', type=float, default=0.,
+            help="fraction of (otherwise successful) requests to answer with 500 Internal Server Error")
+    args = parser.parse_args()
+
+    endpoints = DEFAULT_ENDPOINTS if args.endpoint is None else \
+        [(regex, float(latency), int(capacity)) for regex, latency, capacity in args.endpoint]
+    httpd = start_webserver(args.port, endpoints, overload=args.overload, error_rate=args.error_rate)
+    print "serving {n} endpoints on port {port}".format(n=len(endpoints), port=args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for endpoint in httpd.endpoints:
+        print endpoint.summary()
+
+class Endpoint(object):
+    def __init__(self, regex, latency, capacity, overload=2., error_rate=0., rand=None):
+        self.regex = re.compile(regex)
+        self.latency = latency
+        self.capacity = capacity
+        self.overload = overload
+        self.error_rate = error_rate
+        self.rand = random.Random() if rand is None else rand
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # status -> number of responses
+        self.responses = collections.Counter()
+
+    def serve(self):
+        """
+        Wait the latency of a request arriving now, and return its response status.
+        """
+        with self.lock:
+            self.in_flight += 1
+            in_flight = self.in_flight
+            error = self.rand.random() < self.error_rate
+        try:
+            if in_flight > self.overload * self.capacity:
+                status = 503
+            else:
+                time.sleep(self.latency * max(1., float(in_flight) / self.capacity))
+                status = 500 if error else 200
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.responses[status] += 1
+        return status
+
+    def summary(self):
+        return "{regex}: {responses}".format(regex=self.regex.pattern, responses=dict(self.responses))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep connections alive (like pharmgkb), since scrapy reuses them
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        self.respond()
+
+    def respond(self):
+        endpoint = next((e for e in self.server.endpoints if e.regex.search(self.path)), None)
+        status = 404 if endpoint is None else endpoint.serve()
+        body = "<html><body>{path}</body></html>".format(path=self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+def start_webserver(port, endpoints, overload=2., error_rate=0.):
+    """
+    Return a (not yet serving) server for endpoints, a list of (url regex, latency, capacity).
+    """
+    httpd = ThreadingHTTPServer(("", port), Handler)
+    httpd.endpoints = [Endpoint(regex, latency, capacity, overload=overload, error_rate=error_rate)
+                       for regex, latency, capacity in endpoints]
+    return httpd
+
+if __name__ == '__main__':
+    main()
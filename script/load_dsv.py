@@ -10,14 +10,24 @@ import textwrap
 import collections
 import csv
 import itertools
+import sys
+import threading
+import marshal
+import hashlib
+import Queue
+import multiprocessing.pool
 
 import argparse
 import argparsers
+import spill
+import bulkload
+import dcsv
 
 def main():
     description = """
         Given a list of dsv files, insert the files into their respective tables (files are named 
-        <table_name>.<extension>), maintaining foreign key constraints. 
+        <table_name>.<extension>), maintaining foreign key constraints.  Files named 
+        <table_name>.dcsv are read as dictionary-encoded dcsv files (see src/python/dcsv.py).
         
         For auto_increment tables T referenced by other tables R_i, we require a set of keys K_i in 
         both T and R_i that can be used to resolve generated ids from T to use in R_i.
@@ -49,21 +59,60 @@ def main():
     """
     parser = argparsers.sql_parser(description=textwrap.dedent(description), formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('files', nargs='+')
-    parser.add_argument('--map', nargs='*')
+    parser.add_argument('--map', nargs='*',
+            help="mappings \"R: x_1, ..., x_n => T\" through which R references the auto_increment table T; (x_1, ..., x_n) must identify the rows of T's file uniquely, or the load fails")
     parser.add_argument('--ignore', nargs='*')
     parser.add_argument('--delim', default=",")
+    parser.add_argument('--batch-size', type=int, 
+            help="insert rows into auto_increment tables BATCH_SIZE rows at a time using multi-row INSERT's (default: one INSERT per row)")
+    parser.add_argument('--max-fk-ids', type=int, 
+            help="keep at most MAX_FK_IDS resolved auto_increment ids in memory, spilling the rest to a temporary on-disk database (default: keep them all in memory)")
+    parser.add_argument('--load-data', action='store_true', 
+            help="LOAD DATA LOCAL INFILE each file into a staging table, and resolve --map references with INSERT ... SELECT joins between staging tables")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+            help="load up to JOBS tables at a time (each over its own connection), once the tables they depend on have been loaded")
+    parser.add_argument('--commit-every', type=int, 
+            help="commit after every COMMIT_EVERY rows inserted (default: don't explicitly commit)")
+    parser.add_argument('--checkpoint', metavar='NAME',
+            help="record the rows committed from each file (and the auto_increment ids they were assigned) under NAME in the load_dsv_checkpoint tables, in the same transaction as the rows themselves, and skip rows already recorded there (i.e. resume a previous load that failed part way through); the checkpoint is removed once all files are loaded, and is refused when resuming with different files, --map or --ignore options")
+    parser.add_argument('--delta', action='store_true', 
+            help="only insert, update and delete the rows that differ from those loaded by a previous --delta load, identifying rows of auto_increment tables by the primary_key of their pharmgkb.items class, and rows of other tables by their primary key (digests of loaded rows are kept in the load_dsv_digest table; the first --delta load of a table loaded some other way records digests for its existing rows)")
+    parser.add_argument('--bulk', action='store_true', 
+            help="turn off unique and foreign key checks, and secondary index maintenance, while loading; rebuild indexes and validate foreign keys once all files are loaded")
     args = parser.parse_args()
     
-    db = oursql.connect(
+    def connect():
+        db = oursql.connect(
             host=args.host,
             port=args.port,
             user=args.user,
             passwd=args.password,
-            db=args.db)
+            db=args.db,
+            local_infile=args.load_data)
+        if args.bulk:
+            bulkload.suspend_checks(db)
+        return db
 
-    load_dsv(db, args.files, args.map, args.ignore, args.delim)
+    def load(db):
+        load_dsv(db, args.files, args.map, args.ignore, args.delim, 
+                batch_size=args.batch_size, 
+                max_fk_ids=args.max_fk_ids, 
+                load_data=args.load_data,
+                jobs=args.jobs,
+                connect=connect,
+                commit_every=args.commit_every,
+                checkpoint_name=args.checkpoint,
+                delta=args.delta)
 
-def load_dsv(db, files, mapping_strings=[], ignore_strings=[], delim=","):
+    db = connect()
+    if args.bulk:
+        tables = [os.path.splitext(os.path.basename(f))[0] for f in args.files]
+        with bulkload.bulk_session(db, tables):
+            load(db)
+    else:
+        load(db)
+
+def load_dsv(db, files, mapping_strings=[], ignore_strings=[], delim=",", batch_size=None, max_fk_ids=None, load_data=False, jobs=1, connect=None, commit_every=None, checkpoint_name=None, delta=False):
     metadata = table_metadata(db)
 
     tables = [os.path.splitext(os.path.basename(f))[0] for f in files]
@@ -99,58 +148,813 @@ def load_dsv(db, files, mapping_strings=[], ignore_strings=[], delim=","):
         columns = m['columns']
         refs[T].append( (R, tuple(columns)) ) 
         fks[R].append( (T, tuple(columns)) )
-    # a mapping from a referencing table, an auto_increment table it references, and field values through which the referencing happened, to an auto_increment value in T.
-    # R, T, [v1, ..., vn] -> T.id
-    fk_id = {}
 
     # (R, X) -> Bool
     ignore_field = collections.defaultdict(lambda: False)
     for s in ignore_strings:
         ignore_field[tuple(parse(ignore, s))] = True
 
-    def rows_for_insert(file):
-        with csv_reader(file, delim=delim) as input:
-            unignored = [f for f in input.fieldnames if not ignore_field[(t, f)]]
-            foreign_keys = [T + "_id" for T, t_fields in fks[t]]
-            header = unignored + foreign_keys 
-            # the first row is the header
-            yield header 
+    # a mapping from a table to the tables (being loaded) that must be loaded before it, either because 
+    # it has a foreign key referencing them, or because it resolves auto_increment ids from them.
+    # t -> set([T1, ..., Tn])
+    dependencies = dict((t, 
+        set(T for T in metadata[t]['references'].union(T for T, columns in fks[t]) if T in table_to_file and T != t))
+        for t in tables)
+
+    if delta and (load_data or checkpoint_name is not None):
+        raise RuntimeError("delta loads can't be combined with LOAD DATA INFILE or checkpoints")
+
+    if load_data:
+        if any(dcsv.is_dcsv(f) for f in files):
+            raise RuntimeError("LOAD DATA INFILE can't load dcsv files")
+        if checkpoint_name is not None:
+            # the staging tables needed to resolve ids are dropped when a load fails
+            raise RuntimeError("checkpoints aren't supported when loading files with LOAD DATA INFILE")
+        def load_table(db, t, file):
+            load_staged_table(db.cursor(), metadata, t, file, refs, fks, ignore_field, delim=delim)
+        try:
+            load_in_order(db, tables, files, dependencies, load_table, jobs=jobs, connect=connect)
+        finally:
+            drop_staging_tables(db.cursor(), tables)
+        return
+
+    # a mapping from a referencing table, an auto_increment table it references, and field values through which the referencing happened, to an auto_increment value in T.
+    # R, T, [v1, ..., vn] -> T.id
+    # (kept in memory until it grows past max_fk_ids entries, then spilled to disk)
+    fk_id = spill.SpillDict(max_memory_items=max_fk_ids)
+
+    checkpoint = None
+    if checkpoint_name is not None:
+        checkpoint = Checkpoint(db, checkpoint_name, checkpoint_inputs(files, mapping_strings, ignore_strings))
+        for key, T_id in checkpoint.fk_ids(db.cursor()):
+            fk_id[key] = T_id
+
+    def record_fk_id(R, T, columns, values, T_id):
+        """
+        Record that the values of columns in R resolve to T_id, ensuring (like check_unique_mapping 
+        when loading with LOAD DATA INFILE) that they identify rows of T uniquely.
+        """
+        key = (R, T, values)
+        if key in fk_id:
+            raise RuntimeError("mapping column values ({values}) occur more than once in the mapping {R}: {columns} => {T}".format(
+                values=comma_join(values), R=R, T=T, columns=comma_join(columns)))
+        fk_id[key] = T_id
+        return key
+
+    def rows_for_insert(t, input):
+        """
+        Return the columns to insert into t, and a generator over (row, values) pairs for each row 
+        read from input (where values are the values to insert for those columns).
+        """
+        unignored = [f for f in input.fieldnames if not ignore_field[(t, f)]]
+        foreign_keys = [T + "_id" for T, t_fields in fks[t]]
+        header = unignored + foreign_keys 
+        def rows():
             for row in input:
                 fk_ids = [fk_id[(t, T, tuple(row[f] for f in t_fields))] for T, t_fields in fks[t]]
-                yield [row[f] for f in unignored] + fk_ids
-
-    cursor = db.cursor()
-    for t, file in zip(tables, files):
-        insertion_input = rows_for_insert(file)
-        header = insertion_input.next()
-        if 'auto_increment_field' in metadata[t]:
-            ids = [id for id in insert_rows_with_ids(cursor, t, header, insertion_input)]
+                yield row, [row[f] for f in unignored] + fk_ids
+        return header, rows()
+
+    def load_table(db, t, file):
+        if checkpoint is not None and checkpoint.is_done(file):
+            return
+        cursor = db.cursor()
+        # with a checkpoint, each chunk's rows are committed in the same transaction as its record in 
+        # the checkpoint (the whole file is one chunk without commit_every)
+        transaction = commit_every is not None or checkpoint is not None
+        if transaction:
+            # restored afterwards, since db may be the caller's connection
+            cursor.execute("SELECT @@autocommit")
+            autocommit = cursor.fetchone()[0]
+            _execute_plain(cursor, "SET autocommit = 0")
+        try:
+            committed = checkpoint.committed_rows(file) if checkpoint is not None else 0
+            with csv_reader(file, delim=delim) as input:
+                # skip rows committed by a previous load
+                for row in itertools.islice(input, committed):
+                    pass
+                header, rows = rows_for_insert(t, input)
+                for chunk in (_batches(rows, commit_every) if commit_every is not None else [rows]):
+                    # the number of rows in this chunk
+                    inserted = [0]
+                    def values_of(rows):
+                        for row, values in rows:
+                            inserted[0] += 1
+                            yield values
+                    # the fk_id entries added by this chunk
+                    chunk_fk_ids = []
+                    if 'auto_increment_field' in metadata[t]:
+                        # record the keys through which t is referenced as each row is inserted, so that 
+                        # file is only read once (tee only buffers the rows of the current batch)
+                        chunk, insertion_rows = itertools.tee(chunk)
+                        ids = insert_rows_with_ids(cursor, t, header, values_of(insertion_rows), batch_size=batch_size)
+                        for (row, values), T_id in itertools.izip(chunk, ids):
+                            for R, columns in refs[t]:
+                                key = record_fk_id(R, t, columns, tuple(row[c] for c in columns), T_id)
+                                if checkpoint is not None:
+                                    chunk_fk_ids.append((key, T_id))
+                    else:
+                        insert_rows(cursor, t, header, values_of(chunk))
+                    committed += inserted[0]
+                    if checkpoint is not None:
+                        checkpoint.record(cursor, file, committed, chunk_fk_ids)
+                    if transaction:
+                        db.commit()
+            if checkpoint is not None:
+                checkpoint.record(cursor, file, committed, [], done=True)
+                db.commit()
+        except:
+            if transaction:
+                # turning autocommit back on would commit the rows inserted since the last commit
+                db.rollback()
+            raise
+        finally:
+            if transaction:
+                _execute_plain(cursor, "SET autocommit = {autocommit}".format(autocommit=int(autocommit)))
+
+    # the rows of each table that are no longer in its file, deleted once all tables are loaded.
+    # t -> (key_columns, [ (row_key, row_id) ])
+    deleted_rows = {}
+
+    def load_table_delta(db, t, file):
+        """
+        Compare each row of file to the digest recorded for it when it was last loaded, and only 
+        insert new rows and update changed rows.  Rows of auto_increment tables are identified by 
+        the primary_key of t's pharmgkb.items class, and keep their ids when updated; rows of other 
+        tables are identified by t's primary key (or all their columns, if it has none).
+
+        Recorded digests are looked up a batch of rows at a time, so besides the keys of the rows 
+        in file (spilled to disk past max_fk_ids of them), nothing is kept per row of t.
+        """
+        cursor = db.cursor()
+        auto_increment_field = metadata[t].get('auto_increment_field')
+        # the row_key's of file
+        seen = spill.SpillSet(max_memory_items=max_fk_ids)
+        seeds = None
+        try:
             with csv_reader(file, delim=delim) as input:
-                # re-read the input file, but this time we know the lastrowid's from each line inserted
-                for T_id, row in itertools.izip(ids, input):
+                header, rows = rows_for_insert(t, input)
+                if auto_increment_field is not None:
+                    key_fields = sorted(item_primary_key(t))
+                    key_columns = [auto_increment_field]
+                    def row_key_of(row, values):
+                        return _digest(tuple(row[f] for f in key_fields))
+                    def describe_key(row, values):
+                        return "({key_fields}) = ({key_values})".format(
+                            key_fields=comma_join(key_fields), key_values=comma_join(row[f] for f in key_fields))
+                else:
+                    key_columns = sorted(metadata[t]['primary_key'] or header)
+                    if not set(key_columns).issubset(header):
+                        raise RuntimeError("the primary key ({key_columns}) of {t} isn't loaded from {file}".format(
+                            key_columns=comma_join(key_columns), t=t, file=file))
+                    def row_key_of(row, values):
+                        return _digest_columns(header, values, key_columns)
+                    def describe_key(row, values):
+                        value = dict(zip(header, values))
+                        return "({key_columns}) = ({key_values})".format(
+                            key_columns=comma_join(key_columns), key_values=comma_join(value[c] for c in key_columns))
+                # ids of t's rows by the digest of their values, if t has rows that weren't loaded by 
+                # a delta load (rows of file with the same values take them over)
+                seeds = seed_digests(cursor, t, header, key_columns, auto_increment_field, max_memory_items=max_fk_ids)
+
+                def record(row, T_id):
                     for R, columns in refs[t]:
-                        fk_id[(R, t, tuple(row[c] for c in columns))] = T_id
-        else:
-            insert_rows(cursor, t, header, insertion_input)
+                        record_fk_id(R, t, columns, tuple(row[c] for c in columns), T_id)
+
+                for batch in _batches(rows, batch_size or 1000):
+                    keyed = []
+                    for row, values in batch:
+                        row_key = row_key_of(row, values)
+                        if row_key in seen:
+                            raise RuntimeError("duplicate key {key} in {file}".format(key=describe_key(row, values), file=file))
+                        seen.add(row_key)
+                        keyed.append((row, values, row_key, _digest_columns(header, values)))
+                    digests = recorded_digests(cursor, t, [row_key for row, values, row_key, row_digest in keyed])
+                    # [ (row_key, row_digest, row_id) ] to record
+                    changed = []
+                    # new rows: [ (row, values, row_key, row_digest) ]
+                    pending = []
+                    for row, values, row_key, row_digest in keyed:
+                        if row_key in digests:
+                            old_digest, T_id = digests[row_key]
+                            if old_digest != row_digest:
+                                if auto_increment_field is not None:
+                                    cursor.execute("UPDATE {t} SET {assignments} WHERE {id} = ?".format(
+                                        t=t, 
+                                        assignments=comma_join('{c} = ?'.format(c=c) for c in header),
+                                        id=auto_increment_field), values + [T_id])
+                                else:
+                                    value = dict(zip(header, values))
+                                    delete_row(cursor, t, key_columns, [value[c] for c in key_columns])
+                                    insert_rows(cursor, t, header, [values])
+                                changed.append((row_key, row_digest, T_id))
+                        else:
+                            T_id = seeds.claim(row_digest) if seeds is not None else None
+                            if T_id is None:
+                                pending.append((row, values, row_key, row_digest))
+                                continue
+                            changed.append((row_key, row_digest, T_id))
+                        record(row, T_id)
+                    if pending != []:
+                        if auto_increment_field is not None:
+                            ids = list(insert_rows_with_ids(cursor, t, header, [values for row, values, row_key, row_digest in pending], batch_size=batch_size))
+                        else:
+                            insert_rows(cursor, t, header, [values for row, values, row_key, row_digest in pending])
+                            ids = [None for p in pending]
+                        for (row, values, row_key, row_digest), T_id in itertools.izip(pending, ids):
+                            record(row, T_id)
+                            changed.append((row_key, row_digest, T_id))
+                    record_digests(cursor, t, changed)
+
+            stale = [(row_key, T_id) for row_key, T_id in all_digests(cursor, t) if row_key not in seen]
+            if seeds is not None:
+                # rows no row of file took over
+                stale.extend((None, T_id) for T_id in unrecorded_ids(cursor, t, auto_increment_field))
+            deleted_rows[t] = (key_columns, stale)
+        finally:
+            seen.close()
+            if seeds is not None:
+                seeds.close()
+
+    if delta:
+        create_digest_table(db.cursor())
+        load_table = load_table_delta
+
+    try:
+        load_in_order(db, tables, files, dependencies, load_table, jobs=jobs, connect=connect)
+        if delta:
+            # delete rows that are referenced before the rows they reference
+            cursor = db.cursor()
+            for t in reversed(load_order(tables, dependencies)):
+                key_columns, stale = deleted_rows[t]
+                if 'auto_increment_field' in metadata[t]:
+                    for row_key, T_id in stale:
+                        cursor.execute("DELETE FROM {t} WHERE {id} = ?".format(t=t, id=metadata[t]['auto_increment_field']), (T_id,))
+                else:
+                    for key_values in stale_key_values(cursor, t, key_columns, set(row_key for row_key, T_id in stale)):
+                        delete_row(cursor, t, key_columns, key_values)
+                for row_key, T_id in stale:
+                    if row_key is not None:
+                        cursor.execute("DELETE FROM load_dsv_digest WHERE table_name = ? AND row_key = ?", (t, row_key))
+        if checkpoint is not None:
+            checkpoint.remove(db)
+    finally:
+        fk_id.close()
+
+class Checkpoint(object):
+    """
+    A record (kept under name in the load_dsv_checkpoint tables of the database being loaded) of 
+    how many rows of each file have been committed, along with the fk_id entries assigned to those 
+    rows, so that a failed load_dsv can resume where it left off.
+
+    The record for a chunk of rows is written over the connection that inserted them, before 
+    committing, so the rows and their record are committed (or rolled back) together.
+
+    inputs (see checkpoint_inputs) describes the load; resuming a load with different inputs is 
+    refused, since the rows recorded as committed would no longer be the ones skipped.
+    """
+    def __init__(self, db, name, inputs):
+        self.name = name
+        cursor = db.cursor()
+        create_checkpoint_tables(cursor)
+        cursor.execute("SELECT inputs FROM load_dsv_checkpoint WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO load_dsv_checkpoint (name, inputs) VALUES (?, ?)", (name, marshal.dumps(inputs)))
+        elif marshal.loads(str(row[0])) != inputs:
+            db.rollback()
+            raise RuntimeError("the checkpoint {name} was recorded for a load of different files, or with different --map or --ignore options; remove it to start the load over".format(name=name))
+        # file digest -> (committed_rows, done), as of the start of the load
+        cursor.execute("SELECT file_digest, committed_rows, done FROM load_dsv_checkpoint_progress WHERE name = ?", (name,))
+        self.progress = dict((file_digest, (committed_rows, bool(done))) for file_digest, committed_rows, done in cursor.fetchall())
+        db.commit()
+
+    def _progress(self, file):
+        return self.progress.get(_digest(os.path.abspath(file)), (0, False))
+
+    def committed_rows(self, file):
+        return self._progress(file)[0]
 
-def _insert_query(table, header):
+    def is_done(self, file):
+        return self._progress(file)[1]
+
+    def fk_ids(self, cursor):
+        cursor.execute("SELECT k, id FROM load_dsv_checkpoint_fk_id WHERE name = ?", (self.name,))
+        return [(marshal.loads(str(k)), id) for k, id in cursor.fetchall()]
+
+    def record(self, cursor, file, committed_rows, fk_ids, done=False):
+        """
+        Record (without committing) that the first committed_rows rows of file have been inserted, 
+        and that they were assigned the fk_ids entries ( [(R, T, [v1, ..., vn]), T.id] ).
+        """
+        if fk_ids != []:
+            insert_rows(cursor, 'load_dsv_checkpoint_fk_id', ['name', 'k', 'id'],
+                    [(self.name, marshal.dumps(key), T_id) for key, T_id in fk_ids])
+        cursor.execute("""
+            INSERT INTO load_dsv_checkpoint_progress (name, file_digest, committed_rows, done) VALUES (?, ?, ?, ?)
+            ON DUPLICATE KEY UPDATE committed_rows = VALUES(committed_rows), done = VALUES(done)
+            """, (self.name, _digest(os.path.abspath(file)), committed_rows, int(done)))
+
+    def remove(self, db):
+        cursor = db.cursor()
+        for table in ['load_dsv_checkpoint_fk_id', 'load_dsv_checkpoint_progress', 'load_dsv_checkpoint']:
+            cursor.execute("DELETE FROM {table} WHERE name = ?".format(table=table), (self.name,))
+        db.commit()
+
+def create_checkpoint_tables(cursor):
+    # InnoDB, so that records are committed along with the rows they describe
+    _execute_plain(cursor, """
+        CREATE TABLE IF NOT EXISTS load_dsv_checkpoint (
+            name varchar(64),
+            inputs longblob,
+            primary key (name)
+        ) ENGINE=InnoDB""")
+    _execute_plain(cursor, """
+        CREATE TABLE IF NOT EXISTS load_dsv_checkpoint_progress (
+            name varchar(64),
+            file_digest char(40),
+            committed_rows bigint,
+            done tinyint,
+            primary key (name, file_digest)
+        ) ENGINE=InnoDB""")
+    _execute_plain(cursor, """
+        CREATE TABLE IF NOT EXISTS load_dsv_checkpoint_fk_id (
+            name varchar(64),
+            k blob,
+            id bigint,
+            index (name)
+        ) ENGINE=InnoDB""")
+
+def checkpoint_inputs(files, mapping_strings, ignore_strings):
+    """
+    Return a description of a load of files with the --map and --ignore options mapping_strings and 
+    ignore_strings, for checking that a Checkpoint is resumed by the same load.  Files may still be 
+    edited past their committed rows (e.g. to fix the row a load failed on) before resuming.
+    """
+    return ([os.path.abspath(f) for f in files], list(mapping_strings or []), sorted(ignore_strings or []))
+
+def item_primary_key(table):
+    """
+    Return the primary_key of the pharmgkb.items class for table.
+    """
+    from pharmgkb import items
+    item_class = getattr(items, table, None)
+    if item_class is None or not hasattr(item_class, 'primary_key'):
+        raise RuntimeError("no pharmgkb.items class with a primary_key exists for the table {table}".format(**locals()))
+    return item_class.primary_key
+
+def _digest(x):
+    return hashlib.sha1(repr(x)).hexdigest()
+
+def _normalized(value):
+    """
+    Return value as the str it was read as from a dsv file (MySQL returns numbers and unicode).
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def _digest_columns(header, values, columns=None):
+    """
+    Return a digest of the values of columns (default: all of header), given the values of the 
+    columns in header, that doesn't depend on their order or on whether they were read from a dsv 
+    file or from MySQL.
+    """
+    value = dict(zip(header, values))
+    return _digest(tuple((c, _normalized(value[c])) for c in sorted(columns if columns is not None else header)))
+
+def create_digest_table(cursor):
+    _execute_plain(cursor, """
+        CREATE TABLE IF NOT EXISTS load_dsv_digest (
+            table_name varchar(64),
+            row_key char(40),
+            row_digest char(40),
+            row_id bigint,
+            index (table_name, row_id),
+            primary key (table_name, row_key)
+        )""")
+
+def recorded_digests(cursor, table, row_keys):
+    """
+    Return the digests recorded for the rows of table with the given row_keys by previous delta 
+    loads.
+    row_key -> (row_digest, row_id)
+    """
+    if row_keys == []:
+        return {}
+    cursor.execute("SELECT row_key, row_digest, row_id FROM load_dsv_digest WHERE table_name = ? AND row_key IN ({qmarks})".format(
+        qmarks=comma_join(len(row_keys)*['?'])), [table] + row_keys)
+    return dict((str(row_key), (str(row_digest), row_id)) for row_key, row_digest, row_id in cursor)
+
+def all_digests(cursor, table, page_size=10000):
+    """
+    Generate (row_key, row_id) for each row of table recorded by previous delta loads, page_size at 
+    a time.
+    """
+    last_key = ''
+    while True:
+        cursor.execute("SELECT row_key, row_id FROM load_dsv_digest WHERE table_name = ? AND row_key > ? ORDER BY row_key LIMIT ?", 
+                (table, last_key, page_size))
+        page = cursor.fetchall()
+        for row_key, row_id in page:
+            yield str(row_key), row_id
+        if len(page) < page_size:
+            return
+        last_key = page[-1][0]
+
+def record_digests(cursor, table, digests):
+    """
+    Record the digests ( [(row_key, row_digest, row_id)] ) of rows loaded into table.
+    """
+    if digests == []:
+        return
+    cursor.executemany("REPLACE INTO load_dsv_digest (table_name, row_key, row_digest, row_id) VALUES (?, ?, ?, ?)",
+        [(table, row_key, row_digest, row_id) for row_key, row_digest, row_id in digests])
+
+def seed_digests(cursor, table, header, key_columns, auto_increment_field, page_size=10000, max_memory_items=None):
+    """
+    If table has rows but no recorded digests (i.e. it was loaded without --delta), record digests 
+    for its rows, so that a delta load only changes the rows that differ from its file.
+
+    The row_key's of an auto_increment table come from fields of its file that it may not have, so 
+    for those, return the ids of its rows by the digest of their values instead (a SeedIds, spilled 
+    past max_memory_items), for rows of the file with the same values to take over.  Return None 
+    otherwise.
+    """
+    cursor.execute("SELECT 1 FROM load_dsv_digest WHERE table_name = ? LIMIT 1", (table,))
+    if cursor.fetchall() != []:
+        return None
+    cursor.execute("SELECT 1 FROM {table} LIMIT 1".format(**locals()))
+    if cursor.fetchall() == []:
+        return None
+    if auto_increment_field is None:
+        for page in _select_pages(cursor, "SELECT {columns_str} FROM {table} ORDER BY {order_str}".format(
+                columns_str=comma_join(header), table=table, order_str=comma_join(key_columns)), page_size=page_size):
+            record_digests(cursor, table, [(_digest_columns(header, values, key_columns), _digest_columns(header, values), None) for values in page])
+        return None
+    seeds = SeedIds(max_memory_items=max_memory_items)
+    for page in _select_pages(cursor, "SELECT {id}, {columns_str} FROM {table} ORDER BY {id}".format(
+            id=auto_increment_field, columns_str=comma_join(header), table=table), page_size=page_size):
+        for row in page:
+            seeds.add(_digest_columns(header, row[1:]), row[0])
+    return seeds
+
+class SeedIds(object):
+    """
+    The ids of an auto_increment table's rows by the digest of their values (see seed_digests), 
+    holding at most max_memory_items entries of each kind in memory.
+
+    Many rows can share a digest, so rather than a list of ids per digest (copied, or rewritten on 
+    disk, on every add and claim), each id is its own (row_digest, n) -> id entry, and only a count 
+    of the ids added and claimed is kept per digest.
+
+    >>> seeds = SeedIds(max_memory_items=2)
+    >>> for row_digest, row_id in [('a', 1), ('b', 2), ('a', 3)]:
+    ...     seeds.add(row_digest, row_id)
+    >>> seeds.claim('a'), seeds.claim('a'), seeds.claim('a'), seeds.claim('b'), seeds.claim('c')
+    (1, 3, None, 2, None)
+    >>> seeds.close()
+    """
+    def __init__(self, max_memory_items=None):
+        # (row_digest, n) -> the n-th id added for row_digest
+        self.ids = spill.SpillDict(max_memory_items=max_memory_items)
+        # row_digest -> (ids added, ids claimed)
+        self.counts = spill.SpillDict(max_memory_items=max_memory_items)
+
+    def add(self, row_digest, row_id):
+        added, claimed = self.counts.get(row_digest, (0, 0))
+        self.ids[(row_digest, added)] = row_id
+        self.counts[row_digest] = (added + 1, claimed)
+
+    def claim(self, row_digest):
+        """
+        Return an id not yet claimed of a row whose values have row_digest (the first added first), 
+        or None if there are none left.
+        """
+        added, claimed = self.counts.get(row_digest, (0, 0))
+        if claimed == added:
+            return None
+        self.counts[row_digest] = (added, claimed + 1)
+        return self.ids[(row_digest, claimed)]
+
+    def close(self):
+        self.ids.close()
+        self.counts.close()
+
+def unrecorded_ids(cursor, table, auto_increment_field):
+    """
+    Return the ids of rows of an auto_increment table that have no recorded digest.
+    """
+    cursor.execute("""
+        SELECT t.{id} FROM {table} t 
+        LEFT JOIN load_dsv_digest d ON d.table_name = ? AND d.row_id = t.{id}
+        WHERE d.row_key IS NULL
+        """.format(id=auto_increment_field, table=table), (table,))
+    return [row_id for row_id, in cursor.fetchall()]
+
+def stale_key_values(cursor, table, key_columns, row_keys, page_size=10000):
+    """
+    Return the values of key_columns for the rows of table whose row_key (see load_table_delta) is 
+    in row_keys.
+    """
+    if len(row_keys) == 0:
+        return []
+    return [key_values 
+            for page in _select_pages(cursor, "SELECT {columns_str} FROM {table} ORDER BY {columns_str}".format(
+                columns_str=comma_join(key_columns), table=table), page_size=page_size)
+            for key_values in page 
+            if _digest_columns(key_columns, key_values) in row_keys]
+
+def _select_pages(cursor, query, params=[], page_size=10000):
+    """
+    Generate the rows of query (which must be ORDER'ed BY a unique key) in lists of page_size rows, 
+    each fetched before it's generated, so other statements can use cursor in between.
+    """
+    offset = 0
+    while True:
+        cursor.execute(query + " LIMIT ? OFFSET ?", list(params) + [page_size, offset])
+        page = cursor.fetchall()
+        if page != []:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+def delete_row(cursor, table, key_columns, key_values):
+    """
+    Delete the row of table whose key_columns (its primary key, or all its columns if it has none) 
+    have the values key_values.
+    """
+    cursor.execute("DELETE FROM {table} WHERE {conditions} LIMIT 1".format(
+        table=table,
+        conditions=' AND '.join('{c} <=> ?'.format(c=c) for c in key_columns)), list(key_values))
+
+def load_order(tables, dependencies):
+    """
+    Return tables in an order such that each table comes after the tables it depends on, otherwise 
+    keeping tables in the order given.
+
+    >>> load_order(['R', 'S', 'T'], {'R': set(['T']), 'S': set(), 'T': set()})
+    ['S', 'T', 'R']
+    """
+    order = []
+    loaded = set()
+    remaining = list(tables)
+    while remaining != []:
+        ready = [t for t in remaining if dependencies[t].issubset(loaded)]
+        if ready == []:
+            raise RuntimeError("cyclic dependencies between the tables {tables}".format(tables=comma_join(remaining)))
+        order.append(ready[0])
+        loaded.add(ready[0])
+        remaining.remove(ready[0])
+    return order
+
+def load_in_order(db, tables, files, dependencies, load_table, jobs=1, connect=None):
+    """
+    Call load_table(db, t, file) for each table t once all the tables it depends on have been 
+    loaded.
+
+    If jobs > 1, up to jobs tables with no dependencies between them are loaded at a time, each in 
+    its own thread using a connection returned by connect().
+    """
+    table_to_file = dict(zip(tables, files))
+    order = load_order(tables, dependencies)
+    if jobs <= 1:
+        for t in order:
+            load_table(db, t, table_to_file[t])
+        return
+
+    if connect is None:
+        raise RuntimeError("a connect function is needed to load tables in parallel")
+    connections = []
+    local = threading.local()
+    def load(t):
+        try:
+            if not hasattr(local, 'db'):
+                local.db = connect()
+                connections.append(local.db)
+            load_table(local.db, t, table_to_file[t])
+            # make t visible to the connections loading the tables that depend on it
+            local.db.commit()
+            return t, None
+        except Exception:
+            return t, sys.exc_info()
+
+    # tables finished loading (or failed to), in the order they finished
+    finished = Queue.Queue()
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        loaded = set()
+        started = set()
+        error = None
+        while len(loaded) < len(order):
+            if error is None:
+                for t in order:
+                    if t not in started and dependencies[t].issubset(loaded):
+                        started.add(t)
+                        pool.apply_async(load, (t,), callback=finished.put)
+            if len(started) == len(loaded):
+                break
+            t, exc_info = finished.get()
+            loaded.add(t)
+            if exc_info is not None and error is None:
+                # wait for the tables already being loaded, then re-raise
+                error = exc_info
+        if error is not None:
+            raise error[0], error[1], error[2]
+    finally:
+        pool.close()
+        pool.join()
+        for c in connections:
+            c.close()
+
+def load_staged_table(cursor, metadata, t, file, refs, fks, ignore_field, delim=","):
+    """
+    Load file into a staging table using LOAD DATA LOCAL INFILE, then copy it into the table t with 
+    a single INSERT ... SELECT, joining against the staging tables of the auto_increment tables it 
+    references to resolve their ids (so those must be loaded first).  The staging tables are 
+    removed by drop_staging_tables.
+
+    Rows of an auto_increment table T are assigned ids MAX(T.id) + 1, ..., MAX(T.id) + n in file 
+    order (so no other connection should insert into T while loading).  For a mapping 
+    R: x_1, ..., x_n => T, (x_1, ..., x_n) must identify the rows of T.dsv uniquely.
+    """
+    with csv_reader(file, delim=delim) as input:
+        fieldnames = input.fieldnames
+    staging = _staging_table(t)
+    _execute_plain(cursor, "DROP TABLE IF EXISTS {staging}".format(**locals()))
+    _execute_plain(cursor, """
+        CREATE TABLE {staging} (
+            load_dsv_line bigint not null auto_increment,
+            load_dsv_id bigint,
+            {columns_str},
+            {indexes_str}
+            primary key (load_dsv_line)
+        )""".format(
+            staging=staging,
+            columns_str=comma_join('{c} LONGTEXT'.format(c=c) for c in fieldnames),
+            # index the columns t is referenced through, to speed up the joins below
+            indexes_str=''.join('index ({prefixes}), '.format(prefixes=comma_join('{c}(64)'.format(c=c) for c in columns))
+                for columns in set(columns for R, columns in refs[t]))))
+    _execute_plain(cursor, """
+        LOAD DATA LOCAL INFILE {file} INTO TABLE {staging}
+        FIELDS TERMINATED BY {delim} OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+        LINES TERMINATED BY {eol}
+        IGNORE 1 LINES
+        ({columns_str})
+        """.format(
+            file=_sql_string(os.path.abspath(file)), 
+            staging=staging,
+            delim=_sql_string(delim),
+            eol=_sql_string(_line_terminator(file)),
+            columns_str=comma_join(fieldnames)))
+
+    for R, columns in refs[t]:
+        check_unique_mapping(cursor, staging, columns, extra_info=' in the mapping {R}: {columns} => {t}'.format(
+            R=R, t=t, columns=comma_join(columns)))
+    for T, columns in fks[t]:
+        check_resolved_mapping(cursor, staging, _staging_table(T), columns, extra_info=' in the mapping {t}: {columns} => {T}'.format(
+            T=T, t=t, columns=comma_join(columns)))
+
+    unignored = [f for f in fieldnames if not ignore_field[(t, f)]]
+    header = unignored + [T + "_id" for T, columns in fks[t]]
+    values = ['s.{f}'.format(f=f) for f in unignored] + ['{T}.load_dsv_id'.format(T=T) for T, columns in fks[t]]
+    if 'auto_increment_field' in metadata[t]:
+        cursor.execute("SELECT COALESCE(MAX({id}), 0) FROM {t}".format(id=metadata[t]['auto_increment_field'], t=t))
+        max_id = cursor.fetchone()[0]
+        cursor.execute("UPDATE {staging} SET load_dsv_id = load_dsv_line + ?".format(**locals()), (max_id,))
+        header.insert(0, metadata[t]['auto_increment_field'])
+        values.insert(0, 's.load_dsv_id')
+    cursor.execute("""
+        INSERT INTO {t} ({column_str}) 
+        SELECT {values_str} 
+        FROM {staging} s {joins_str}
+        ORDER BY s.load_dsv_line
+        """.format(
+            t=t,
+            column_str=comma_join(header),
+            values_str=comma_join(values),
+            staging=staging,
+            joins_str=' '.join(
+                'JOIN {T_staging} {T} ON {on}'.format(
+                    T_staging=_staging_table(T), 
+                    T=T,
+                    on=' AND '.join('s.{c} = {T}.{c}'.format(c=c, T=T) for c in columns))
+                for T, columns in fks[t])))
+
+def drop_staging_tables(cursor, tables):
+    for t in tables:
+        _execute_plain(cursor, "DROP TABLE IF EXISTS {staging}".format(staging=_staging_table(t)))
+
+def check_unique_mapping(cursor, staging, columns, extra_info=''):
+    """
+    Ensure that columns identify rows of the staging table uniquely.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM {staging} GROUP BY {columns_str} HAVING COUNT(*) > 1
+        ) duplicates
+        """.format(staging=staging, columns_str=comma_join(columns)))
+    duplicates = cursor.fetchone()[0]
+    if duplicates != 0:
+        raise RuntimeError("{duplicates} sets of mapping column values occur more than once".format(**locals()) + extra_info)
+
+def check_resolved_mapping(cursor, staging, T_staging, columns, extra_info=''):
+    """
+    Ensure that each row of the staging table references some row of the auto_increment table's 
+    staging table T_staging.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) 
+        FROM {staging} s LEFT JOIN {T_staging} T ON {on}
+        WHERE T.load_dsv_line IS NULL
+        """.format(
+            staging=staging, 
+            T_staging=T_staging, 
+            on=' AND '.join('s.{c} = T.{c}'.format(c=c) for c in columns)))
+    unresolved = cursor.fetchone()[0]
+    if unresolved != 0:
+        raise RuntimeError("{unresolved} rows reference mapping column values that aren't loaded".format(**locals()) + extra_info)
+
+def _staging_table(table):
+    return 'load_dsv_staging_{table}'.format(**locals())
+
+def _line_terminator(file):
+    with open(file, 'rb') as f:
+        return '\r\n' if f.readline().endswith('\r\n') else '\n'
+
+def _sql_string(s):
+    """
+    Quote s as a MySQL string literal.
+    """
+    return "'" + s.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def _execute_plain(cursor, query):
+    """
+    Execute a query that can't be run as a prepared statement (e.g. LOAD DATA LOCAL INFILE).
+    """
+    return cursor.execute(query, plain_query=True)
+
+def _insert_query(table, header, n=1):
+    """
+    Return an INSERT query for n rows of values for the columns in header.
+    """
     return """
-        INSERT INTO {table} ({column_str}) VALUES ({qmarks})
+        INSERT INTO {table} ({column_str}) VALUES {values}
     """.format(
         table=table,
         column_str=comma_join(header), 
-        qmarks=comma_join(len(header)*['?']))
+        values=comma_join(n*['({qmarks})'.format(qmarks=comma_join(len(header)*['?']))]))
+
+# The maximum number of placeholders MySQL allows in a prepared statement.
+_max_placeholders = 65535
 
 def insert_rows(cursor, table, header, rows):
     return cursor.executemany(_insert_query(table, header), rows)
 
-def insert_rows_with_ids(cursor, table, header, rows):
+def insert_rows_with_ids(cursor, table, header, rows, batch_size=None):
     """
-    Insert rows into table, and also return the lastrowid's of each inserted row
+    Insert rows into table, and also return the lastrowid's of each inserted row.
+
+    If batch_size is given, rows are inserted batch_size at a time using a multi-row INSERT.  MySQL 
+    generates consecutive auto_increment values for the rows of a single INSERT statement (provided 
+    no other connection is concurrently inserting into table when innodb_autoinc_lock_mode = 2), 
+    and lastrowid is the value generated for the first row of the batch, so the ids of the 
+    remaining rows are derived from it using @@auto_increment_increment.
     """
-    for row in rows:
-        cursor.execute(_insert_query(table, header), row)
-        yield cursor.lastrowid
+    if batch_size is None:
+        query = _insert_query(table, header)
+        for row in rows:
+            cursor.execute(query, row)
+            yield cursor.lastrowid
+        return
+
+    batch_size = max(1, min(batch_size, _max_placeholders / max(len(header), 1)))
+    cursor.execute("SELECT @@auto_increment_increment")
+    increment = cursor.fetchone()[0]
+    batch_query = _insert_query(table, header, batch_size)
+    for batch in _batches(rows, batch_size):
+        query = batch_query if len(batch) == batch_size else _insert_query(table, header, len(batch))
+        cursor.execute(query, list(itertools.chain.from_iterable(batch)))
+        first_id = cursor.lastrowid
+        for i in xrange(len(batch)):
+            yield first_id + i*increment
+
+def _batches(xs, n):
+    """
+    Split the iterable xs into lists of (at most) n elements.
+
+    >>> [b for b in _batches(xrange(5), 2)]
+    [[0, 1], [2, 3], [4]]
+    """
+    xs = iter(xs)
+    while True:
+        batch = list(itertools.islice(xs, n))
+        if batch == []:
+            return
+        yield batch
 
 def merge_dict(d1, d2):
     return dict(d1.items() + d2.items())
@@ -209,6 +1013,19 @@ def table_metadata(db):
             table['auto_increment_field'] = row['COLUMN_NAME']
         columns = get(table, 'columns', default=list)
         columns.append(row['COLUMN_NAME'])
+        primary_key = get(table, 'primary_key', default=list)
+        if row['COLUMN_KEY'] == 'PRI':
+            primary_key.append(row['COLUMN_NAME'])
+        get(table, 'references', default=set)
+    cursor.execute("""
+        SELECT TABLE_NAME, REFERENCED_TABLE_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND 
+              REFERENCED_TABLE_SCHEMA = DATABASE()
+    """)
+    for row in cursor:
+        # the tables this table references through foreign key constraints
+        tables[row['TABLE_NAME']]['references'].add(row['REFERENCED_TABLE_NAME'])
     return tables
 
 class csv_reader:
@@ -216,8 +1033,12 @@ class csv_reader:
         self.file = file
         self.delim = delim
     def __enter__(self):
-        self.input = fileinput.FileInput([self.file])
-        self.reader = csv.DictReader(self.input, delimiter=self.delim)
+        if dcsv.is_dcsv(self.file):
+            self.input = open(self.file, 'rb')
+            self.reader = dcsv.DictReader(self.input)
+        else:
+            self.input = fileinput.FileInput([self.file])
+            self.reader = csv.DictReader(self.input, delimiter=self.delim)
         return self.reader
     def __exit__(self, *args):
         self.input.close()
@@ -5,12 +5,15 @@ import re
 import os.path
 
 import argparsers
+import bulkload
 
 def main():
     parser = argparsers.sql_parser(description="Load .csv files output from the scrapy pipeline.  The expected format is:\n" +
             "column_name1,column_name2,...,column_namen\n" +
             "value1,value2,...,valuen\n")
     parser.add_argument('files', nargs='+')
+    parser.add_argument('--bulk', action='store_true', 
+            help="turn off unique and foreign key checks, and secondary index maintenance, while loading; rebuild indexes and validate foreign keys once all files are loaded")
     args = parser.parse_args()
     
     db = MySQLdb.connect(
@@ -21,11 +24,19 @@ def main():
             db=args.db)
     c = db.cursor()
 
-    for f in args.files:
-        load_csv_file(db, c, f)
+    if args.bulk:
+        with bulkload.bulk_session(db, [csv_table(f) for f in args.files]):
+            for f in args.files:
+                load_csv_file(db, c, f)
+    else:
+        for f in args.files:
+            load_csv_file(db, c, f)
+
+def csv_table(filename):
+    return re.search(r'(.*)\.[^.]+$', os.path.basename(filename)).group(1)
 
 def load_csv_file(db, cursor, filename):
-    table = re.search(r'(.*)\.[^.]+$', os.path.basename(filename)).group(1)
+    table = csv_table(filename)
     input = fileinput.input(filename)     
     header = input.next().rstrip().split(',')
     columns_str = ', '.join(header)
@@ -4,7 +4,19 @@ import fileinput
 import textwrap
 import csv
 import collections
-from itertools import izip, ifilter
+import heapq
+import multiprocessing
+import json
+import os
+import random
+import sys
+from itertools import izip, product
+
+# optional; used to encode the matrix and find greedy keys with vectorized operations
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def main():
     description = textwrap.dedent("""
@@ -26,7 +38,23 @@ def main():
     parser.add_argument('file', nargs='?')
     parser.add_argument('--delim', default='\t')
     parser.add_argument('--no-row-names', action='store_true')
+    parser.add_argument('--max-key-size', type=int, 
+            help="don't search for row keys with more than MAX_KEY_SIZE columns")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+            help="find the keys of up to JOBS rows at a time in worker processes")
+    parser.add_argument('--greedy', action='store_true', 
+            help="instead of searching for every minimal row key, greedily find one small row key per row (for matrices too large to search exhaustively)")
+    parser.add_argument('--cache', 
+            help="keep the matrix and its row keys in CACHE (a json file, e.g. one per gene), and if CACHE already exists, only search for the keys of rows that may have changed since it was written")
+    parser.add_argument('--panel', action='store_true', 
+            help="instead of row keys, output a small set of columns that together tell apart every pair of (distinct) rows, e.g. a tag-SNP panel")
+    parser.add_argument('--exact', action='store_true', 
+            help="with --panel, search for the smallest such set of columns (only feasible for small matrices)")
     args = parser.parse_args()
+    if args.cache is not None and args.greedy:
+        parser.error("--cache can't be used with --greedy")
+    if args.exact and not args.panel:
+        parser.error("--exact can only be used with --panel")
     
     input = fileinput.FileInput([args.file] if args.file is not None else [])
     reader = csv.reader(input, delimiter=args.delim)
@@ -43,75 +71,536 @@ def main():
             rows.append(r)
             i += 1
     input.close()
-    K = matrix_row_keys(column_names, row_names, rows)
+    if not args.no_row_names and rows != [] and len(column_names) == len(rows[0]) + 1:
+        # the header has a name for the row name column too (e.g. "Haplotype Name")
+        column_names = column_names[1:]
+    if args.panel:
+        panel, lower_bound = tag_columns(column_names, rows, exact=args.exact)
+        print >>sys.stderr, "{n} columns ({how}); at least {lower_bound} are needed".format(
+            n=len(panel), how='smallest' if args.exact else 'greedy', lower_bound=lower_bound)
+        for x in panel:
+            print x
+        return
+    cache = read_key_cache(args.cache) if args.cache is not None else None
+    if args.greedy:
+        K = greedy_row_keys(column_names, row_names, rows, jobs=args.jobs)
+    elif cache is not None and cache['column_names'] == column_names and cache['max_key_size'] == args.max_key_size:
+        K = update_row_keys(cache['keys'], column_names, cache['row_names'], cache['rows'], row_names, rows, 
+                max_key_size=args.max_key_size, jobs=args.jobs)
+    else:
+        K = matrix_row_keys(column_names, row_names, rows, max_key_size=args.max_key_size, jobs=args.jobs)
+    if args.cache is not None:
+        write_key_cache(args.cache, column_names, row_names, rows, args.max_key_size, K)
     for row_name in row_names:
         print row_name
         for key in K[row_name]:
             print '\t' + ', '.join("{x} = {v}".format(x=x, v=v) for x, v in key)
 
-def matrix_row_keys(column_names, row_names, rows):
-    X = dict((x, {}) for x in column_names)
-    for y, row in izip(row_names, rows):
-        for x, v in izip(column_names, row): 
-            if v not in X[x]:
-                X[x][v] = set()
-            X[x][v].add(y)
-
-    def intrsct(keys, X_y, key, remaining, R):
-        if len(R) == 1:
-            remove = None
-            for k in keys:
-                intr = k.intersection(key)
-                if len(intr) == len(key) == len(k):
-                    # key == k
-                    return
-                elif len(intr) == len(key):
-                    # key subsetof k
-                    remove = k
+def matrix_row_keys(column_names, row_names, rows, max_key_size=None, jobs=1, only=None):
+    """
+    Return the minimal row keys of each row (keys with more than max_key_size columns aren't 
+    searched for), searching for the keys of up to jobs rows at a time in worker processes.  If 
+    only is given, just return the keys of the rows it names.
+    y -> { { (x, v) } }
+
+    Row sets are represented as integer bitmasks over row indices, and keys as integer bitmasks 
+    over column indices.
+    """
+    codes, values = encode(rows, len(column_names))
+    matrix = {
+        'column_names': column_names,
+        'rows': rows,
+        'codes': codes,
+        'masks_by_code': value_masks(codes, values),
+        'max_key_size': max_key_size,
+    }
+    return _keys_by_row(_minimal_row_keys, matrix, row_names, jobs, only)
+
+def update_row_keys(K, column_names, old_row_names, old_rows, row_names, rows, max_key_size=None, jobs=1):
+    """
+    Given the keys K of a previous version of the matrix (K = matrix_row_keys(column_names, 
+    old_row_names, old_rows, max_key_size)), return the keys of the new version (i.e. 
+    matrix_row_keys(column_names, row_names, rows, max_key_size)), only searching for the keys of 
+    rows that may have changed.
+    y -> { { (x, v) } }
+
+    Rows are matched up between versions by name.  Besides added and changed rows, the keys of a 
+    row y are searched for again if:
+    - some added (or changed) row matches one of y's keys (which is no longer a key)
+    - some removed (or changed) row was the last row other than y matching the columns where the 
+      two of them agree (so that a subset of those columns is now a key)
+    The keys of all other rows are unchanged.
+    """
+    old = dict(izip(old_row_names, old_rows))
+    new = dict(izip(row_names, rows))
+    removed = [y for y in old_row_names if y not in new or new[y] != old[y]]
+    added = [y for y in row_names if y not in old or old[y] != new[y]]
+    search = set(added)
+
+    if removed != []:
+        old_codes, old_values = encode(old_rows, len(column_names))
+        old_masks = value_masks(old_codes, old_values)
+        old_index = dict((y, i) for i, y in enumerate(old_row_names))
+        survivors = ((1 << len(old_row_names)) - 1) & ~sum(1 << old_index[z] for z in removed)
+        for y in row_names:
+            if y in search:
+                continue
+            i = old_index[y]
+            for z in removed:
+                j = old_index[z]
+                A = survivors
+                for c in xrange(len(column_names)):
+                    if old_codes[i][c] == old_codes[j][c]:
+                        A &= old_masks[c][old_codes[i][c]]
+                if A == 1 << i:
+                    search.add(y)
                     break
-                elif len(intr) == len(k):
-                    # k subsetof key
-                    return
-                # else: disjoint (pass)
-            if remove is not None:
-                keys.remove(remove)
-            keys.add(frozenset(key))
-        elif len(R) == 0 or len(remaining) == 0:
-            pass
-        else:
-            examined = set()
-            for i in remaining:
-                examined.add(i)
-                intr = R.intersection(X_y[i][1])
-                if len(intr) < min(len(R), len(X_y[i][1])):
-                    intrsct(
-                        keys,
-                        X_y,
-                        key.union([i]),
-                        remaining.difference(examined),
-                        intr,
-                    )
-
-    # y -> { { (x, v) } }
-    K = {}
-    for y, row in izip(row_names, rows):
-        X_y = [ifilter(lambda (v, ys): y in ys, X[x].iteritems()).next() for x in column_names]
-        keys = set()
-        remaining = set(xrange(0, len(column_names)))
-        for i, (v, R) in enumerate(X_y):
-            intrsct(
-                keys,
-                X_y,
-                set([i]),
-                remaining.difference([i]),
-                R,
-            )
-            remaining.remove(i)
-        K[y] = set(
-            frozenset((column_names[i], X_y[i][0]) for i in k) for k in keys
-        )
 
+    if added != []:
+        column_index = dict((x, c) for c, x in enumerate(column_names))
+        def matches(row, key):
+            return all(row[column_index[x]] == v for x, v in key)
+        for y in row_names:
+            if y not in search and any(matches(new[w], key) for key in K[y] for w in added):
+                search.add(y)
+
+    new_K = dict((y, K[y]) for y in row_names if y not in search)
+    if search != set():
+        new_K.update(matrix_row_keys(column_names, row_names, rows, max_key_size=max_key_size, jobs=jobs, only=search))
+    return new_K
+
+def _minimal_row_keys(matrix, i):
+    column_names, row, codes, masks_by_code = matrix['column_names'], matrix['rows'][i], matrix['codes'], matrix['masks_by_code']
+    n = len(matrix['rows'])
+    all_rows = (1 << n) - 1
+    # columns whose value in row i is shared by every row can't distinguish it (unless it's the 
+    # only row), and columns whose values in row i match the same rows are interchangeable, so 
+    # only search over one column per distinct row mask
+    columns = collections.OrderedDict()
+    for c in xrange(len(column_names)):
+        M = masks_by_code[c][codes[i][c]]
+        if M != all_rows or n == 1:
+            columns.setdefault(M, []).append(c)
+    masks = columns.keys()
+    keys = row_keys(masks, matrix['max_key_size'])
+    return set(
+        frozenset((column_names[c], row[c]) for c in cs)
+        for k in keys
+        for cs in product(*[columns[masks[j]] for j in _bits(k)])
+    )
+
+# the matrix and per-row key function shared (read-only) with worker processes
+_worker_matrix = None
+_worker_row_keys = None
+
+def _init_worker(row_keys_function, matrix):
+    global _worker_matrix, _worker_row_keys
+    _worker_matrix = matrix
+    _worker_row_keys = row_keys_function
+
+def _worker_keys(i):
+    return _worker_row_keys(_worker_matrix, i)
+
+def _keys_by_row(row_keys_function, matrix, row_names, jobs=1, only=None):
+    """
+    Return row_keys_function(matrix, i) for each row i (or just the rows named in only), using 
+    jobs worker processes (which inherit matrix when they're forked, rather than having it sent 
+    to them).
+    y -> { { (x, v) } }
+    """
+    indices = [i for i, y in enumerate(row_names) if only is None or y in only]
+    if jobs <= 1:
+        return dict((row_names[i], row_keys_function(matrix, i)) for i in indices)
+    pool = multiprocessing.Pool(jobs, _init_worker, (row_keys_function, matrix))
+    try:
+        # rows can take wildly different amounts of time, so hand them out one at a time
+        K = dict(izip((row_names[i] for i in indices), pool.imap(_worker_keys, indices, 1)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
     return K
 
+def read_key_cache(path):
+    """
+    Return the matrix and row keys written by write_key_cache, or None if path doesn't exist.
+    { 'column_names': [x], 'row_names': [y], 'rows': [row], 'max_key_size': n, 'keys': y -> { { (x, v) } } }
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        cache = json.load(f)
+    cache['keys'] = dict(
+        (y, set(frozenset((x, v) for x, v in key) for key in keys)) for y, keys in cache['keys'])
+    return cache
+
+def write_key_cache(path, column_names, row_names, rows, max_key_size, K):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({
+            'column_names': column_names,
+            'row_names': row_names,
+            'rows': rows,
+            'max_key_size': max_key_size,
+            'keys': [(y, [sorted(key) for key in K[y]]) for y in row_names],
+        }, f)
+    os.rename(tmp, path)
+
+def tag_columns(column_names, rows, exact=False):
+    """
+    Return a small set of columns that together tell apart every pair of distinct rows, along 
+    with a lower bound on the size of such a set.
+    ([x], lower bound)
+
+    This is a set cover of the pairs of distinct rows by the columns telling them apart.  
+    Columns are chosen greedily (each time taking the column that tells apart the most pairs not 
+    yet told apart, recounting lazily), and then dropped if they turn out not to be needed.  If 
+    exact, a branch and bound search then looks for a smaller set, which makes the result a 
+    smallest one.
+
+    The lower bound follows from columns having at most k values: t columns split rows into at 
+    most k^t groups, so at least ceil(log_k(distinct rows)) columns are needed (the same bound 
+    prunes the exact search, applied to the largest group of rows not yet told apart).
+
+    >>> tag_columns(['x1', 'x2', 'x3'], [[1, 1, 1], [1, 2, 1], [2, 1, 1], [2, 1, 1]])
+    (['x1', 'x2'], 2)
+    """
+    codes, values = encode(rows, len(column_names))
+    # identical rows can't be told apart
+    distinct = collections.OrderedDict()
+    for i in xrange(len(rows)):
+        distinct.setdefault(tuple(codes[i]), i)
+    distinct_codes, distinct_values = encode(distinct.keys(), len(column_names))
+    all_rows = (1 << len(distinct)) - 1
+    # columns that split up rows the same way are interchangeable, and columns with one value 
+    # don't split them up at all
+    partitions = collections.OrderedDict()
+    for c, masks in enumerate(value_masks(distinct_codes, distinct_values)):
+        if len(masks) > 1:
+            partitions.setdefault(tuple(sorted(masks)), c)
+    columns = [(c, list(masks)) for masks, c in partitions.iteritems()]
+    k = max([len(masks) for c, masks in columns] + [2])
+
+    # groups are (row mask, rows) of rows not yet told apart
+
+    def lower_bound(groups):
+        return max([_log_ceil(size, k) for G, size in groups] + [0])
+
+    def split(groups, masks):
+        # the groups of (at least 2) rows not yet told apart, once masks' column is added
+        split_groups = []
+        for G, size in groups:
+            for M in masks:
+                split_size = _popcount(G & M)
+                if split_size > 1:
+                    split_groups.append((G & M, split_size))
+        return split_groups
+
+    def pairs(groups):
+        return sum(size * (size - 1) // 2 for G, size in groups)
+
+    start = [(all_rows, len(distinct))] if len(distinct) > 1 else []
+    panel = []
+    groups = start
+    groups_pairs = pairs(groups)
+    # the pairs a column tells apart only go down as the panel grows, so a column's last computed 
+    # count is an upper bound, and only the column at the top of the heap needs recounting
+    heap = [(-groups_pairs, j) for j in xrange(len(columns))]
+    heapq.heapify(heap)
+    while groups != []:
+        stale, j = heapq.heappop(heap)
+        split_groups = split(groups, columns[j][1])
+        split_pairs = pairs(split_groups)
+        count = groups_pairs - split_pairs
+        if heap != [] and (-count, j) > heap[0]:
+            heapq.heappush(heap, (-count, j))
+            continue
+        panel.append(j)
+        groups, groups_pairs = split_groups, split_pairs
+    # drop columns that the rest of the panel makes redundant: those whose removal leaves every 
+    # distinct row with a distinct combination of values in the rest of the panel.  Combinations 
+    # are compared by hashing each row's values as a sum of random weights (so that a column's 
+    # values can be subtracted out); a collision can only cause a column to be kept.
+    rand = random.Random(0)
+    weights = dict((j, [rand.getrandbits(64) for M in columns[j][1]]) for j in panel)
+    row_codes = [[int(distinct_codes[i][columns[j][0]]) for j in panel] for i in xrange(len(distinct))]
+    hashes = [sum(weights[j][codes_i[p]] for p, j in enumerate(panel)) for codes_i in row_codes]
+    for p, j in list(enumerate(panel)):
+        without = [h - weights[j][codes_i[p]] for h, codes_i in izip(hashes, row_codes)]
+        if len(set(without)) == len(hashes):
+            panel.remove(j)
+            hashes = without
+
+    if exact:
+        best = [panel]
+        def search(chosen, groups, excluded):
+            if groups == []:
+                if len(chosen) < len(best[0]):
+                    best[0] = chosen
+                return
+            if len(chosen) + lower_bound(groups) >= len(best[0]):
+                return
+            # some column must tell apart the first two rows of the largest group
+            G, size = max(groups, key=lambda (G, size): size)
+            first = G & -G
+            second = (G & ~first) & -(G & ~first)
+            excluded = set(excluded)
+            for j, (c, masks) in enumerate(columns):
+                if j not in excluded and any(M & first != 0 and M & second == 0 for M in masks):
+                    search(chosen + [j], split(groups, masks), excluded)
+                    # later branches don't need j (those panels were covered by this branch)
+                    excluded.add(j)
+        search([], start, set())
+        panel = best[0]
+
+    return [column_names[columns[j][0]] for j in sorted(panel, key=lambda j: columns[j][0])], lower_bound(start)
+
+def _log_ceil(n, k):
+    """
+    Return the smallest t such that k^t >= n.
+
+    >>> _log_ceil(1, 2), _log_ceil(8, 2), _log_ceil(9, 2), _log_ceil(9, 3)
+    (0, 3, 4, 2)
+    """
+    t = 0
+    while k ** t < n:
+        t += 1
+    return t
+
+def encode(rows, num_columns):
+    """
+    Return the matrix of integer codes for rows (codes[i][c] is the index of rows[i][c] in 
+    values[c]), along with the distinct values of each column.
+    (codes, [ [v] ])
+
+    codes is a numpy array if numpy is available, otherwise a list of lists.
+
+    >>> codes, values = encode([['A', 'C'], ['G', 'C'], ['A', 'T']], 2)
+    >>> [list(r) for r in codes], values
+    ([[0, 0], [1, 0], [0, 1]], [['A', 'G'], ['C', 'T']])
+    """
+    indices = [{} for c in xrange(num_columns)]
+    values = [[] for c in xrange(num_columns)]
+    def code(c, v):
+        if v not in indices[c]:
+            indices[c][v] = len(values[c])
+            values[c].append(v)
+        return indices[c][v]
+    codes = [[code(c, v) for c, v in enumerate(row)] for row in rows]
+    if numpy is not None:
+        codes = numpy.array(codes, dtype=numpy.int32).reshape((len(rows), num_columns))
+    return codes, values
+
+def value_masks(codes, values):
+    """
+    Return, for each column, the bitmask of rows having each of its values.
+    [ [row mask] ]
+    """
+    if numpy is not None:
+        return [[_mask(codes[:, c] == k) for k in xrange(len(vs))] for c, vs in enumerate(values)]
+    masks = [[0] * len(vs) for vs in values]
+    for i, row in enumerate(codes):
+        bit = 1 << i
+        for c, k in enumerate(row):
+            masks[c][k] |= bit
+    return masks
+
+def _mask(bools):
+    """
+    Return the bitmask for a numpy array of booleans (bools[i] is bit i).
+
+    >>> _mask(numpy.array([True, False, True, True, False, False, False, False, False, True]))
+    525
+    """
+    n = len(bools)
+    if n == 0:
+        return 0
+    # packbits puts bools[-1] in the most significant bit, and pads out to a multiple of 8 bits
+    packed = numpy.packbits(bools[::-1]).tostring()
+    return int(packed.encode('hex'), 16) >> (8 * len(packed) - n)
+
+def discriminating_power(codes, values):
+    """
+    Return the number of pairs of rows each column tells apart.
+    [ pairs ]
+
+    >>> codes, values = encode([['A', 'C'], ['G', 'C'], ['A', 'T']], 2)
+    >>> [int(p) for p in discriminating_power(codes, values)]
+    [2, 2]
+    """
+    if numpy is not None:
+        n, m = codes.shape
+        counts = value_counts(codes, values)
+        return (n * n - (counts.astype(numpy.int64) ** 2).sum(axis=1)) // 2
+    n = len(codes)
+    return [(n * n - sum(_popcount(M) ** 2 for M in masks)) // 2 for masks in value_masks(codes, values)]
+
+def value_counts(codes, values):
+    """
+    Return the number of rows having each code of each column, as a numpy array (counts[c][k] 
+    is the number of rows with code k in column c).
+    """
+    n, m = codes.shape
+    width = max(len(vs) for vs in values) if values != [] else 0
+    flat = (codes + numpy.arange(m) * width).ravel()
+    return numpy.bincount(flat, minlength=m * width).reshape((m, width))
+
+def greedy_row_keys(column_names, row_names, rows, jobs=1):
+    """
+    Return one small row key for each row, or no keys for rows that are identical to another row 
+    (finding the keys of up to jobs rows at a time in worker processes).
+    y -> { { (x, v) } }
+
+    Each key is built by repeatedly adding the column that leaves the fewest other rows matching 
+    it (breaking ties by discriminating power), until no other rows match.  Columns that aren't 
+    needed once the key is complete are then dropped (in the order they were added).  The keys 
+    found are minimal, but not necessarily the smallest.
+    """
+    codes, values = encode(rows, len(column_names))
+    power = discriminating_power(codes, values)
+    matrix = {
+        'column_names': column_names,
+        'rows': rows,
+        'greedy_key': (_greedy_key_vectorized if numpy is not None else _greedy_key_masks)(codes, values, power),
+    }
+    return _keys_by_row(_greedy_row_keys, matrix, row_names, jobs)
+
+def _greedy_row_keys(matrix, i):
+    key = matrix['greedy_key'](i)
+    row = matrix['rows'][i]
+    return set() if key is None else set([
+        frozenset((matrix['column_names'][c], row[c]) for c in key)
+    ])
+
+def _greedy_key_vectorized(codes, values, power):
+    n, m = codes.shape
+    counts = value_counts(codes, values) if m != 0 else None
+    columns = numpy.arange(m)
+
+    def best(matching):
+        fewest = numpy.flatnonzero(matching == matching.min())
+        return fewest[numpy.argmax(power[fewest])]
+
+    def greedy_key(i):
+        others = numpy.arange(n) != i
+        if not others.any():
+            return [] if m == 0 else [0]
+        if m == 0:
+            return None
+        # the first column is chosen from the value counts alone, so that the full matrix is only 
+        # compared against row i once
+        c = best(counts[columns, codes[i]])
+        alive = numpy.flatnonzero(others & (codes[:, c] == codes[i, c]))
+        key = [c]
+        while len(alive) != 0:
+            matching = (codes[alive] == codes[i]).sum(axis=0)
+            c = best(matching)
+            if matching[c] == len(alive):
+                return None
+            alive = alive[codes[alive, c] == codes[i, c]]
+            key.append(c)
+        for c in list(key):
+            rest = [k for k in key if k != c]
+            if not ((codes[:, rest] == codes[i, rest]).all(axis=1) & others).any():
+                key = rest
+        return sorted(int(c) for c in key)
+    return greedy_key
+
+def _greedy_key_masks(codes, values, power):
+    n = len(codes)
+    m = len(values)
+    masks_by_code = value_masks(codes, values)
+
+    def greedy_key(i):
+        others = ((1 << n) - 1) & ~(1 << i)
+        masks = [masks_by_code[c][codes[i][c]] for c in xrange(m)]
+        if others == 0:
+            return [] if m == 0 else [0]
+        alive = others
+        key = []
+        while alive != 0:
+            matching = [_popcount(alive & M) for M in masks]
+            if matching == []:
+                return None
+            fewest = min(matching)
+            c = max((c for c in xrange(m) if matching[c] == fewest), key=lambda c: (power[c], -c))
+            if fewest == _popcount(alive):
+                return None
+            alive &= masks[c]
+            key.append(c)
+        for c in list(key):
+            rest = [k for k in key if k != c]
+            if reduce(lambda R, k: R & masks[k], rest, others) == 0:
+                key = rest
+        return sorted(key)
+    return greedy_key
+
+def _popcount(x):
+    return bin(x).count('1')
+
+def row_keys(masks, max_key_size=None):
+    """
+    Given the row masks of each of a row's values (one per column), return the minimal keys (as 
+    column masks) whose row masks intersect to just that row.
+
+    Keys are built by adding columns in increasing order, and a column is only added if it 
+    narrows down the rows matched so far (and isn't itself narrowed down by them, in which case a 
+    smaller key would match the same rows).  A key stops growing once it matches a single row, or 
+    once adding all of the remaining columns wouldn't narrow it down to a single row.
+
+    >>> sorted(row_keys([0b011, 0b101, 0b001]))
+    [3, 4]
+    """
+    keys = []
+    # remaining[j] = the rows matched by all of masks[j:]
+    remaining = [0] * len(masks) + [-1]
+    for j in xrange(len(masks) - 1, -1, -1):
+        remaining[j] = remaining[j + 1] & masks[j]
+
+    def add(key):
+        for k in keys:
+            if k & key == k:
+                # k subsetof key
+                return
+        keys[:] = [k for k in keys if k & key != key]
+        keys.append(key)
+
+    def search(start, key, R, size):
+        rest = R & remaining[start]
+        if rest & (rest - 1) != 0:
+            return
+        for j in xrange(start, len(masks)):
+            M = masks[j]
+            intr = R & M
+            if intr == R or intr == M:
+                continue
+            if intr & (intr - 1) == 0:
+                add(key | (1 << j))
+            elif max_key_size is None or size + 1 < max_key_size:
+                search(j + 1, key | (1 << j), intr, size + 1)
+
+    for j, M in enumerate(masks):
+        if M & (M - 1) == 0:
+            add(1 << j)
+        elif max_key_size is None or max_key_size > 1:
+            search(j + 1, 1 << j, M, 1)
+    return keys
+
+def _bits(mask):
+    """
+    Return the indices of the bits set in mask.
+
+    >>> list(_bits(0b1010))
+    [1, 3]
+    """
+    i = 0
+    while mask:
+        if mask & 1:
+            yield i
+        mask >>= 1
+        i += 1
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,234 @@
+"""
+Speed up bulk loads into MySQL tables by suspending per-row index and constraint maintenance for the
+duration of the load, then rebuilding indexes and validating foreign keys once at the end.
+
+Works with both oursql and MySQLdb connections.
+"""
+
+import collections
+import sys
+import time
+
+def suspend_checks(db):
+    """
+    Turn off unique and foreign key checks for db's session.
+    """
+    cursor = db.cursor()
+    _execute(cursor, "SET unique_checks = 0")
+    _execute(cursor, "SET foreign_key_checks = 0")
+
+def restore_checks(db):
+    cursor = db.cursor()
+    _execute(cursor, "SET unique_checks = 1")
+    _execute(cursor, "SET foreign_key_checks = 1")
+
+class bulk_session(object):
+    """
+    A context manager for bulk loading tables over db:
+
+    On entry, unique and foreign key checks are turned off for db's session (other connections
+    used for loading should call suspend_checks themselves), MyISAM tables have their keys
+    disabled, and InnoDB tables have the secondary indexes that aren't needed by foreign keys
+    dropped (their definitions are written to log first).  If that fails part way, the tables
+    already handled are restored.
+
+    On exit, indexes are rebuilt, checks are turned back on, and (if loading succeeded) foreign
+    keys of tables are validated in a single query per constraint.  Every table is rebuilt even if
+    some fail; the first failure is raised afterwards, unless loading itself failed.  The time
+    taken by each phase is written to log.
+    """
+    def __init__(self, db, tables, log=sys.stderr):
+        self.db = db
+        self.tables = tables
+        self.log = log
+
+    def __enter__(self):
+        cursor = self.db.cursor()
+        suspend_checks(self.db)
+        # MyISAM tables whose keys were disabled
+        self.disabled_keys = []
+        # InnoDB table -> the indexes dropped from it (index -> definition)
+        self.dropped_indexes = {}
+        try:
+            engines = table_engines(cursor, self.tables)
+            for table in self.tables:
+                if engines[table] == 'MyISAM':
+                    _execute(cursor, "ALTER TABLE {table} DISABLE KEYS".format(**locals()))
+                    self.disabled_keys.append(table)
+                elif engines[table] == 'InnoDB':
+                    indexes = droppable_indexes(cursor, table)
+                    if indexes != {}:
+                        # so that the indexes of a killed load can be rebuilt by hand
+                        for index, definition in indexes.iteritems():
+                            print >>self.log, "dropping {table}.{index} (to rebuild: ALTER TABLE {table} ADD {definition})".format(**locals())
+                        _execute(cursor, "ALTER TABLE {table} {drops}".format(
+                            table=table,
+                            drops=', '.join('DROP INDEX {index}'.format(index=index) for index in indexes)))
+                        self.dropped_indexes[table] = indexes
+        except:
+            # put back the indexes of the tables already handled
+            error = sys.exc_info()
+            self._rebuild()
+            raise error[0], error[1], error[2]
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._report('load', time.time() - self.start)
+        cursor = self.db.cursor()
+
+        start = time.time()
+        error = self._rebuild()
+        self._report('rebuild indexes', time.time() - start)
+        if type is not None:
+            # let the load's own exception propagate
+            return
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+        start = time.time()
+        violations = foreign_key_violations(cursor, self.tables)
+        self._report('validate foreign keys', time.time() - start)
+        if violations != []:
+            raise RuntimeError("foreign key constraints violated after bulk loading:\n" + '\n'.join(
+                "{count} rows of {table} violate {constraint}".format(table=table, constraint=constraint, count=count)
+                for table, constraint, count in violations))
+
+    def _rebuild(self):
+        """
+        Re-enable the keys and re-add the indexes of each table, then turn checks back on.  Every
+        table is tried even if some fail (their errors are written to log); return the exc_info of
+        the first failure, or None.
+        """
+        cursor = self.db.cursor()
+        error = None
+        try:
+            for table in self.tables:
+                try:
+                    if table in self.disabled_keys:
+                        _execute(cursor, "ALTER TABLE {table} ENABLE KEYS".format(**locals()))
+                    elif self.dropped_indexes.get(table, {}) != {}:
+                        _execute(cursor, "ALTER TABLE {table} {adds}".format(
+                            table=table,
+                            adds=', '.join('ADD ' + definition for definition in self.dropped_indexes[table].itervalues())))
+                except Exception as e:
+                    print >>self.log, "failed to rebuild the indexes of {table}: {e}".format(**locals())
+                    if error is None:
+                        error = sys.exc_info()
+        finally:
+            restore_checks(self.db)
+        return error
+
+    def _report(self, phase, seconds):
+        print >>self.log, "{phase}: {seconds:.2f}s".format(**locals())
+
+def table_engines(cursor, tables):
+    """
+    Return the storage engine of each table.
+    table -> engine
+    """
+    _execute(cursor, """
+        SELECT TABLE_NAME, ENGINE
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({tables_str})
+    """.format(tables_str=', '.join(_sql_string(t) for t in tables)))
+    return dict(cursor.fetchall())
+
+def foreign_keys(cursor, tables):
+    """
+    Return the foreign key constraints of tables.
+    [ (table, constraint, referenced_table, [(column, referenced_column)]) ]
+    """
+    _execute(cursor, """
+        SELECT TABLE_NAME, CONSTRAINT_NAME, REFERENCED_TABLE_NAME, COLUMN_NAME, REFERENCED_COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND
+              REFERENCED_TABLE_NAME IS NOT NULL AND
+              TABLE_NAME IN ({tables_str})
+        ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+    """.format(tables_str=', '.join(_sql_string(t) for t in tables)))
+    constraints = collections.OrderedDict()
+    for table, constraint, referenced_table, column, referenced_column in cursor.fetchall():
+        key = (table, constraint, referenced_table)
+        constraints.setdefault(key, []).append((column, referenced_column))
+    return [key + (columns,) for key, columns in constraints.iteritems()]
+
+def droppable_indexes(cursor, table):
+    """
+    Return the non-unique secondary indexes of table that foreign keys don't rely on, along with the
+    definition (as in ALTER TABLE ... ADD <definition>) that recreates each of them, keeping their
+    type (e.g. FULLTEXT), prefix lengths, column order and comment.  Functional indexes (whose key
+    parts are expressions rather than columns) are left alone.
+    index -> definition
+    """
+    _execute(cursor, """
+        SELECT INDEX_NAME, INDEX_TYPE, INDEX_COMMENT, COLUMN_NAME, SUB_PART, COLLATION
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = {table} AND NON_UNIQUE = 1
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """.format(table=_sql_string(table)))
+    # index -> (type, comment, [ (column, sub_part, collation) ])
+    indexes = collections.OrderedDict()
+    for index, index_type, comment, column, sub_part, collation in cursor.fetchall():
+        indexes.setdefault(index, (index_type, comment, []))[2].append((column, sub_part, collation))
+    fk_columns = [[c for c, r in columns] for t, constraint, referenced_table, columns in foreign_keys(cursor, [table])]
+    def needed_by_foreign_key(columns):
+        return any(columns[:len(fk)] == fk for fk in fk_columns)
+    return collections.OrderedDict(
+        (index, index_definition(index, index_type, comment, key_parts))
+        for index, (index_type, comment, key_parts) in indexes.iteritems()
+        if not any(column is None for column, sub_part, collation in key_parts) and
+           not needed_by_foreign_key([column for column, sub_part, collation in key_parts]))
+
+def index_definition(index, index_type, comment, key_parts):
+    """
+    Return the definition of an index, given its INDEX_TYPE and INDEX_COMMENT in
+    information_schema.STATISTICS, and the COLUMN_NAME, SUB_PART and COLLATION ('A' for ascending,
+    'D' for descending) of each of its key parts.
+    """
+    columns = ', '.join(
+        column +
+        ('' if sub_part is None else '({sub_part})'.format(sub_part=sub_part)) +
+        (' DESC' if collation == 'D' else '')
+        for column, sub_part, collation in key_parts)
+    if index_type in ['FULLTEXT', 'SPATIAL']:
+        definition = '{index_type} INDEX {index} ({columns})'.format(**locals())
+    else:
+        definition = 'INDEX {index} ({columns}) USING {index_type}'.format(**locals())
+    if comment:
+        definition += ' COMMENT {comment}'.format(comment=_sql_string(comment))
+    return definition
+
+def foreign_key_violations(cursor, tables):
+    """
+    Return the number of rows of tables that violate each of their foreign key constraints.
+    [ (table, constraint, count) ]
+    """
+    violations = []
+    for table, constraint, referenced_table, columns in foreign_keys(cursor, tables):
+        _execute(cursor, """
+            SELECT COUNT(*)
+            FROM {table} r LEFT JOIN {referenced_table} t ON {on}
+            WHERE ({referencing_not_null}) AND t.{first_referenced_column} IS NULL
+        """.format(
+            table=table,
+            referenced_table=referenced_table,
+            on=' AND '.join('r.{c} = t.{rc}'.format(c=c, rc=rc) for c, rc in columns),
+            referencing_not_null=' AND '.join('r.{c} IS NOT NULL'.format(c=c) for c, rc in columns),
+            first_referenced_column=columns[0][1]))
+        count = cursor.fetchone()[0]
+        if count != 0:
+            violations.append((table, constraint, count))
+    return violations
+
+def _sql_string(s):
+    return "'" + s.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def _execute(cursor, query):
+    """
+    Execute query without parameters (as a plain query for oursql, since statements like ALTER TABLE
+    ... DISABLE KEYS can't be prepared).
+    """
+    if cursor.__class__.__module__.startswith('oursql'):
+        return cursor.execute(query, plain_query=True)
+    return cursor.execute(query)
@@ -0,0 +1,169 @@
+"""
+A compact, dictionary-encoded alternative to csv files (named <table>.dcsv), for the intermediate
+files of the scrapy pipeline, whose columns repeat the same few strings (gene names, haplotype
+names, recommendation text) over many rows.
+
+Rows are written in blocks of block_rows rows.  Each block stores, for each column, the distinct
+values in that block and an array of indexes into them, and is zlib-compressed:
+
+    'DCSV\\x01' (<uint32 length> zlib(marshal((num_rows, [(values, typecode, indexes)]))))*
+
+The reader and writer interfaces mirror the csv module's (the first row is the header), so they can
+stand in for csv.reader/writer and csv.DictReader/DictWriter.  Values are read back as strings
+(None is written as '', and other non-strings are written as str(value), like csv).
+
+>>> from StringIO import StringIO
+>>> f = StringIO()
+>>> w = DictWriter(f, ['gene_name', 'snp_id'], block_rows=2)
+>>> w.writeheader()
+>>> w.writerows([{'gene_name': 'CYP2D6', 'snp_id': 'rs1'}, {'gene_name': 'CYP2D6', 'snp_id': 'rs2'}])
+>>> w.flush()
+>>> r = DictReader(StringIO(f.getvalue()))
+>>> r.fieldnames
+['gene_name', 'snp_id']
+>>> [row['snp_id'] for row in r]
+['rs1', 'rs2']
+"""
+
+import array
+import itertools
+import marshal
+import os.path
+import struct
+import sys
+import zlib
+
+EXTENSION = '.dcsv'
+MAGIC = 'DCSV\x01'
+
+def is_dcsv(filename):
+    return os.path.splitext(filename)[1] == EXTENSION
+
+class writer(object):
+    """
+    Write rows (lists of values) to the file-like object f.  flush() must be called once all rows
+    have been written.
+    """
+    def __init__(self, f, block_rows=4096, compress_level=6):
+        self.f = f
+        self.block_rows = block_rows
+        self.compress_level = compress_level
+        self.rows = []
+        self.f.write(MAGIC)
+
+    def writerow(self, row):
+        self.rows.append([_str(v) for v in row])
+        if len(self.rows) >= self.block_rows:
+            self._write_block()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """
+        Write the rows buffered for the current block.
+        """
+        if self.rows != []:
+            self._write_block()
+        self.f.flush()
+
+    def _write_block(self):
+        num_columns = max(len(row) for row in self.rows)
+        columns = []
+        for i in xrange(num_columns):
+            codes = {}
+            values = []
+            indexes = []
+            for row in self.rows:
+                v = row[i] if i < len(row) else ''
+                code = codes.get(v)
+                if code is None:
+                    code = codes[v] = len(values)
+                    values.append(v)
+                indexes.append(code)
+            typecode = 'B' if len(values) <= 0xff else 'H' if len(values) <= 0xffff else 'I'
+            columns.append((values, typecode, _pack(typecode, indexes)))
+        block = zlib.compress(marshal.dumps((len(self.rows), columns)), self.compress_level)
+        self.f.write(struct.pack('<I', len(block)))
+        self.f.write(block)
+        self.rows = []
+
+def reader(f):
+    """
+    Yield the rows (lists of strings) of the dcsv file-like object f.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a dcsv file: {name}".format(name=getattr(f, 'name', f)))
+    while True:
+        length = f.read(4)
+        if length == '':
+            return
+        block = f.read(struct.unpack('<I', length)[0])
+        num_rows, columns = marshal.loads(zlib.decompress(block))
+        for row in itertools.izip(*[[values[i] for i in _unpack(typecode, indexes)] for values, typecode, indexes in columns]):
+            yield list(row)
+
+class DictWriter(object):
+    """
+    Like csv.DictWriter, but for dcsv files.
+    """
+    def __init__(self, f, fieldnames, restval='', extrasaction='raise', **kwargs):
+        self.fieldnames = fieldnames
+        self.restval = restval
+        self.extrasaction = extrasaction
+        self.writer = writer(f, **kwargs)
+
+    def writeheader(self):
+        self.writer.writerow(self.fieldnames)
+
+    def writerow(self, rowdict):
+        if self.extrasaction == 'raise':
+            extras = [k for k in rowdict if k not in self.fieldnames]
+            if extras != []:
+                raise ValueError("dict contains fields not in fieldnames: " + ", ".join(repr(x) for x in extras))
+        self.writer.writerow([rowdict.get(k, self.restval) for k in self.fieldnames])
+
+    def writerows(self, rowdicts):
+        for rowdict in rowdicts:
+            self.writerow(rowdict)
+
+    def flush(self):
+        self.writer.flush()
+
+class DictReader(object):
+    """
+    Like csv.DictReader, but for dcsv files (fieldnames are taken from the first row).
+    """
+    def __init__(self, f):
+        self.reader = reader(f)
+        try:
+            self.fieldnames = self.reader.next()
+        except StopIteration:
+            self.fieldnames = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return dict(itertools.izip(self.fieldnames, self.reader.next()))
+
+def _str(v):
+    if v is None:
+        return ''
+    if isinstance(v, basestring):
+        return v
+    return str(v)
+
+def _pack(typecode, indexes):
+    a = array.array(typecode, indexes)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tostring()
+
+def _unpack(typecode, indexes):
+    a = array.array(typecode)
+    a.fromstring(indexes)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
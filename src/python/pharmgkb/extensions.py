@@ -0,0 +1,33 @@
+"""
+Define scrapy extensions (http://doc.scrapy.org/en/0.18/topics/extensions.html).
+"""
+
+from scrapy import signals, log
+from pharmgkb.spiders import Gene
+
+class RecommendationCacheStats(object):
+    """
+    When the spider closes, log the hit rate of the drug recommendation response cache 
+    (pharmgkb.spiders.Gene.recommendation_cache) for each gene, and record the totals in the crawl 
+    stats.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider):
+        cache = Gene.recommendation_cache
+        for gene_name in sorted(set(cache.hits) | set(cache.misses)):
+            hits = cache.hits[gene_name]
+            misses = cache.misses[gene_name]
+            spider.log("{gene_name}: {hits} of {responses} drug recommendation responses were already parsed ({percent:.1f}%)".format(
+                responses=hits + misses,
+                percent=100. * hits / (hits + misses),
+                **locals()), level=log.INFO)
+        self.stats.set_value('recommendation_cache/hits', sum(cache.hits.values()), spider=spider)
+        self.stats.set_value('recommendation_cache/misses', sum(cache.misses.values()), spider=spider)
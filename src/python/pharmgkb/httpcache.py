@@ -0,0 +1,141 @@
+"""
+Define a scrapy HTTPCACHE_STORAGE (http://doc.scrapy.org/en/0.18/topics/downloader-middleware.html#httpcache-storage-backends)
+that keeps all of a spider's cached responses in a single sqlite database.
+"""
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.project import data_path
+from scrapy import log
+
+import anydbm
+import cPickle as pickle
+import marshal
+import os.path
+import sqlite3
+import time
+import whichdb
+import zlib
+
+class SqliteCacheStorage(object):
+    """
+    Store responses in HTTPCACHE_DIR/<spider name>.sqlite, indexed by request fingerprint, with
+    zlib-compressed bodies.  Unlike the one-file-per-response storages, a warm crawl only reads one
+    indexed file.
+
+    Responses older than HTTPCACHE_EXPIRATION_SECS (if non-zero) are treated as missing, and are
+    deleted (and the database shrunk) by compact(), which is run when the spider closes if
+    HTTPCACHE_SQLITE_COMPACT is set.  Stores are committed every HTTPCACHE_SQLITE_COMMIT_EVERY
+    responses (and when the spider closes).
+
+    The first time a spider's database is created, the responses cached for it by scrapy's
+    DbmCacheStorage (HTTPCACHE_DIR/<spider name>.db) are copied into it, so switching storages
+    doesn't mean starting over with a cold cache.
+    """
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.commit_every = settings.getint('HTTPCACHE_SQLITE_COMMIT_EVERY', 100)
+        self.compact_on_close = settings.getbool('HTTPCACHE_SQLITE_COMPACT')
+        self.db = None
+        self.uncommitted = 0
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cachedir, '%s.sqlite' % spider.name)
+        created = not os.path.exists(path)
+        self.db = connect(path)
+        dbm_path = os.path.join(self.cachedir, '%s.db' % spider.name)
+        if created and whichdb.whichdb(dbm_path):
+            migrated = migrate_dbm(self.db, dbm_path)
+            log.msg("copied {migrated} responses from the dbm http cache {dbm_path} into {path}".format(**locals()),
+                    level=log.INFO, spider=spider)
+
+    def close_spider(self, spider):
+        self.db.commit()
+        if self.compact_on_close:
+            compact(self.db, self.expiration_secs)
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute("SELECT timestamp, url, status, headers, body FROM response WHERE fingerprint = ?",
+                (request_fingerprint(request),)).fetchone()
+        if row is None:
+            return  # not cached
+        timestamp, url, status, headers, body = row
+        if 0 < self.expiration_secs < time.time() - timestamp:
+            return  # expired
+        headers = Headers(marshal.loads(str(headers)))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=zlib.decompress(str(body)))
+
+    def store_response(self, spider, request, response):
+        store(self.db, request_fingerprint(request), time.time(), response.url, response.status, dict(response.headers), response.body)
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.db.commit()
+            self.uncommitted = 0
+
+def connect(path):
+    """
+    Open (creating if needed) the sqlite cache database at path.
+    """
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS response (
+            fingerprint text primary key,
+            timestamp real,
+            url text,
+            status integer,
+            headers blob,
+            body blob
+        )""")
+    return db
+
+def store(db, fingerprint, timestamp, url, status, headers, body):
+    db.execute("INSERT OR REPLACE INTO response (fingerprint, timestamp, url, status, headers, body) VALUES (?, ?, ?, ?, ?, ?)", (
+        fingerprint,
+        timestamp,
+        url,
+        status,
+        sqlite3.Binary(marshal.dumps(headers)),
+        sqlite3.Binary(zlib.compress(body)),
+    ))
+
+def migrate_dbm(db, dbm_path):
+    """
+    Copy the responses cached by scrapy's DbmCacheStorage in the dbm database at dbm_path into db,
+    keeping their fingerprints and timestamps.  Return the number of responses copied.
+    """
+    source = anydbm.open(dbm_path, 'r')
+    try:
+        migrated = 0
+        for key in source.keys():
+            if not key.endswith('_data'):
+                continue
+            fingerprint = key[:-len('_data')]
+            try:
+                timestamp = float(source[fingerprint + '_time'])
+            except KeyError:
+                timestamp = time.time()
+            data = pickle.loads(source[key])
+            store(db, fingerprint, timestamp, data['url'], data['status'], data['headers'], data['body'])
+            migrated += 1
+        db.commit()
+        return migrated
+    finally:
+        source.close()
+
+def compact(db, expiration_secs):
+    """
+    Delete the responses of db older than expiration_secs (if non-zero), and reclaim unused space.
+    Return the number of responses deleted.
+    """
+    deleted = 0
+    if expiration_secs > 0:
+        deleted = db.execute("DELETE FROM response WHERE timestamp < ?", (time.time() - expiration_secs,)).rowcount
+        db.commit()
+    db.execute("VACUUM")
+    return deleted
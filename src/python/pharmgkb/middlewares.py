@@ -0,0 +1,278 @@
+"""
+Define scrapy downloader middlewares (http://doc.scrapy.org/en/0.18/topics/downloader-middleware.html).
+"""
+
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.responsetypes import responsetypes
+from scrapy.http import Response, TextResponse
+from scrapy.core.downloader import Slot
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy import signals, log
+
+import os
+import os.path
+import re
+import urllib
+import urlparse
+
+class OfflineReplayMiddleware(object):
+    """
+    Replay a crawl without touching the network (settings.OFFLINE): requests missed by the
+    HTTPCACHE store (HttpCacheMiddleware runs first) are served straight from a "wget -r" mirror of
+    pharmgkb in settings.OFFLINE_MIRROR_DIR (if set), and any other request is dropped instead of
+    being downloaded.  Since responses never reach the downloader, DOWNLOAD_DELAY doesn't apply.
+
+    The mirror directory may either be the one wget was run in (containing www.pharmgkb.org/...) or
+    the host directory itself (the one script/pharmgkb_webserver.py serves).  Form requests (like
+    those of GeneHaplotypeSpider and BaseGenotypeSpider) are resolved to the mirrored file of the
+    equivalent GET url (e.g. alleleGuidelines.action?allele1=...&annotationId=...), regardless of
+    the order of its query parameters.
+    """
+    def __init__(self, mirror_dir, stats):
+        self.mirror_dir = mirror_dir
+        self.stats = stats
+        # directory -> { (basename, frozenset(query parameters)) -> filename }
+        self.query_files = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('OFFLINE'):
+            raise NotConfigured
+        return cls(crawler.settings.get('OFFLINE_MIRROR_DIR'), crawler.stats)
+
+    def process_request(self, request, spider):
+        filename = self.mirror_file(request) if self.mirror_dir is not None else None
+        if filename is None:
+            self.stats.inc_value('offline/ignored', spider=spider)
+            raise IgnoreRequest("Ignored request not in the cache or mirror (offline): %s" % request)
+        self.stats.inc_value('offline/mirror', spider=spider)
+        with open(filename, 'rb') as f:
+            body = f.read()
+        response_class = responsetypes.from_args(url=request.url, filename=filename, body=body)
+        if response_class is Response:
+            response_class = TextResponse
+        return response_class(url=request.url, body=body, request=request, flags=['offline'])
+
+    def mirror_file(self, request):
+        """
+        Return the mirrored file for request, or None if it isn't in the mirror.
+        """
+        url = urlparse.urlparse(request.url)
+        parameters = urlparse.parse_qsl(url.query, keep_blank_values=True)
+        if request.method == 'POST' and request.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            parameters += urlparse.parse_qsl(request.body, keep_blank_values=True)
+        path = urllib.unquote(url.path).lstrip('/')
+        for base in [os.path.join(self.mirror_dir, url.netloc, path), os.path.join(self.mirror_dir, path)]:
+            if parameters != []:
+                filename = self._query_file(base, parameters)
+            elif os.path.isdir(base):
+                filename = os.path.join(base, 'index.html')
+            else:
+                filename = base
+            for candidate in [filename, filename + '.html'] if filename is not None else []:
+                if os.path.isfile(candidate):
+                    return candidate
+        return None
+
+    def _query_file(self, base, parameters):
+        directory, basename = os.path.split(base)
+        if directory not in self.query_files:
+            files = {}
+            if os.path.isdir(directory):
+                for f in os.listdir(directory):
+                    if '?' in f:
+                        name, query = f.split('?', 1)
+                        # wget --adjust-extension appends .html to the query
+                        for q in set([query, query[:-len('.html')] if query.endswith('.html') else query]):
+                            files[(name, frozenset(urlparse.parse_qsl(q, keep_blank_values=True)))] = os.path.join(directory, f)
+            self.query_files[directory] = files
+        return self.query_files[directory].get((basename, frozenset(parameters)))
+
+class EndpointThrottleMiddleware(object):
+    """
+    Pace each class of pharmgkb url (settings.ENDPOINT_THROTTLE_ENDPOINTS; e.g. gene pages, the 
+    ajaxGuidelinePickerData.action json and the alleleGuidelines.action fragments) separately, 
+    instead of crawling the whole site at one fixed DOWNLOAD_DELAY.
+
+    Requests of each endpoint (per host) are downloaded in their own downloader slot, whose 
+    concurrency and delay follow an EndpointThrottle fed with the latency and errors of the 
+    endpoint's responses (a slot starts a request at most every delay seconds, so its concurrency 
+    only matters once responses take longer than that).  Requests for other urls keep the default 
+    slot and DOWNLOAD_DELAY.  
+    Responses that never reached the network (from HTTPCACHE or OFFLINE_MIRROR_DIR) are ignored.
+    """
+    def __init__(self, crawler, endpoints, stats, error_codes=(500, 502, 503, 504), debug=False):
+        """
+        endpoints is a list of (name, url regex, EndpointThrottle).
+        """
+        self.crawler = crawler
+        self.endpoints = [(name, re.compile(pattern), throttle) for name, pattern, throttle in endpoints]
+        self.stats = stats
+        self.error_codes = set(error_codes)
+        self.debug = debug
+        # download slot key -> (endpoint name, EndpointThrottle)
+        self.slot_endpoints = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ENDPOINT_THROTTLE_ENABLED'):
+            raise NotConfigured
+        defaults = {
+            'start_delay': settings.getfloat('ENDPOINT_THROTTLE_START_DELAY', settings.getfloat('DOWNLOAD_DELAY')),
+            'min_delay': settings.getfloat('ENDPOINT_THROTTLE_MIN_DELAY'),
+            'max_delay': settings.getfloat('ENDPOINT_THROTTLE_MAX_DELAY', 60.),
+            'max_concurrency': settings.getint('ENDPOINT_THROTTLE_MAX_CONCURRENCY', 1),
+            'error_budget': settings.getfloat('ENDPOINT_THROTTLE_ERROR_BUDGET'),
+            'budget_responses': settings.getint('ENDPOINT_THROTTLE_ERROR_BUDGET_RESPONSES', 100),
+            'latency_tolerance': settings.getfloat('ENDPOINT_THROTTLE_LATENCY_TOLERANCE', 2.),
+        }
+        endpoints = []
+        for name, pattern, limits in settings.getlist('ENDPOINT_THROTTLE_ENDPOINTS'):
+            kwargs = dict(defaults)
+            kwargs.update(limits)
+            endpoints.append((name, pattern, EndpointThrottle(**kwargs)))
+        middleware = cls(crawler, endpoints, crawler.stats,
+                error_codes=[int(code) for code in settings.getlist('ENDPOINT_THROTTLE_ERROR_CODES')],
+                debug=settings.getbool('ENDPOINT_THROTTLE_DEBUG'))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def endpoint(self, request):
+        """
+        Return the (name, EndpointThrottle) of the endpoint request is for, or None.
+        """
+        for name, pattern, throttle in self.endpoints:
+            if pattern.search(request.url):
+                return name, throttle
+        return None
+
+    def process_request(self, request, spider):
+        endpoint = self.endpoint(request)
+        if endpoint is None:
+            return
+        name, throttle = endpoint
+        key = '{host} {name}'.format(host=urlparse_cached(request).hostname, name=name)
+        request.meta['download_slot'] = key
+        self.slot_endpoints[key] = endpoint
+        # the downloader creates missing slots with the default concurrency and delay (and drops idle 
+        # ones), so (re)create it with the endpoint's
+        slots = self.crawler.engine.downloader.slots
+        if key not in slots:
+            slots[key] = Slot(throttle.concurrency, throttle.delay, self.crawler.settings)
+
+    def process_response(self, request, response, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self._record(request, spider, latency=latency, error=response.status in self.error_codes)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self._record(request, spider, latency=None, error=True)
+
+    def _record(self, request, spider, latency, error):
+        key = request.meta.get('download_slot')
+        if key not in self.slot_endpoints:
+            return
+        name, throttle = self.slot_endpoints[key]
+        self.stats.inc_value('endpoint_throttle/{name}/responses'.format(name=name), spider=spider)
+        if error:
+            self.stats.inc_value('endpoint_throttle/{name}/errors'.format(name=name), spider=spider)
+        if throttle.record(latency, error):
+            slot = self.crawler.engine.downloader.slots.get(key)
+            if slot is not None:
+                slot.concurrency = throttle.concurrency
+                slot.delay = throttle.delay
+            if self.debug:
+                spider.log("{key}: concurrency {concurrency}, delay {delay:.2f}s (latency {latency}, {errors} errors in {responses} responses)".format(
+                    key=key,
+                    concurrency=throttle.concurrency,
+                    delay=throttle.delay,
+                    latency='{0:.2f}s'.format(throttle.latency) if throttle.latency is not None else 'unknown',
+                    errors=throttle.errors,
+                    responses=throttle.responses), level=log.INFO)
+
+    def spider_closed(self, spider):
+        for name, pattern, throttle in self.endpoints:
+            spider.log("{name}: {responses} responses, {errors} errors, ended at concurrency {concurrency} and delay {delay:.2f}s".format(
+                name=name,
+                responses=throttle.responses,
+                errors=throttle.errors,
+                concurrency=throttle.concurrency,
+                delay=throttle.delay), level=log.INFO)
+            self.stats.set_value('endpoint_throttle/{name}/concurrency'.format(name=name), throttle.concurrency, spider=spider)
+            self.stats.set_value('endpoint_throttle/{name}/delay'.format(name=name), throttle.delay, spider=spider)
+
+class EndpointThrottle(object):
+    """
+    Adapt the concurrency and delay of requests to one endpoint to the latency and errors of its 
+    responses (additive increase, multiplicative decrease; like TCP congestion control), within 
+    politeness limits:
+
+    - after an error (a failed download or an ENDPOINT_THROTTLE_ERROR_CODES response), halve the 
+      concurrency and double the delay (up to max_delay)
+    - when the smoothed latency exceeds latency_tolerance times the lowest seen (i.e. requests are 
+      queueing up at the server), drop one concurrent request
+    - otherwise, if one more error would keep the endpoint's errors within error_budget (a 
+      fraction of its responses so far, but at least budget_responses), shorten the delay (down to 
+      min_delay), or once it's there, add a concurrent request (up to max_concurrency)
+
+    Since speeding up is how the server's limits are found, errors hold the pace until enough 
+    responses succeed to pay for them, keeping the crawl's error rate within error_budget.
+
+    Adjustments wait for a round of responses (one per concurrent request) since the last one, so 
+    that they see the effect of the previous one.
+    """
+    def __init__(self, start_delay=1., min_delay=0., max_delay=60., max_concurrency=1, error_budget=0.01, 
+            budget_responses=100, latency_tolerance=2., smoothing=0.3):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.error_budget = error_budget
+        self.budget_responses = budget_responses
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.delay = min(max(start_delay, min_delay), max_delay)
+        self.concurrency = 1
+        # exponentially smoothed latency, and its lowest value
+        self.latency = None
+        self.baseline_latency = None
+        self.responses = 0
+        self.errors = 0
+        self.since_adjusted = 0
+
+    def within_error_budget(self, errors):
+        return errors <= self.error_budget * max(self.responses, self.budget_responses)
+
+    def record(self, latency, error):
+        """
+        Record a response (latency is None for failed downloads), returning True if the concurrency 
+        or delay changed.
+        """
+        self.responses += 1
+        self.since_adjusted += 1
+        if error:
+            self.errors += 1
+        elif latency is not None:
+            self.latency = latency if self.latency is None else \
+                self.smoothing * latency + (1 - self.smoothing) * self.latency
+            self.baseline_latency = min(self.baseline_latency, self.latency) if self.baseline_latency is not None else self.latency
+        if self.since_adjusted < self.concurrency:
+            return False
+
+        concurrency, delay = self.concurrency, self.delay
+        if error:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(2 * self.delay, self.min_delay, self.latency or 0.))
+        elif self.latency is not None and self.latency > self.latency_tolerance * self.baseline_latency:
+            self.concurrency = max(1, self.concurrency - 1)
+        elif self.within_error_budget(self.errors + 1):
+            if self.delay > self.min_delay:
+                self.delay = max(self.min_delay, self.delay * 0.75)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        if (concurrency, delay) == (self.concurrency, self.delay):
+            return False
+        self.since_adjusted = 0
+        return True
@@ -0,0 +1,59 @@
+"""
+Extract data from PharmGKB pages using precompiled lxml XPath expressions evaluated directly on the
+document, instead of HtmlXPathSelector queries (which compile their expression and wrap every
+result in a new selector each time).  Each function returns exactly what its HtmlXPathSelector
+counterpart in pharmgkb.spiders.Gene extracts (text as unicode).
+"""
+
+from lxml import etree
+from scrapy.selector.lxmldocument import LxmlDocument
+
+NO_RECOMMENDATIONS = etree.XPath('boolean(//text()[contains(., "This guideline does not contain recommendations")])')
+DT_TEXT = etree.XPath('//dt/*/text()')
+DD = etree.XPath('//dd')
+DD_TEXT = etree.XPath('(* | */*)/text()')
+HAPLOTYPES_TABLE = etree.XPath('//div[@id="tabHaplotypes"]/article[@class="HaplotypeSet"]/*/table')
+TABLE_ROWS = etree.XPath('*/tr | tr')
+HEADER_TEXT = etree.XPath('th/text() | th/a/text()')
+LINK_TEXT = etree.XPath('a/text()')
+TEXT = etree.XPath('text()')
+
+def document(response):
+    """
+    Return the root element of response, parsed (and cached) the same way HtmlXPathSelector parses
+    it.
+    """
+    return LxmlDocument(response)
+
+def recommendation_titles_values(response):
+    """
+    Given a drug recommendation response, return the titles (<dt>) and values (<dd>) of its
+    fields, or None if it has no recommendations.
+    """
+    root = document(response)
+    if NO_RECOMMENDATIONS(root):
+        return None
+    return [unicode(t) for t in DT_TEXT(root)], [u' '.join(DD_TEXT(dd)) for dd in DD(root)]
+
+def haplotypes_table(response):
+    """
+    Return the table element of a gene page's "Haplotypes" tab, or None if it has none.
+    """
+    tables = HAPLOTYPES_TABLE(document(response))
+    return tables[0] if tables != [] else None
+
+def table_cells(t):
+    """
+    Given the element for a table, extract the text of its header cells, and the <td> cells of each
+    of its other rows.
+    """
+    rows = TABLE_ROWS(t)
+    return [unicode(h) for h in HEADER_TEXT(rows[0])], [row.findall('td') for row in rows[1:]]
+
+def first_text(cell):
+    """
+    Return the first text node inside cell (like cell.select('text()')[0]).
+    """
+    if cell.text is not None:
+        return unicode(cell.text)
+    return unicode(TEXT(cell)[0])
@@ -1,9 +1,11 @@
-from scrapy import signals
+from scrapy import signals, log
 from scrapy.exceptions import DropItem
 from scrapy.contrib.exporter import CsvItemExporter, JsonLinesItemExporter
 import items
 import settings
 import pipelines
+import spill
+import dcsv
 
 import collections
 import os
@@ -12,6 +14,17 @@ import errno
 import fileinput
 import sys
 import csv
+import hashlib
+import heapq
+import itertools
+import marshal
+import tempfile
+import sqlite3
+# non-standard libs (download with pip); only needed for DatabasePipeline with mysql
+try:
+    import oursql
+except ImportError:
+    oursql = None
 
 # Define your item pipelines here
 #
@@ -20,14 +33,22 @@ import csv
 
 _output_dir = settings.CSV_OUTPUT_DIR
 
+# separator for joining the distinct values of fields of rows with the same primary key
+_separator = '. '
+
 class CsvPipeline(object):
     """
-    Output items into settings.CSV_OUTPUT_DIR/<class_name>.csv.
+    Output items into settings.CSV_OUTPUT_DIR/<class_name>.csv (or <class_name>.dcsv if 
+    settings.CSV_OUTPUT_FORMAT is 'dcsv').
+
+    Duplicate items are dropped.  Only a fixed-size digest of each item is remembered, and past 
+    settings.CSV_DEDUP_MAX_MEMORY_ITEMS digests they're spilled to disk, so memory use stays bounded 
+    on large crawls.
     """
     def __init__(self):
         self.exporters = {}
-        # (Item.__class__, item.values) => True
-        self.items_seen = set()
+        # _item_digest(item)
+        self.items_seen = spill.SpillSet(max_memory_items=settings.CSV_DEDUP_MAX_MEMORY_ITEMS)
 
     def get_exporter(self, item):
         exporter = None
@@ -36,6 +57,8 @@ class CsvPipeline(object):
         else:
             if item.__class__ == items.unused_genotype_data:
                 exporter = JsonLinesItemExporter(open(_class_to_file(item.__class__), 'w+b'))
+            elif settings.CSV_OUTPUT_FORMAT == 'dcsv':
+                exporter = DcsvItemExporter(open(_class_to_file(item.__class__), 'w+b'))
             else:
                 exporter = CsvItemExporter(open(_class_to_file(item.__class__), 'w+b'))
             self.exporters[item.__class__] = exporter
@@ -43,22 +66,52 @@ class CsvPipeline(object):
         return exporter
 
     def item_seen(self, item):
-        return self.item_key(item) in self.items_seen
+        return _item_digest(item) in self.items_seen
 
     def process_item(self, item, spider):
         if item.__class__ == items.unused_genotype_data:
             return item
-        item_key = _item_key(item)
-        if item_key not in self.items_seen:
+        item_digest = _item_digest(item)
+        if item_digest not in self.items_seen:
             exporter = self.get_exporter(item)
             exporter.export_item(item)
-            self.items_seen.add(item_key)
+            self.items_seen.add(item_digest)
             return item
         raise DropItem("Duplicate item found: %s" % item)
 
+    def close_spider(self, spider):
+        for exporter in self.exporters.itervalues():
+            exporter.finish_exporting()
+        self.items_seen.close()
+
+class DcsvItemExporter(CsvItemExporter):
+    """
+    Export items like CsvItemExporter, but into a dcsv file.
+    """
+    def __init__(self, file, **kwargs):
+        CsvItemExporter.__init__(self, file, **kwargs)
+        self.csv_writer = dcsv.writer(file)
+
+    def finish_exporting(self):
+        self.csv_writer.flush()
+
 def _item_key(item):
     return (item.__class__, tuple(sorted(item.items(), key=lambda name_value: name_value[0])))
 
+def _item_digest(item):
+    """
+    Return a sha1 digest of _item_key(item) (unicode values are hashed as utf-8, so they match equal 
+    str values like they do in _item_key).
+    """
+    item_class, fields = _item_key(item)
+    h = hashlib.sha1(item_class.__name__)
+    for field in fields:
+        h.update(repr(tuple(_utf8(x) for x in field)))
+    return h.digest()
+
+def _utf8(x):
+    return x.encode('utf-8') if isinstance(x, unicode) else x
+
 def _filepath(filename):
     try:
         os.makedirs(_output_dir)
@@ -71,30 +124,241 @@ def _class_to_file(c):
     if c == items.unused_genotype_data:
         return _filepath('{}.json'.format(c.__name__))
     else:
-        return _filepath('{}.csv'.format(c.__name__))
+        return _filepath('{}.{}'.format(c.__name__, settings.CSV_OUTPUT_FORMAT))
 def _file_to_class(filename):
     classname = os.path.splitext(os.path.basename(filename))[0]
     return getattr(items, classname)
 
+class DatabasePipeline(object):
+    """
+    Insert items straight into the haplorec tables of an empty database (settings.DATABASE_PIPELINE 
+    is 'mysql' for a MySQL database created from src/sql/mysql/haplorec.sql, or 'sqlite' for a 
+    local SQLite stand-in, whose tables are created if needed), instead of going through 
+    CsvPipeline, collapse_scraped_data.py and load_dsv.py.
+
+    Items are buffered per table and written settings.DATABASE_PIPELINE_BATCH_SIZE rows at a time 
+    with multi-row upserts.  Rows with the same primary key are collapsed the same way 
+    collapse_by_key does (using the <table>_collapser hooks), by remembering the distinct rows seen 
+    for each primary key (spilled to disk past settings.DATABASE_PIPELINE_MAX_MEMORY_ITEMS) and 
+    overwriting the previously written row.  drug_recommendation ids are assigned in-process, so 
+    genotype_drug_recommendation rows reference them directly (like load_dsv's --map).
+
+    unused_genotype_data items aren't recorded.
+    """
+    def __init__(self, engine=settings.DATABASE_PIPELINE, db=settings.DATABASE_PIPELINE_DB, 
+            batch_size=settings.DATABASE_PIPELINE_BATCH_SIZE, 
+            max_memory_items=settings.DATABASE_PIPELINE_MAX_MEMORY_ITEMS, separator=_separator):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.separator = separator
+        if engine == 'mysql':
+            if oursql is None:
+                raise ImportError("DatabasePipeline needs oursql to insert into mysql")
+            self.db = oursql.connect(
+                host=settings.DATABASE_PIPELINE_HOST,
+                port=settings.DATABASE_PIPELINE_PORT,
+                user=settings.DATABASE_PIPELINE_USER,
+                passwd=settings.DATABASE_PIPELINE_PASSWORD,
+                db=db)
+        elif engine == 'sqlite':
+            self.db = sqlite3.connect(db)
+            self.db.executescript(_sqlite_schema)
+        else:
+            raise ValueError("Expected DATABASE_PIPELINE to be mysql or sqlite but saw {engine}".format(**locals()))
+        cursor = self.db.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM drug_recommendation")
+        self.last_drug_recommendation_id = cursor.fetchone()[0]
+        # (drug_name, gene_name, haplotype_name1, haplotype_name2) -> drug_recommendation.id
+        self.drug_recommendation_ids = {}
+        # (table, primary key) -> [non-key field values of distinct rows]
+        self.rows = spill.SpillDict(max_memory_items=max_memory_items)
+        # table -> primary keys whose collapsed rows haven't been written yet
+        self.pending = dict((table, collections.OrderedDict()) for table in _database_columns)
+
+    def process_item(self, item, spider):
+        table = item.__class__.__name__
+        if table not in _database_columns:
+            return item
+        key_fields, non_key_fields = _key_fields(item.__class__)
+        key = tuple(item.get(f, '') for f in key_fields)
+        if table == 'drug_recommendation' and key not in self.drug_recommendation_ids:
+            self.last_drug_recommendation_id += 1
+            self.drug_recommendation_ids[key] = self.last_drug_recommendation_id
+        elif table == 'genotype_drug_recommendation' and _drug_recommendation_key(item) not in self.drug_recommendation_ids:
+            spider.log("Missing drug_recommendation for {item}".format(**locals()), level=log.WARNING)
+            return item
+        values = tuple(item.get(f, '') for f in non_key_fields)
+        rows = self.rows.get((table, key), [])
+        if values not in rows:
+            self.rows[(table, key)] = rows + [values]
+            self.pending[table][key] = True
+            if len(self.pending[table]) >= self.batch_size:
+                self.flush(table)
+        return item
+
+    def flush(self, table):
+        """
+        Write the collapsed rows of table's pending primary keys (writing drug_recommendation's 
+        first if table references it).
+        """
+        if table == 'genotype_drug_recommendation':
+            self.flush('drug_recommendation')
+        if len(self.pending[table]) == 0:
+            return
+        item_class = getattr(items, table)
+        collapse = getattr(pipelines, table + '_collapser', _collapser)
+        key_fields, non_key_fields = _key_fields(item_class)
+        columns = _database_columns[table]
+        database_rows = []
+        for key in self.pending[table]:
+            rows = [dict(zip(non_key_fields, values)) for values in self.rows[(table, key)]]
+            row = collapse(key_fields, non_key_fields, key, rows, separator=self.separator)
+            if table == 'drug_recommendation':
+                row['id'] = self.drug_recommendation_ids[key]
+            elif table == 'genotype_drug_recommendation':
+                row['drug_recommendation_id'] = self.drug_recommendation_ids[_drug_recommendation_key(row)]
+            database_rows.append([row[c] for c in columns])
+        # sqlite limits the number of parameters in a statement (999 in older versions)
+        rows_per_statement = len(database_rows) if self.engine == 'mysql' else max(1, 999 // len(columns))
+        cursor = self.db.cursor()
+        for i in xrange(0, len(database_rows), rows_per_statement):
+            batch = database_rows[i:i + rows_per_statement]
+            cursor.execute(self.upsert_query(table, len(batch)), [v for r in batch for v in r])
+        self.db.commit()
+        self.pending[table].clear()
+
+    def upsert_query(self, table, num_rows):
+        """
+        Return a query that inserts num_rows rows into table, overwriting the non-key columns of 
+        rows that are already there.
+        """
+        columns = _database_columns[table]
+        conflict_columns = _database_conflict_columns[table]
+        update_columns = [c for c in columns if c not in conflict_columns]
+        query = "INSERT INTO {table} ({columns_str}) VALUES {values_str}".format(
+            table=table,
+            columns_str=', '.join(columns),
+            values_str=', '.join(['(' + ', '.join(['?'] * len(columns)) + ')'] * num_rows))
+        if self.engine == 'mysql':
+            return query + " ON DUPLICATE KEY UPDATE " + ', '.join(
+                "{c} = VALUES({c})".format(c=c) for c in update_columns or conflict_columns[:1])
+        if update_columns == []:
+            return query + " ON CONFLICT DO NOTHING"
+        return query + " ON CONFLICT ({conflict_columns_str}) DO UPDATE SET {updates_str}".format(
+            conflict_columns_str=', '.join(conflict_columns),
+            updates_str=', '.join("{c} = excluded.{c}".format(c=c) for c in update_columns))
+
+    def close_spider(self, spider):
+        for table in _database_columns:
+            self.flush(table)
+        self.rows.close()
+        self.db.close()
+
+# table -> columns written by DatabasePipeline (in the order tables are flushed)
+_database_columns = collections.OrderedDict([
+    ('drug_recommendation', ['id', 'drug_name', 'implications', 'recommendation', 'classification', 'diplotype_egs']),
+    ('gene_haplotype_variant', ['gene_name', 'haplotype_name', 'snp_id', 'allele']),
+    ('genotype_phenotype', ['gene_name', 'haplotype_name1', 'haplotype_name2', 'phenotype_name']),
+    ('genotype_drug_recommendation', ['gene_name', 'haplotype_name1', 'haplotype_name2', 'drug_recommendation_id']),
+])
+# table -> its primary key in haplorec
+_database_conflict_columns = {
+    'drug_recommendation': ['id'],
+    'gene_haplotype_variant': ['gene_name', 'haplotype_name', 'snp_id', 'allele'],
+    'genotype_phenotype': ['gene_name', 'haplotype_name1', 'haplotype_name2'],
+    'genotype_drug_recommendation': ['gene_name', 'haplotype_name1', 'haplotype_name2', 'drug_recommendation_id'],
+}
+
+_sqlite_schema = """
+CREATE TABLE IF NOT EXISTS drug_recommendation (
+    id integer primary key,
+    drug_name text,
+    implications text,
+    recommendation text,
+    classification text,
+    diplotype_egs text
+);
+CREATE TABLE IF NOT EXISTS gene_haplotype_variant (
+    gene_name text,
+    haplotype_name text,
+    snp_id text,
+    allele text,
+    primary key (gene_name, haplotype_name, snp_id, allele)
+);
+CREATE TABLE IF NOT EXISTS genotype_phenotype (
+    gene_name text,
+    haplotype_name1 text,
+    haplotype_name2 text,
+    phenotype_name text,
+    primary key (gene_name, haplotype_name1, haplotype_name2)
+);
+CREATE TABLE IF NOT EXISTS genotype_drug_recommendation (
+    gene_name text,
+    haplotype_name1 text,
+    haplotype_name2 text,
+    drug_recommendation_id integer references drug_recommendation(id),
+    primary key (gene_name, haplotype_name1, haplotype_name2, drug_recommendation_id)
+);
+"""
+
+def _key_fields(item_class):
+    """
+    Return (primary key fields, other fields) of item_class, in sorted order.
+    """
+    key_fields = sorted(item_class.primary_key)
+    return key_fields, sorted(f for f in item_class.fields.keys() if f not in item_class.primary_key)
+
+def _drug_recommendation_key(row):
+    return tuple(row.get(f, '') for f in ['drug_name', 'gene_name', 'haplotype_name1', 'haplotype_name2'])
+
 # post-processing of generated *.csv files (i.e. processing the depends on having all the scraped data to 
 # perform, such as collapsing lines would otherwise cause duplicate primary-key errors upon insertion into mysql)
 
-def _dup_map(dicts, key):
+def _sorted_by_key(dicts, key, max_memory_rows=100000):
     """
-    Group dicts into based on their values (d[key[0]], ..., d[key[n]]).
+    Yield (k, dict) for each of dicts in order of k = (d[key[0]], ..., d[key[n]]), holding at most 
+    max_memory_rows dicts in memory (runs of that many sorted dicts are written to temporary files, 
+    then merged).
 
-    >>> _dup_map([{'f1': 1, 'f2': 2}, {'f1': 1, 'f2': 3}, {'f1': 4, 'f2': 2}], ['f1'])
-    defaultdict(<type 'list'>, {
-        (1,): [{'f1': 1, 'f2': 2}, {'f1': 1, 'f2': 3}], 
-        (4,): [{'f1': 4, 'f2': 2}]
-    })
+    >>> list(_sorted_by_key([{'f1': 4, 'f2': 2}, {'f1': 1, 'f2': 3}, {'f1': 1, 'f2': 2}], ['f1'], max_memory_rows=1))
+    [((1,), {'f1': 1, 'f2': 3}), ((1,), {'f1': 1, 'f2': 2}), ((4,), {'f1': 4, 'f2': 2})]
     """
-    d = collections.defaultdict(list)
-    for dict in dicts:
-        d[tuple(dict[k] for k in key)].append(dict)
-    return d
+    runs = []
+    try:
+        # (k, i, dict), where i makes the sort stable and avoids comparing dicts
+        run = []
+        for i, dict in enumerate(dicts):
+            run.append((tuple(dict[k] for k in key), i, dict))
+            if len(run) >= max_memory_rows:
+                run.sort()
+                runs.append(_write_run(run))
+                run = []
+        run.sort()
+        if runs == []:
+            merged = iter(run)
+        else:
+            runs.append(_write_run(run))
+            merged = heapq.merge(*[_read_run(f) for f in runs])
+        for k, i, dict in merged:
+            yield k, dict
+    finally:
+        for f in runs:
+            f.close()
+
+def _write_run(run):
+    f = tempfile.TemporaryFile()
+    for x in run:
+        marshal.dump(x, f)
+    f.seek(0)
+    return f
+
+def _read_run(f):
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
+            return
 
-_separator = '. '
 
 def _collapser(key_fields, non_key_fields, k, rows, field_collapsers={}, separator=_separator):
     """
@@ -131,21 +395,38 @@ def genotype_phenotype_collapser(key_fields, non_key_fields, k, rows, separator=
         'phenotype_name': phenotype_name_collapser,
     }, separator=separator)
 
-def collapse_by_key(input_file, output, delim=',', separator=_separator):
+def collapse_by_key(input_file, output, delim=',', separator=_separator, max_memory_rows=100000, dcsv_output=False):
     """
     Given a file output by the scrapy pipeline (e.g. "tmp/scrapy/genotype_phenotype.csv"), collapse 
     rows with identical primary keys by joining fields on separator (or use some table specific 
     collapsing strategy <table_name>_collapser).
+
+    Rows are sorted by primary key with an external merge sort (see _sorted_by_key), so at most 
+    max_memory_rows rows are held in memory regardless of the size of input_file.  Collapsed rows 
+    are output in primary key order.
+
+    input_file may be a dcsv file (<table_name>.dcsv); if dcsv_output, output is written as dcsv 
+    too.
     """
     item_class = _file_to_class(input_file)
     collapse = getattr(pipelines, item_class.__name__ + '_collapser', _collapser)
-    input = fileinput.FileInput([input_file])
-    reader = csv.DictReader(input, delimiter=delim)
-    key_fields = item_class.primary_key
+    if dcsv.is_dcsv(input_file):
+        input = open(input_file, 'rb')
+        reader = dcsv.DictReader(input)
+    else:
+        input = fileinput.FileInput([input_file])
+        reader = csv.DictReader(input, delimiter=delim)
+    key_fields = sorted(item_class.primary_key)
     non_key_fields = set([x for x in item_class.fields.keys() if x not in key_fields])
-    writer = csv.DictWriter(output, reader.fieldnames, delimiter=delim)
+    if dcsv_output:
+        writer = dcsv.DictWriter(output, reader.fieldnames)
+    else:
+        writer = csv.DictWriter(output, reader.fieldnames, delimiter=delim)
     writer.writeheader()
-    for k, rows in _dup_map(reader, key_fields).iteritems():
+    for k, group in itertools.groupby(_sorted_by_key(reader, key_fields, max_memory_rows), key=lambda k_row: k_row[0]):
+        rows = [row for k, row in group]
         row = collapse(key_fields, non_key_fields, k, rows, separator=separator)
         writer.writerow(row)
+    if dcsv_output:
+        writer.flush()
     input.close()
@@ -19,10 +19,93 @@ NEWSPIDER_MODULE = 'pharmgkb.spiders'
 # use a delay to prevent hitting the pharmgkb server too hard
 DOWNLOAD_DELAY = 1 
 
-ITEM_PIPELINES = [
-        'pharmgkb.pipelines.CsvPipeline',
+# set ENDPOINT_THROTTLE=1 to pace each class of pharmgkb url in its own download slot instead of 
+# DOWNLOAD_DELAY, adapting its concurrency and delay to the latency and errors of its responses, 
+# within these politeness limits (which each endpoint may override); see 
+# pharmgkb.middlewares.EndpointThrottleMiddleware
+ENDPOINT_THROTTLE_ENABLED = os.environ.get('ENDPOINT_THROTTLE', '') not in ['', '0']
+ENDPOINT_THROTTLE_ENDPOINTS = [
+        # (name, url regex, limits)
+        ('gene', r'/gene/PA\d+', {'max_concurrency': 1}),
+        ('guideline_picker', r'/views/ajaxGuidelinePickerData\.action', {'max_concurrency': 2}),
+        ('allele_guidelines', r'/views/alleleGuidelines\.action', {'max_concurrency': 4}),
 ]
+ENDPOINT_THROTTLE_START_DELAY = DOWNLOAD_DELAY
+ENDPOINT_THROTTLE_MIN_DELAY = 0.25
+ENDPOINT_THROTTLE_MAX_DELAY = 60
+ENDPOINT_THROTTLE_MAX_CONCURRENCY = 1
+# fraction of an endpoint's responses (counting at least ENDPOINT_THROTTLE_ERROR_BUDGET_RESPONSES) 
+# that may be errors (ENDPOINT_THROTTLE_ERROR_CODES responses or failed downloads) before it stops 
+# speeding up
+ENDPOINT_THROTTLE_ERROR_BUDGET = 0.01
+ENDPOINT_THROTTLE_ERROR_BUDGET_RESPONSES = 100
+ENDPOINT_THROTTLE_ERROR_CODES = [429, 500, 502, 503, 504]
+# drop a concurrent request when the smoothed latency exceeds this many times the lowest seen
+ENDPOINT_THROTTLE_LATENCY_TOLERANCE = 2.
+ENDPOINT_THROTTLE_DEBUG = False
+
+# only request one heterozygous genotype per pair of haplotype function classes, inferring the rest 
+# (and requesting a PRUNE_GENOTYPES_VERIFY_RATE fraction of the rest to check the inferences); see 
+# pharmgkb.spiders.Gene.GenotypePruner
+PRUNE_GENOTYPES = os.environ.get('PRUNE_GENOTYPES', '') not in ['', '0']
+PRUNE_GENOTYPES_VERIFY_RATE = float(os.environ.get('PRUNE_GENOTYPES_VERIFY_RATE', 0.05))
+
+# parse pages with precompiled lxml XPath (pharmgkb.parsers.compiled) instead of HtmlXPathSelector 
+# queries; the items are the same
+COMPILED_XPATH = os.environ.get('COMPILED_XPATH', '1') not in ['', '0']
+
+# number of distinct drug recommendation responses to keep parsed fields for; see 
+# pharmgkb.spiders.Gene.RecommendationCache
+RECOMMENDATION_CACHE_SIZE = 10000
+
+EXTENSIONS = {
+        'pharmgkb.extensions.RecommendationCacheStats': 500,
+}
+
+# set DATABASE_PIPELINE to mysql or sqlite to insert items straight into DATABASE_PIPELINE_DB (a 
+# mysql database name or sqlite file), instead of writing csv files into CSV_OUTPUT_DIR
+DATABASE_PIPELINE = os.environ.get('DATABASE_PIPELINE')
+DATABASE_PIPELINE_DB = os.environ.get('DATABASE_PIPELINE_DB', os.environ.get('HAPLOREC_DB_NAME', 'haplorec'))
+DATABASE_PIPELINE_HOST = os.environ.get('DATABASE_PIPELINE_HOST', 'localhost')
+DATABASE_PIPELINE_PORT = int(os.environ.get('DATABASE_PIPELINE_PORT', 3306))
+DATABASE_PIPELINE_USER = os.environ.get('DATABASE_PIPELINE_USER', 'root')
+DATABASE_PIPELINE_PASSWORD = os.environ.get('DATABASE_PIPELINE_PASSWORD', '')
+# rows per table to buffer before upserting them
+DATABASE_PIPELINE_BATCH_SIZE = 1000
+# distinct rows to keep in memory for collapsing rows with the same primary key before spilling to disk
+DATABASE_PIPELINE_MAX_MEMORY_ITEMS = 1000000
+
+if DATABASE_PIPELINE is None:
+    ITEM_PIPELINES = [
+            'pharmgkb.pipelines.CsvPipeline',
+    ]
+else:
+    ITEM_PIPELINES = [
+            'pharmgkb.pipelines.DatabasePipeline',
+    ]
 CSV_OUTPUT_DIR = os.environ.get('CSV_OUTPUT_DIR', '.')
+# csv, or dcsv for compact dictionary-encoded files (see src/python/dcsv.py)
+CSV_OUTPUT_FORMAT = os.environ.get('CSV_OUTPUT_FORMAT', 'csv')
+# number of item digests CsvPipeline keeps in memory for dropping duplicates before spilling to disk
+CSV_DEDUP_MAX_MEMORY_ITEMS = int(os.environ.get('CSV_DEDUP_MAX_MEMORY_ITEMS', 1000000))
 
 HTTPCACHE_ENABLED = True
 HTTPCACHE_DIR = 'cache'
+# keep cached responses compressed in a single sqlite database (cache/<spider>.sqlite), which starts 
+# out with the responses of scrapy's default dbm cache (cache/<spider>.db) if there is one; see 
+# pharmgkb.httpcache.SqliteCacheStorage
+HTTPCACHE_STORAGE = 'pharmgkb.httpcache.SqliteCacheStorage'
+# delete expired responses and shrink the cache when the spider closes
+HTTPCACHE_SQLITE_COMPACT = False
+
+# replay the crawl without downloading anything: requests are served from the HTTPCACHE store, then 
+# from a "wget -r" mirror of pharmgkb in OFFLINE_MIRROR_DIR (if set), and dropped otherwise; see 
+# pharmgkb.middlewares.OfflineReplayMiddleware
+OFFLINE = os.environ.get('OFFLINE', '') not in ['', '0']
+OFFLINE_MIRROR_DIR = os.environ.get('OFFLINE_MIRROR_DIR')
+DOWNLOADER_MIDDLEWARES = {
+        # after HttpCacheMiddleware (900), so only requests missing from the cache reach it
+        'pharmgkb.middlewares.OfflineReplayMiddleware': 950,
+        # after OfflineReplayMiddleware, so only requests that are downloaded are throttled
+        'pharmgkb.middlewares.EndpointThrottleMiddleware': 960,
+}
@@ -4,11 +4,21 @@ from scrapy.selector import HtmlXPathSelector
 from scrapy.http.request.form import FormRequest
 from pharmgkb import items
 from pharmgkb import parsers
+from pharmgkb import settings
 from pharmgkb.spiders import as_func
-from pharmgkb.parsers.text import parse
+from pharmgkb.parsers.text import parse, ParserError
+try:
+    from pharmgkb.parsers import compiled
+except ImportError:
+    # lxml isn't installed (scrapy is using its libxml2 selectors)
+    compiled = None
 
 import itertools
+import functools
+import hashlib
+import random
 import re
+import sys
 import json
 import urlparse
 import collections
@@ -25,17 +35,18 @@ def _spider_request_callback(spider, response):
     Default callback for spider_request, which is to just call spider.parse on the response.
     """
     return spider.parse(response)
-def spider_request(spider_class, response, callback=_spider_request_callback, **kwargs):
+def spider_request(spider_class, response, callback=_spider_request_callback, errback=None, **kwargs):
     """
     Return a scrapy Request object to handle whatever url's are handled by spider_class, but use the 
     same domain as response.url.
 
-    spider_class must have a .request(base_url, callback) method, which generates a scrapy Request 
-    whose response is handled by the provided callback.
+    spider_class must have a .request(base_url, callback, errback) method, which generates a scrapy 
+    Request whose response is handled by the provided callback (and whose failure is handled by 
+    errback).
     """
     base_url = get_domain(response.url)
     spider = spider_class(base_url, **kwargs)
-    return spider.request(base_url, lambda r: callback(spider, r))
+    return spider.request(base_url, lambda r: callback(spider, r), errback=errback)
 
 class GeneSpider(BaseSpider):
     """
@@ -62,10 +73,16 @@ class GeneSpider(BaseSpider):
     def parse(self, response):
         hxs = HtmlXPathSelector(response)
         gene_name = re.search(r'^(.*)\s*\[PharmGKB\]$', hxs.select('//title/text()')[0].extract()).group(1).rstrip()
-        haplotypes_table = hxs.select('//div[@id="tabHaplotypes"]/article[@class="HaplotypeSet"]/*/table')
-        if haplotypes_table != []:
+        if use_compiled_xpath():
+            haplotypes_table = compiled.haplotypes_table(response)
+            parse_haplotypes_table = self.parse_haplotypes_table_compiled
+        else:
+            haplotypes_table = hxs.select('//div[@id="tabHaplotypes"]/article[@class="HaplotypeSet"]/*/table')
+            haplotypes_table = haplotypes_table[0] if haplotypes_table != [] else None
+            parse_haplotypes_table = self.parse_haplotypes_table
+        if haplotypes_table is not None:
             # This gene has a "Haplotypes" tab on its page.
-            for gene_haplotype_variant in self.parse_haplotypes_table(haplotypes_table[0], gene_name):
+            for gene_haplotype_variant in parse_haplotypes_table(haplotypes_table, gene_name):
                 yield gene_haplotype_variant
 
         base_url = get_domain(response.url)
@@ -81,17 +98,34 @@ class GeneSpider(BaseSpider):
                     annotation_id=annotation_id,
                     drug_name=drug_name,
                     gene_name=gene_name,
-                    snp_to_haplotype=self.snp_to_haplotype)
+                    snp_to_haplotype=self.snp_to_haplotype,
+                    prune_genotypes=settings.PRUNE_GENOTYPES,
+                    verify_rate=settings.PRUNE_GENOTYPES_VERIFY_RATE)
 
     def parse_haplotypes_table(self, haplotypes_table, gene_name):
-        self.snp_to_haplotype = collections.defaultdict(set)
         t = parsers.table(haplotypes_table)
         header = t.next()
         snp_ids = header.select('text() | a/text()')[1:].extract()
-        alleles = {}
-        for row in t:
-            haplotype_name = row[0].select('a/text()')[0].extract()
-            for snp_allele in itertools.izip(snp_ids, [r.select('text()').extract()[0].strip() for r in row[1:]]):
+        rows = ((row[0].select('a/text()')[0].extract(), [r.select('text()').extract()[0].strip() for r in row[1:]]) for row in t)
+        return self.gene_haplotype_variants(gene_name, snp_ids, rows)
+
+    def parse_haplotypes_table_compiled(self, haplotypes_table, gene_name):
+        """
+        Same as parse_haplotypes_table, but for the lxml element of the table, extracting all its 
+        cells at once with precompiled XPath (see pharmgkb.parsers.compiled).
+        """
+        header, cells = compiled.table_cells(haplotypes_table)
+        rows = ((unicode(compiled.LINK_TEXT(row[0])[0]), [compiled.first_text(c).strip() for c in row[1:]]) for row in cells)
+        return self.gene_haplotype_variants(gene_name, header[1:], rows)
+
+    def gene_haplotype_variants(self, gene_name, snp_ids, rows):
+        """
+        Generate gene_haplotype_variant's from the (haplotype_name, [allele for each snp_id]) rows of 
+        a gene's haplotypes table.
+        """
+        self.snp_to_haplotype = collections.defaultdict(set)
+        for haplotype_name, alleles in rows:
+            for snp_allele in itertools.izip(snp_ids, alleles):
                 self.snp_to_haplotype[snp_allele].add(haplotype_name)
                 yield items.gene_haplotype_variant(
                         gene_name=gene_name,
@@ -107,14 +141,14 @@ class FormRequestSpider(object):
     def __init__(self):
         self.formdata = {}
 
-    def request(self, base_url, callback):
+    def request(self, base_url, callback, errback=None):
         """
         Return a FormRequest object whose formdata fields are fields in self.formdata_fields that 
         are also in self.kwargs.
         """
         for name, attr in self.formdata_fields:
             self.formdata[name] = self.kwargs[attr]
-        return FormRequest(base_url + self.url, formdata=self.formdata, callback=callback)
+        return FormRequest(base_url + self.url, formdata=self.formdata, callback=callback, errback=errback)
         
     def start_requests(self):
         return [self.request(self.base_url, self.parse, **self.kwargs)]
@@ -144,7 +178,8 @@ class GeneHaplotypeSpider(FormRequestSpider, BaseSpider):
 
     This spider crawls out to:
 
-    * :class:`.HaplotypeGenotypeSpider`'s for each pair of haplotypes for this gene
+    * :class:`.HaplotypeGenotypeSpider`'s for each pair of haplotypes for this gene (or, with 
+      prune_genotypes, for the pairs requested by a :class:`.GenotypePruner`)
     * :class:`.SnpGenotypeSpider`'s for each SNP for this gene
     """
     name = "GeneHaplotypes"
@@ -160,7 +195,7 @@ class GeneHaplotypeSpider(FormRequestSpider, BaseSpider):
             ('annotationId', 'annotation_id'),
         ]
 
-    def parse_form_response(self, response, annotation_id=None, drug_name=None, snp_to_haplotype=None, gene_name=None):
+    def parse_form_response(self, response, annotation_id=None, drug_name=None, snp_to_haplotype=None, gene_name=None, prune_genotypes=False, verify_rate=0.):
         result = None
         try:
             result = json.loads(response.body)
@@ -174,10 +209,13 @@ class GeneHaplotypeSpider(FormRequestSpider, BaseSpider):
                 gene_name = r['gene']
                 haplotype_names = [haplotype['name'] for haplotype in r['haps']]
                 haplotype_ids = [haplotype['value'] for haplotype in r['haps']]
-                for haplotype1, haplotype2 in [sorted(genotype, key=lambda haplotype: haplotype[0]) for genotype in itertools.combinations_with_replacement(itertools.izip(haplotype_names, haplotype_ids), 2)]:
+                genotypes = [tuple(sorted(genotype, key=lambda haplotype: haplotype[0])) for genotype in itertools.combinations_with_replacement(itertools.izip(haplotype_names, haplotype_ids), 2)]
+                def genotype_request(haplotype1, haplotype2, callback=_spider_request_callback, errback=None, gene_name=gene_name):
                     haplotype_name1, haplotype_id1 = haplotype1
                     haplotype_name2, haplotype_id2 = haplotype2
-                    yield spider_request(HaplotypeGenotypeSpider, response, 
+                    return spider_request(HaplotypeGenotypeSpider, response, 
+                        callback=callback,
+                        errback=errback,
                         haplotype_name1=haplotype_name1,
                         haplotype_name2=haplotype_name2,
                         haplotype_id1=haplotype_id1,
@@ -185,6 +223,14 @@ class GeneHaplotypeSpider(FormRequestSpider, BaseSpider):
                         gene_name=gene_name,
                         drug_name=drug_name,
                         annotation_id=annotation_id)
+                if prune_genotypes:
+                    pruner = GenotypePruner(genotypes, genotype_request, verify_rate=verify_rate,
+                            description="{gene_name} ({drug_name})".format(**locals()))
+                    for request in pruner.start_requests():
+                        yield request
+                else:
+                    for haplotype1, haplotype2 in genotypes:
+                        yield genotype_request(haplotype1, haplotype2)
             elif 'rsid' in r and 'alleles' in r:
                 snp_id = r['rsid']
                 genotype_names = r['alleles']
@@ -197,6 +243,165 @@ class GeneHaplotypeSpider(FormRequestSpider, BaseSpider):
                             drug_name=drug_name,
                             annotation_id=annotation_id)
 
+class GenotypePruner(object):
+    """
+    Request the drug recommendations of a gene's genotypes (for one drug) in two phases, to avoid 
+    requesting every pair of haplotypes:
+
+    1. Request each homozygous genotype, and learn the function class of its haplotype from the 
+       "Phenotype (Genotype)" of its recommendation (e.g. "An individual carrying two 
+       non-functional alleles" => non-functional).
+    2. Once all homozygous genotypes are in, request one representative heterozygous genotype for 
+       each pair of function classes, and infer the items of the other genotypes with the same 
+       pair of function classes from it.  A random verify_rate fraction of the inferred genotypes 
+       are also requested, and an error is logged if their items differ from the inferred ones.  
+       Genotypes with a haplotype whose function class couldn't be learned are all requested.
+
+    genotypes are pairs of (haplotype_name, haplotype_id), and request(haplotype1, haplotype2, 
+    callback, errback) returns a HaplotypeGenotypeSpider request for a genotype, whose response is 
+    handled by callback(spider, response).
+    """
+    def __init__(self, genotypes, request, verify_rate=0., description='', rand=None):
+        self.genotypes = genotypes
+        self.request = request
+        self.verify_rate = verify_rate
+        self.description = description
+        self.rand = rand if rand is not None else random.Random()
+        # haplotype -> function class (or None if it couldn't be learned)
+        self.function_class = {}
+        self.homozygotes = [haplotype1 for haplotype1, haplotype2 in genotypes if haplotype1 == haplotype2]
+
+    def start_requests(self):
+        for haplotype in self.homozygotes:
+            yield self.request(haplotype, haplotype,
+                    callback=functools.partial(self.parse_homozygote, haplotype),
+                    errback=functools.partial(self.homozygote_failed, haplotype))
+
+    def parse_homozygote(self, haplotype, spider, response):
+        try:
+            parsed = list(spider.parse(response))
+        except Exception:
+            # still request the heterozygotes (all of this haplotype's), then report the error
+            error = sys.exc_info()
+            self.function_class[haplotype] = None
+            if len(self.function_class) == len(self.homozygotes):
+                for request in self.heterozygote_requests(spider):
+                    yield request
+            raise error[0], error[1], error[2]
+        for item in parsed:
+            yield item
+        self.function_class[haplotype] = function_class(parsed)
+        if len(self.function_class) == len(self.homozygotes):
+            for request in self.heterozygote_requests(spider):
+                yield request
+
+    def homozygote_failed(self, haplotype, failure):
+        self.log("{description}: failed to request homozygote {haplotype}, requesting all its heterozygotes: {failure}".format(
+            description=self.description, haplotype=haplotype[0], failure=failure.getErrorMessage()), level=scrapy.log.WARNING)
+        self.function_class[haplotype] = None
+        if len(self.function_class) == len(self.homozygotes):
+            return list(self.heterozygote_requests(None))
+        return []
+
+    def heterozygote_requests(self, spider):
+        requested = 0
+        verified = 0
+        # (function class, function class) -> [genotype]
+        by_function_classes = collections.OrderedDict()
+        for haplotype1, haplotype2 in self.genotypes:
+            if haplotype1 == haplotype2:
+                continue
+            classes = (self.function_class.get(haplotype1), self.function_class.get(haplotype2))
+            if None in classes:
+                requested += 1
+                yield self.request(haplotype1, haplotype2)
+            else:
+                by_function_classes.setdefault(tuple(sorted(classes)), []).append((haplotype1, haplotype2))
+        for genotypes in by_function_classes.itervalues():
+            verify = [g for g in genotypes[1:] if self.rand.random() < self.verify_rate]
+            infer = [g for g in genotypes[1:] if g not in verify]
+            requested += 1 + len(verify)
+            verified += len(verify)
+            yield self.request(*genotypes[0],
+                    callback=functools.partial(self.parse_representative, infer, verify),
+                    errback=functools.partial(self.representative_failed, genotypes[0], infer + verify))
+        self.log("{description}: requesting {requested} of {total} heterozygous genotypes ({verified} to verify inferences)".format(
+            description=self.description,
+            total=len(self.genotypes) - len(self.homozygotes),
+            **locals()), level=scrapy.log.INFO, spider=spider)
+
+    def log(self, msg, level, spider=None):
+        if spider is not None:
+            spider.log(msg, level=level)
+        else:
+            scrapy.log.msg(msg, level=level)
+
+    def parse_representative(self, infer, verify, spider, response):
+        parsed = list(spider.parse(response))
+        for item in parsed:
+            yield item
+        for genotype in infer:
+            for item in rebind_genotype(parsed, *genotype):
+                yield item
+        for genotype in verify:
+            yield self.request(*genotype, callback=functools.partial(self.parse_verification, rebind_genotype(parsed, *genotype)))
+
+    def representative_failed(self, representative, genotypes, failure):
+        """
+        The request for the representative of a pair of function classes failed, so request each 
+        of the genotypes that would have been inferred from it (or verified) instead.
+        """
+        self.log("{description}: failed to request representative genotype {haplotype1}/{haplotype2}, requesting its {n} genotypes instead: {failure}".format(
+            description=self.description,
+            haplotype1=representative[0][0],
+            haplotype2=representative[1][0],
+            n=len(genotypes),
+            failure=failure.getErrorMessage()), level=scrapy.log.WARNING)
+        return [self.request(*genotype) for genotype in genotypes]
+
+    def parse_verification(self, expected, spider, response):
+        parsed = list(spider.parse(response))
+        if [dict(item) for item in parsed] != [dict(item) for item in expected]:
+            spider.log("{description}: inferred items differ from the crawled ones for {formdata}".format(
+                description=self.description, formdata=spider.formdata), level=scrapy.log.ERROR)
+        for item in parsed:
+            yield item
+
+def function_class(parsed):
+    """
+    Return the function class of a haplotype given the items parsed from its homozygous genotype's 
+    drug recommendation, or None if it can't be determined.
+    """
+    for item in parsed:
+        if isinstance(item, items.genotype_phenotype) and item.get('phenotype_genotype') is not None:
+            try:
+                allele_pairs = parse('phenotype_genotype', item['phenotype_genotype'])
+            except ParserError:
+                return None
+            classes = set(allele1 for allele1, allele2 in allele_pairs if allele1 == allele2)
+            if len(classes) == 1:
+                return classes.pop()
+            return None
+    return None
+
+def rebind_genotype(parsed, haplotype1, haplotype2):
+    """
+    Return copies of items parsed from a HaplotypeGenotypeSpider response, for the genotype 
+    (haplotype1, haplotype2) instead.
+    """
+    haplotype_name1, haplotype_id1 = haplotype1
+    haplotype_name2, haplotype_id2 = haplotype2
+    rebound = []
+    for item in parsed:
+        item = item.__class__(item)
+        if isinstance(item, items.unused_genotype_data):
+            item['source'] = dict(item['source'], allele1=haplotype_id1, allele2=haplotype_id2)
+        else:
+            item['haplotype_name1'] = haplotype_name1
+            item['haplotype_name2'] = haplotype_name2
+        rebound.append(item)
+    return rebound
+
 class BaseGenotypeSpider(FormRequestSpider, BaseSpider):
     """
     Abstract class for spiders that crawl drug recommmendation urls.
@@ -222,52 +427,131 @@ class BaseGenotypeSpider(FormRequestSpider, BaseSpider):
         yield genotype_drug_recommendation 
 
     def parse_form_response(self, response, **kwargs):
-        hxs = HtmlXPathSelector(response)
-
-        if len(hxs.select('//text()').re('This guideline does not contain recommendations')) != 0:
+        # many genotypes share a drug recommendation, so reuse the parsed fields of identical 
+        # responses, and only fill in the genotype-specific fields (init_items) for each
+        recommendation = recommendation_cache.get(
+                (hashlib.sha1(response.body).digest(), kwargs['location']),
+                kwargs['gene_name'],
+                lambda: parse_recommendation(response, kwargs['location']))
+        if recommendation is None:
             return
+        drug_recommendation_fields, genotype_phenotype_fields, unused_values = recommendation
 
         drug_recommendation, genotype_phenotype, genotype_drug_recommendation = self.init_items(**kwargs)
-
-        def strip_title(t):
-            t = t.strip()
-            m = re.search(r'^Recommendations\s*\(Strength:\s*([^)]*)\)', t)
-            if m:
-                return ('Recommendations', m.group(1))
-            return t
-
-        title_value = dict(itertools.izip([strip_title(t) for t in hxs.select('//dt/*/text()').extract()],
-                           [' '.join(h.select('(* | */*)/text()').extract()) for h in hxs.select('//dd')]))
-
-        # A mapping from location (gene_name in the case of HaplotypeGenotypeSpider, snp_id in the 
-        # case of SnpGenotypeSpider) that specifies what field from the drug recommendation to use 
-        # instead of "Phenotype (Genotype)". Some recommendations have unique fields.
-        phenotype_exceptions = { 
-            'CYP2C19': 'Metabolizer Status',
-            'CYP2D6': 'Metabolizer Status',
-        }
-
-        unused_genotype_data = items.unused_genotype_data(values={}, source=self.formdata)
-        for title, value in title_value.iteritems():
-            if type(title) is tuple and title[0] == 'Recommendations':
-                drug_recommendation['classification'] = title[1]               
-                drug_recommendation['recommendation'] = value
-            elif title == 'Phenotype (Genotype)' and kwargs['location'] not in phenotype_exceptions:
-                genotype_phenotype['phenotype_name'] = items.process.phenotype_name(value)
-            elif title == 'Implications':
-                drug_recommendation['implications'] = value
-            elif kwargs['location'] in phenotype_exceptions and title == phenotype_exceptions[kwargs['location']]:
-                genotype_phenotype['phenotype_name'] = items.process.phenotype_name(value)
-            else:
-                unused_genotype_data['values'][title] = value
-            if title == 'Phenotype (Genotype)':
-                genotype_phenotype['phenotype_genotype'] = value
+        drug_recommendation.update(drug_recommendation_fields)
+        genotype_phenotype.update(genotype_phenotype_fields)
+        unused_genotype_data = items.unused_genotype_data(values=dict(unused_values), source=self.formdata)
 
         for item in self.yield_items(genotype_phenotype, drug_recommendation, genotype_drug_recommendation):
             yield item
         if unused_genotype_data['values'] != {}:
             yield unused_genotype_data
 
+def use_compiled_xpath():
+    """
+    Return True if pages should be parsed with precompiled XPath (pharmgkb.parsers.compiled) 
+    instead of HtmlXPathSelector queries (settings.COMPILED_XPATH, if lxml is installed).
+    """
+    return settings.COMPILED_XPATH and compiled is not None
+
+def parse_recommendation(response, location, compiled_xpath=None):
+    """
+    Parse a drug recommendation response (see BaseGenotypeSpider) for location, returning the 
+    fields it defines for a drug_recommendation, the fields it defines for a genotype_phenotype, 
+    and the values it has that we don't consider (for an unused_genotype_data).  Return None if 
+    the response has no recommendations.
+
+    The response is parsed with precompiled XPath if compiled_xpath (by default, 
+    use_compiled_xpath()); either way the fields are the same.
+    """
+    if compiled_xpath is None:
+        compiled_xpath = use_compiled_xpath()
+    if compiled_xpath:
+        titles_values = compiled.recommendation_titles_values(response)
+    else:
+        titles_values = recommendation_titles_values(response)
+    if titles_values is None:
+        return None
+    titles, values = titles_values
+
+    drug_recommendation = {}
+    genotype_phenotype = {}
+    unused_values = {}
+
+    def strip_title(t):
+        t = t.strip()
+        m = re.search(r'^Recommendations\s*\(Strength:\s*([^)]*)\)', t)
+        if m:
+            return ('Recommendations', m.group(1))
+        return t
+
+    title_value = dict(itertools.izip([strip_title(t) for t in titles], values))
+
+    # A mapping from location (gene_name in the case of HaplotypeGenotypeSpider, snp_id in the 
+    # case of SnpGenotypeSpider) that specifies what field from the drug recommendation to use 
+    # instead of "Phenotype (Genotype)". Some recommendations have unique fields.
+    phenotype_exceptions = { 
+        'CYP2C19': 'Metabolizer Status',
+        'CYP2D6': 'Metabolizer Status',
+    }
+
+    for title, value in title_value.iteritems():
+        if type(title) is tuple and title[0] == 'Recommendations':
+            drug_recommendation['classification'] = title[1]               
+            drug_recommendation['recommendation'] = value
+        elif title == 'Phenotype (Genotype)' and location not in phenotype_exceptions:
+            genotype_phenotype['phenotype_name'] = items.process.phenotype_name(value)
+        elif title == 'Implications':
+            drug_recommendation['implications'] = value
+        elif location in phenotype_exceptions and title == phenotype_exceptions[location]:
+            genotype_phenotype['phenotype_name'] = items.process.phenotype_name(value)
+        else:
+            unused_values[title] = value
+        if title == 'Phenotype (Genotype)':
+            genotype_phenotype['phenotype_genotype'] = value
+
+    return drug_recommendation, genotype_phenotype, unused_values
+
+def recommendation_titles_values(response):
+    """
+    Given a drug recommendation response, return the titles (<dt>) and values (<dd>) of its 
+    fields, or None if it has no recommendations.
+    """
+    hxs = HtmlXPathSelector(response)
+    if len(hxs.select('//text()').re('This guideline does not contain recommendations')) != 0:
+        return None
+    return hxs.select('//dt/*/text()').extract(), [' '.join(h.select('(* | */*)/text()').extract()) for h in hxs.select('//dd')]
+
+class RecommendationCache(object):
+    """
+    Remember the results of up to max_entries computations (e.g. parse_recommendation's), counting 
+    hits and misses per gene (see pharmgkb.extensions.RecommendationCacheStats).  The oldest entry 
+    is evicted once it's full.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        # gene_name -> count
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def get(self, key, gene_name, compute):
+        """
+        Return the result of compute() cached for key, calling it if it isn't cached.
+        """
+        if key in self.entries:
+            self.hits[gene_name] += 1
+            return self.entries[key]
+        self.misses[gene_name] += 1
+        value = compute()
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+# shared by all BaseGenotypeSpider's (a new spider is created for each request)
+recommendation_cache = RecommendationCache(settings.RECOMMENDATION_CACHE_SIZE)
+
 class HaplotypeGenotypeSpider(BaseGenotypeSpider):
     """
     Crawl starting at a drug recommendation from a "Lookup your guideline" dialog.
@@ -0,0 +1,198 @@
+"""
+Containers that keep a bounded number of entries in memory, and spill the rest to an on-disk sqlite
+database.
+"""
+
+import sqlite3
+import marshal
+import hashlib
+import struct
+import tempfile
+import threading
+import os
+
+class SpillDict(object):
+    """
+    A dict-like mapping that holds at most max_memory_items entries in memory.  Once it grows past
+    that, its in-memory entries are moved into a temporary sqlite database, and it continues to
+    buffer up to max_memory_items new entries in memory before moving them as well.
+
+    Keys and values must be marshal-able (e.g. tuples of strings and ints).  A SpillDict may be 
+    shared between threads.
+
+    >>> d = SpillDict(max_memory_items=2)
+    >>> for i in xrange(5):
+    ...     d[('k', i)] = i
+    >>> d[('k', 0)], d[('k', 4)], len(d), d.spilled
+    (0, 4, 5, True)
+    >>> d.close()
+    """
+    def __init__(self, max_memory_items=None):
+        self.max_memory_items = max_memory_items
+        self.memory = {}
+        self.path = None
+        self.db = None
+        self.lock = threading.RLock()
+
+    @property
+    def spilled(self):
+        return self.db is not None
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            if self.max_memory_items is not None and len(self.memory) > self.max_memory_items:
+                self.spill()
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key in self.memory:
+                return self.memory[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT v FROM spill WHERE k = ?", (_dumps(key),)).fetchone()
+                if row is not None:
+                    return marshal.loads(str(row[0]))
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        with self.lock:
+            if self.db is None:
+                return len(self.memory)
+            on_disk = self.db.execute("SELECT count(*) FROM spill").fetchone()[0]
+            only_in_memory = sum(1 for k in self.memory if
+                    self.db.execute("SELECT 1 FROM spill WHERE k = ?", (_dumps(k),)).fetchone() is None)
+            return on_disk + only_in_memory
+
+    def spill(self):
+        """
+        Move the in-memory entries into the on-disk database (creating it if needed).
+        """
+        with self.lock:
+            if self.db is None:
+                fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+                os.close(fd)
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                self.db.execute("PRAGMA synchronous = OFF")
+                self.db.execute("PRAGMA journal_mode = OFF")
+                self.db.execute("CREATE TABLE spill (k BLOB PRIMARY KEY, v BLOB)")
+            self.db.executemany("INSERT OR REPLACE INTO spill (k, v) VALUES (?, ?)",
+                    ((_dumps(k), _dumps(v)) for k, v in self.memory.iteritems()))
+            self.db.commit()
+            self.memory.clear()
+
+    def close(self):
+        """
+        Discard all entries, removing the on-disk database.
+        """
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.close()
+                os.remove(self.path)
+                self.db = None
+                self.path = None
+
+class SpillSet(object):
+    """
+    A set of strings that holds at most max_memory_items of them in memory, spilling the rest to a 
+    temporary sqlite database (like SpillDict).
+
+    Once spilled, a bloom filter of bloom_bits bits is kept in memory over the strings on disk, so 
+    that checking for a string that was never added (the common case when deduplicating) usually 
+    doesn't touch the disk; strings the filter might contain are verified against the database.
+
+    >>> s = SpillSet(max_memory_items=2)
+    >>> for x in ['a', 'b', 'c', 'd']:
+    ...     s.add(x)
+    >>> 'a' in s, 'd' in s, 'e' in s, len(s), s.spilled
+    (True, True, False, 4, True)
+    >>> s.close()
+    """
+    def __init__(self, max_memory_items=None, bloom_bits=8 * 2**20, bloom_hashes=4):
+        self.max_memory_items = max_memory_items
+        self.memory = set()
+        self.path = None
+        self.db = None
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.bloom = None
+        self.lock = threading.RLock()
+
+    @property
+    def spilled(self):
+        return self.db is not None
+
+    def add(self, x):
+        with self.lock:
+            self.memory.add(x)
+            if self.max_memory_items is not None and len(self.memory) > self.max_memory_items:
+                self.spill()
+
+    def __contains__(self, x):
+        with self.lock:
+            if x in self.memory:
+                return True
+            if self.db is None or not all(self.bloom[i >> 3] & (1 << (i & 7)) for i in self._bloom_bits(x)):
+                return False
+            return self.db.execute("SELECT 1 FROM spill WHERE k = ?", (sqlite3.Binary(x),)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            if self.db is None:
+                return len(self.memory)
+            return self.db.execute("SELECT count(*) FROM spill").fetchone()[0] + \
+                    sum(1 for x in self.memory if self.db.execute("SELECT 1 FROM spill WHERE k = ?", (sqlite3.Binary(x),)).fetchone() is None)
+
+    def _bloom_bits(self, x):
+        digest = hashlib.md5(x).digest()
+        return [h % self.bloom_bits for h in struct.unpack('<4I', digest)[:self.bloom_hashes]]
+
+    def spill(self):
+        """
+        Move the in-memory strings into the on-disk database (creating it if needed).
+        """
+        with self.lock:
+            if self.db is None:
+                fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+                os.close(fd)
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                self.db.execute("PRAGMA synchronous = OFF")
+                self.db.execute("PRAGMA journal_mode = OFF")
+                self.db.execute("CREATE TABLE spill (k BLOB PRIMARY KEY)")
+                self.bloom = bytearray((self.bloom_bits + 7) // 8)
+            for x in self.memory:
+                for i in self._bloom_bits(x):
+                    self.bloom[i >> 3] |= 1 << (i & 7)
+            self.db.executemany("INSERT OR IGNORE INTO spill (k) VALUES (?)",
+                    ((sqlite3.Binary(x),) for x in self.memory))
+            self.db.commit()
+            self.memory.clear()
+
+    def close(self):
+        """
+        Discard all strings, removing the on-disk database.
+        """
+        with self.lock:
+            self.memory.clear()
+            self.bloom = None
+            if self.db is not None:
+                self.db.close()
+                os.remove(self.path)
+                self.db = None
+                self.path = None
+
+def _dumps(x):
+    return sqlite3.Binary(marshal.dumps(x))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import unittest
+import bulkload
+import StringIO
+import re
+
+class DatabaseError(Exception):
+    pass
+
+class Cursor(object):
+    """
+    Stands in for a cursor of DB, answering bulkload's information_schema queries.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query):
+        query = ' '.join(query.split())
+        self.db.queries.append(query)
+        if any(pattern in query for pattern in self.db.fail):
+            raise DatabaseError(query)
+        if 'information_schema.TABLES' in query:
+            self.rows = self.db.engines.items()
+        elif 'information_schema.STATISTICS' in query:
+            table = re.search(r"TABLE_NAME = '(\w+)'", query).group(1)
+            self.rows = self.db.indexes.get(table, [])
+        elif 'information_schema.KEY_COLUMN_USAGE' in query:
+            self.rows = []
+        else:
+            self.rows = [(0,)]
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0]
+
+class DB(object):
+    """
+    Stands in for a connection to a database with tables of the given engines and (non-unique)
+    indexes, where queries containing any of fail raise DatabaseError.
+    """
+    def __init__(self, engines, indexes, fail=()):
+        self.engines = engines
+        self.indexes = indexes
+        self.fail = fail
+        self.queries = []
+
+    def cursor(self):
+        return Cursor(self)
+
+class test_bulk_session(unittest.TestCase):
+    def db(self, fail=()):
+        return DB({'A': 'InnoDB', 'B': 'MyISAM', 'C': 'InnoDB'},
+                  {'A': [('a_idx', 'BTREE', '', 'a', None, 'A')],
+                   'C': [('c_fulltext', 'FULLTEXT', '', 'c', None, None)]},
+                  fail=fail)
+
+    def test_enter_fails(self):
+        """
+        When dropping a later table's indexes fails, the tables already handled are restored, along
+        with checks, and the dropped definitions are logged.
+        """
+        db = self.db(fail=['DROP INDEX c_fulltext'])
+        log = StringIO.StringIO()
+        def load():
+            with bulkload.bulk_session(db, ['A', 'B', 'C'], log=log):
+                self.fail("entered the session")
+        self.assertRaises(DatabaseError, load)
+        self.assertIn("ALTER TABLE A ADD INDEX a_idx (a) USING BTREE", db.queries)
+        self.assertIn("ALTER TABLE B ENABLE KEYS", db.queries)
+        self.assertFalse(any(q.startswith("ALTER TABLE C ADD") for q in db.queries))
+        self.assertEqual(db.queries[-2:], ["SET unique_checks = 1", "SET foreign_key_checks = 1"])
+        self.assertIn("to rebuild: ALTER TABLE A ADD INDEX a_idx (a) USING BTREE", log.getvalue())
+        self.assertIn("to rebuild: ALTER TABLE C ADD FULLTEXT INDEX c_fulltext (c)", log.getvalue())
+
+    def test_exit_rebuild_fails(self):
+        """
+        When rebuilding a table's indexes fails, the other tables are still rebuilt and checks
+        restored before raising; an exception raised while loading takes precedence.
+        """
+        for load_error in [None, ValueError]:
+            db = self.db(fail=['ALTER TABLE A ADD'])
+            log = StringIO.StringIO()
+            def load():
+                with bulkload.bulk_session(db, ['A', 'B', 'C'], log=log):
+                    if load_error is not None:
+                        raise load_error()
+            self.assertRaises(load_error or DatabaseError, load)
+            self.assertIn("ALTER TABLE B ENABLE KEYS", db.queries)
+            self.assertIn("ALTER TABLE C ADD FULLTEXT INDEX c_fulltext (c)", db.queries)
+            self.assertEqual(db.queries[-2:], ["SET unique_checks = 1", "SET foreign_key_checks = 1"])
+            self.assertIn("failed to rebuild the indexes of A", log.getvalue())
+
+class test_index_definition(unittest.TestCase):
+    def test_index_definition(self):
+        self.assertEqual(bulkload.index_definition('z_idx', 'BTREE', '', [('z', None, 'A')]),
+                "INDEX z_idx (z) USING BTREE")
+        self.assertEqual(bulkload.index_definition('xy_idx', 'BTREE', "x's prefix", [('x', 5, 'A'), ('y', None, 'D')]),
+                "INDEX xy_idx (x(5), y DESC) USING BTREE COMMENT 'x\\'s prefix'")
+        self.assertEqual(bulkload.index_definition('x_fulltext', 'FULLTEXT', '', [('x', None, None)]),
+                "FULLTEXT INDEX x_fulltext (x)")
+        self.assertEqual(bulkload.index_definition('p_idx', 'SPATIAL', '', [('p', 32, 'A')]),
+                "SPATIAL INDEX p_idx (p(32))")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import unittest
+import dcsv
+from StringIO import StringIO
+
+class test_dcsv(unittest.TestCase):
+    def _round_trip(self, rows, **kwargs):
+        f = StringIO()
+        w = dcsv.writer(f, **kwargs)
+        w.writerows(rows)
+        w.flush()
+        return list(dcsv.reader(StringIO(f.getvalue())))
+
+    def test_round_trip(self):
+        """
+        Rows are read back as written, across blocks, with non-string values written like csv
+        writes them.
+        """
+        rows = [['gene_name', 'snp_id', 'allele']] + \
+               [['CYP2D6', 'rs{i}'.format(i=i), 'ACGT'[i % 4]] for i in xrange(1000)] + \
+               [['CYP2C19', 1, None]]
+        expected = [[str(v) if v is not None else '' for v in row] for row in rows]
+        for block_rows in [1, 7, 5000]:
+            self.assertEqual(self._round_trip(rows, block_rows=block_rows), expected)
+
+    def test_many_distinct_values(self):
+        """
+        Blocks with more distinct values in a column than fit in 1 or 2 byte indexes.
+        """
+        rows = [[str(i), 'x'] for i in xrange(70000)]
+        self.assertEqual(self._round_trip(rows, block_rows=100000), rows)
+
+    def test_dict_reader(self):
+        f = StringIO()
+        w = dcsv.DictWriter(f, ['x', 'y'])
+        w.writeheader()
+        w.writerow({'x': 'a'})
+        self.assertRaises(ValueError, lambda: w.writerow({'z': 'a'}))
+        w.flush()
+        r = dcsv.DictReader(StringIO(f.getvalue()))
+        self.assertEqual(r.fieldnames, ['x', 'y'])
+        self.assertEqual(list(r), [{'x': 'a', 'y': ''}])
+        self.assertEqual(dcsv.DictReader(StringIO(dcsv.MAGIC)).fieldnames, None)
+        self.assertRaises(ValueError, lambda: dcsv.DictReader(StringIO('x,y\n')))
+
+if __name__ == '__main__':
+    unittest.main()
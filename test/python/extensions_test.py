@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb.extensions import RecommendationCacheStats
+from pharmgkb.spiders import Gene
+
+class Stats(object):
+    def __init__(self):
+        self.values = {}
+
+    def set_value(self, key, value, spider=None):
+        self.values[key] = value
+
+class Spider(object):
+    def __init__(self):
+        self.logs = []
+
+    def log(self, msg, level):
+        self.logs.append(msg)
+
+class test_recommendation_cache_stats(unittest.TestCase):
+    def setUp(self):
+        self.recommendation_cache = Gene.recommendation_cache
+        Gene.recommendation_cache = Gene.RecommendationCache(10)
+
+    def tearDown(self):
+        Gene.recommendation_cache = self.recommendation_cache
+
+    def test_spider_closed(self):
+        """
+        The hit rate of each gene is logged, and the total hits and misses recorded in the stats.
+        """
+        for key, gene_name in [('a', 'HLA-B'), ('b', 'CYP2D6'), ('b', 'CYP2D6'), ('b', 'CYP2D6'), ('c', 'CYP2D6')]:
+            Gene.recommendation_cache.get(key, gene_name, lambda: None)
+        stats = Stats()
+        spider = Spider()
+        RecommendationCacheStats(stats).spider_closed(spider)
+        self.assertEqual(spider.logs, [
+            "CYP2D6: 2 of 4 drug recommendation responses were already parsed (50.0%)",
+            "HLA-B: 0 of 1 drug recommendation responses were already parsed (0.0%)",
+        ])
+        self.assertEqual(stats.values, {'recommendation_cache/hits': 2, 'recommendation_cache/misses': 3})
+
+    def test_no_responses(self):
+        stats = Stats()
+        spider = Spider()
+        RecommendationCacheStats(stats).spider_closed(spider)
+        self.assertEqual(spider.logs, [])
+        self.assertEqual(stats.values, {'recommendation_cache/hits': 0, 'recommendation_cache/misses': 0})
+
+if __name__ == '__main__':
+    unittest.main()
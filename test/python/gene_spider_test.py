@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb import settings
+from pharmgkb.spiders import Gene
+from scrapy.http import HtmlResponse
+from scrapy.item import BaseItem
+import os.path
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'in', 'pharmgkb', 'www.pharmgkb.org')
+
+def fixture_response(path):
+    with open(os.path.join(FIXTURES, path), 'rb') as f:
+        return HtmlResponse('http://www.pharmgkb.org/' + path, body=f.read(), headers={'Content-Type': 'text/html;charset=UTF-8'})
+
+class test_compiled_xpath(unittest.TestCase):
+    """
+    Parsing with precompiled XPath gives the same items as parsing with HtmlXPathSelector.
+    """
+    def setUp(self):
+        self.compiled_xpath = settings.COMPILED_XPATH
+
+    def tearDown(self):
+        settings.COMPILED_XPATH = self.compiled_xpath
+
+    def _items(self, parse, path, compiled_xpath):
+        settings.COMPILED_XPATH = compiled_xpath
+        return [(type(i).__name__, sorted(i.items())) for i in parse(fixture_response(path)) if isinstance(i, BaseItem)]
+
+    def test_gene(self):
+        for path in os.listdir(os.path.join(FIXTURES, 'gene')):
+            parse = lambda response: Gene.GeneSpider(start_url=response.url).parse(response)
+            variants = self._items(parse, 'gene/' + path, True)
+            self.assertNotEqual(variants, [])
+            self.assertEqual(repr(variants), repr(self._items(parse, 'gene/' + path, False)))
+
+    def test_recommendation(self):
+        for path in os.listdir(os.path.join(FIXTURES, 'views')):
+            location = path.split('location=')[1]
+            self.assertEqual(repr(Gene.parse_recommendation(fixture_response('views/' + path), location, compiled_xpath=True)),
+                             repr(Gene.parse_recommendation(fixture_response('views/' + path), location, compiled_xpath=False)))
+        drug_recommendation, genotype_phenotype, unused_values = Gene.parse_recommendation(fixture_response(
+            'views/alleleGuidelines.action?allele1=PA165920003&allele2=PA165816021&annotationId=981483939&location=CYP2D6'), 'CYP2D6', compiled_xpath=True)
+        self.assertEqual(genotype_phenotype['phenotype_name'], 'poor metabolizer')
+        self.assertEqual(drug_recommendation['classification'], 'Strong')
+        self.assertEqual(unused_values, {'Activity Score': '0', 'Phenotype (Genotype)': 'An individual carrying no functional alleles'})
+        self.assertIsNone(Gene.parse_recommendation(fixture_response(
+            'views/alleleGuidelines.action?allele1=PA165816543&allele2=PA165816543&annotationId=827848453&location=HLA-B'), 'HLA-B', compiled_xpath=True))
+
+class test_recommendation_cache(unittest.TestCase):
+    def test_cache(self):
+        """
+        Cached results are returned without recomputing them, hits and misses are counted per gene, 
+        the oldest entry is evicted past max_entries, and None results are cached too.
+        """
+        cache = Gene.RecommendationCache(2)
+        computed = []
+        def compute(value):
+            def f():
+                computed.append(value)
+                return value
+            return f
+        self.assertEqual(cache.get('a', 'CYP2D6', compute(1)), 1)
+        self.assertEqual(cache.get('a', 'CYP2D6', compute(2)), 1)
+        self.assertIsNone(cache.get('b', 'HLA-B', compute(None)))
+        self.assertIsNone(cache.get('b', 'HLA-B', compute(3)))
+        self.assertEqual(computed, [1, None])
+        self.assertEqual(cache.hits, {'CYP2D6': 1, 'HLA-B': 1})
+        self.assertEqual(cache.misses, {'CYP2D6': 1, 'HLA-B': 1})
+        # evicts 'a'
+        self.assertEqual(cache.get('c', 'CYP2D6', compute(4)), 4)
+        self.assertEqual(list(cache.entries), ['b', 'c'])
+        self.assertEqual(cache.get('a', 'CYP2D6', compute(5)), 5)
+        self.assertEqual(list(cache.entries), ['c', 'a'])
+        self.assertEqual(computed, [1, None, 4, 5])
+        self.assertEqual(cache.misses, {'CYP2D6': 3, 'HLA-B': 1})
+
+    def test_identical_responses(self):
+        """
+        Genotypes with identical drug recommendation responses are parsed once, and their items only 
+        differ in the genotype's fields.
+        """
+        recommendation_cache = Gene.recommendation_cache
+        Gene.recommendation_cache = Gene.RecommendationCache(10)
+        try:
+            path = 'views/alleleGuidelines.action?allele1=PA165920003&allele2=PA165816021&annotationId=981483939&location=CYP2D6'
+            def parse(haplotype1, haplotype2):
+                spider = Gene.HaplotypeGenotypeSpider(
+                        annotation_id='981483939',
+                        haplotype_name1=haplotype1[0],
+                        haplotype_id1=haplotype1[1],
+                        haplotype_name2=haplotype2[0],
+                        haplotype_id2=haplotype2[1],
+                        gene_name='CYP2D6',
+                        drug_name='codeine')
+                # fill in spider.formdata (the source of unused_genotype_data), as crawling does
+                spider.request('http://www.pharmgkb.org', spider.parse)
+                return [i for i in spider.parse(fixture_response(path)) if isinstance(i, BaseItem)]
+            items1 = parse(('*4', 'PA165920003'), ('*5', 'PA165816021'))
+            items2 = parse(('*3', 'PA165816020'), ('*6', 'PA165816022'))
+            self.assertEqual(Gene.recommendation_cache.misses, {'CYP2D6': 1})
+            self.assertEqual(Gene.recommendation_cache.hits, {'CYP2D6': 1})
+            self.assertEqual([type(i) for i in items1], [type(i) for i in items2])
+            self.assertEqual([type(i).__name__ for i in items1], 
+                    ['genotype_phenotype', 'drug_recommendation', 'genotype_drug_recommendation', 'unused_genotype_data'])
+            for item1, item2 in zip(items1, items2):
+                differing = sorted(k for k in set(item1) | set(item2) if item1.get(k) != item2.get(k))
+                if 'source' in differing:
+                    self.assertEqual(differing, ['source'])
+                    self.assertEqual((item1['source']['allele1'], item1['source']['allele2']), ('PA165920003', 'PA165816021'))
+                    self.assertEqual((item2['source']['allele1'], item2['source']['allele2']), ('PA165816020', 'PA165816022'))
+                    self.assertEqual(dict(item1['source'], allele1=None, allele2=None), dict(item2['source'], allele1=None, allele2=None))
+                else:
+                    self.assertEqual(differing, ['haplotype_name1', 'haplotype_name2'])
+                    self.assertEqual((item1['haplotype_name1'], item1['haplotype_name2']), ('*4', '*5'))
+                    self.assertEqual((item2['haplotype_name1'], item2['haplotype_name2']), ('*3', '*6'))
+        finally:
+            Gene.recommendation_cache = recommendation_cache
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb import items
+from pharmgkb.spiders import Gene
+from twisted.python.failure import Failure
+import collections
+import itertools
+import random
+
+CLASSES = ['functional', 'reduced-function', 'non-functional']
+
+class ParseError(Exception):
+    pass
+
+class Request(object):
+    """
+    Stands in for the HaplotypeGenotypeSpider request returned by GeneHaplotypeSpider's
+    genotype_request.
+    """
+    def __init__(self, haplotype1, haplotype2, callback=None, errback=None):
+        self.genotype = (haplotype1, haplotype2)
+        self.callback = callback if callback is not None else lambda spider, response: spider.parse(response)
+        self.errback = errback
+
+class Spider(object):
+    """
+    Stands in for a HaplotypeGenotypeSpider, parsing the drug recommendation of a genotype whose
+    haplotypes have the function classes in classes (a haplotype id missing from classes has a
+    "Phenotype (Genotype)" we can't parse).
+    """
+    def __init__(self, classes, haplotype1, haplotype2, broken=False, logs=None):
+        self.classes = classes
+        self.haplotype1 = haplotype1
+        self.haplotype2 = haplotype2
+        self.broken = broken
+        self.logs = logs if logs is not None else []
+        self.formdata = {'annotationId': '1', 'allele1': haplotype1[1], 'allele2': haplotype2[1]}
+
+    def parse(self, response):
+        if self.broken:
+            raise ParseError("unexpected drug recommendation for {0}".format(self.formdata))
+        class1, class2 = sorted([self.classes.get(self.haplotype1[1]), self.classes.get(self.haplotype2[1])])
+        if class1 is None:
+            phenotype_genotype = 'Something else'
+        elif class1 == class2:
+            phenotype_genotype = 'An individual carrying two {0} alleles'.format(class1)
+        else:
+            phenotype_genotype = 'An individual carrying one {0} allele and one {1} allele'.format(class1, class2)
+        genotype = dict(gene_name='G', haplotype_name1=self.haplotype1[0], haplotype_name2=self.haplotype2[0])
+        yield items.genotype_phenotype(phenotype_name='{0}/{1}'.format(class1, class2), phenotype_genotype=phenotype_genotype, **genotype)
+        yield items.drug_recommendation(drug_name='d', recommendation='rec {0} {1}'.format(class1, class2), **genotype)
+        yield items.genotype_drug_recommendation(drug_name='d', **genotype)
+        yield items.unused_genotype_data(values={'Phenotype (Genotype)': phenotype_genotype}, source=self.formdata)
+
+    def log(self, msg, level):
+        self.logs.append(msg)
+
+class Pruner(Gene.GenotypePruner):
+    def __init__(self, *args, **kwargs):
+        Gene.GenotypePruner.__init__(self, *args, **kwargs)
+        self.logs = []
+
+    def log(self, msg, level, spider=None):
+        self.logs.append(msg)
+
+def item_key(item):
+    return (type(item).__name__, sorted((k, sorted(v.items()) if isinstance(v, dict) else v) for k, v in item.items()))
+
+class test_genotype_pruner(unittest.TestCase):
+    """
+    Requesting genotypes through a GenotypePruner gives the same items as requesting every genotype
+    of a simulated 30 haplotype gene, in fewer requests.
+    """
+    def setUp(self):
+        rand = random.Random(1)
+        self.haplotypes = [('*{0}'.format(i), 'PA{0}'.format(i)) for i in xrange(1, 31)]
+        self.classes = dict((haplotype_id, rand.choice(CLASSES)) for haplotype_name, haplotype_id in self.haplotypes)
+        # *7's function class can't be learned
+        del self.classes['PA7']
+        self.genotypes = [tuple(sorted(genotype, key=lambda haplotype: haplotype[0]))
+                          for genotype in itertools.combinations_with_replacement(self.haplotypes, 2)]
+        self.heterozygotes = [(h1, h2) for h1, h2 in self.genotypes if h1 != h2]
+        self.spider_logs = []
+
+    def spider(self, genotype, broken=()):
+        return Spider(self.classes, *genotype, broken=genotype in broken, logs=self.spider_logs)
+
+    def crawl_all(self):
+        return sorted(item_key(item) for genotype in self.genotypes for item in self.spider(genotype).parse(None))
+
+    def crawl(self, pruner, fail=lambda request: False, broken=()):
+        """
+        Return the genotypes requested, the items parsed, and the exceptions raised by callbacks
+        (which scrapy logs and moves on from).
+        """
+        queue = collections.deque(pruner.start_requests())
+        requested = []
+        parsed = []
+        errors = []
+        while queue:
+            request = queue.popleft()
+            requested.append(request.genotype)
+            if fail(request):
+                output = request.errback(Failure(IOError("connection refused")))
+            else:
+                output = request.callback(self.spider(request.genotype, broken), None)
+            try:
+                for x in output or []:
+                    if isinstance(x, Request):
+                        queue.append(x)
+                    else:
+                        parsed.append(x)
+            except ParseError as e:
+                errors.append(e)
+        return requested, sorted(item_key(item) for item in parsed), errors
+
+    def without(self, parsed, genotype):
+        """
+        Return the parsed items that don't belong to genotype.
+        """
+        (name1, id1), (name2, id2) = genotype
+        def belongs(item):
+            fields = dict(item[1])
+            if item[0] == 'unused_genotype_data':
+                source = dict(fields['source'])
+                return (source['allele1'], source['allele2']) == (id1, id2)
+            return (fields['haplotype_name1'], fields['haplotype_name2']) == (name1, name2)
+        return [item for item in parsed if not belongs(item)]
+
+    def pruner(self, verify_rate=0.):
+        return Pruner(self.genotypes, Request, verify_rate=verify_rate, description='G d', rand=random.Random(2))
+
+    def test_inferred_items(self):
+        full = self.crawl_all()
+        for verify_rate in [0., 0.3]:
+            pruner = self.pruner(verify_rate)
+            requested, parsed, errors = self.crawl(pruner)
+            self.assertEqual(parsed, full)
+            self.assertEqual(errors, [])
+            self.assertLess(len(requested), len(self.genotypes) / 2)
+            self.assertEqual(len(set(requested)), len(requested))
+            # the verified inferences all match
+            self.assertEqual(self.spider_logs, [])
+            self.assertTrue(any(msg.startswith("G d: requesting") for msg in pruner.logs))
+        # every genotype is requested if none are inferred
+        requested, parsed, errors = self.crawl(self.pruner(1.))
+        self.assertEqual(sorted(requested), sorted(self.genotypes))
+        self.assertEqual(parsed, full)
+
+    def test_unknown_function_class(self):
+        requested, parsed, errors = self.crawl(self.pruner())
+        unknown = [genotype for genotype in self.heterozygotes if ('*7', 'PA7') in genotype]
+        self.assertEqual(len(unknown), 29)
+        self.assertTrue(set(unknown).issubset(requested))
+        self.assertEqual(parsed, self.crawl_all())
+
+    def test_homozygote_failed(self):
+        last = (self.haplotypes[-1], self.haplotypes[-1])
+        for homozygote in [(self.haplotypes[0], self.haplotypes[0]), last]:
+            pruner = self.pruner()
+            requested, parsed, errors = self.crawl(pruner, fail=lambda request: request.genotype == homozygote)
+            self.assertEqual(parsed, self.without(self.crawl_all(), homozygote))
+            self.assertTrue(set(g for g in self.heterozygotes if homozygote[0] in g).issubset(requested))
+            self.assertTrue(any("failed to request homozygote" in msg for msg in pruner.logs))
+            # the heterozygotes requested are logged, even when the last homozygote failed
+            self.assertTrue(any(msg.startswith("G d: requesting") for msg in pruner.logs))
+
+    def test_homozygote_parse_error(self):
+        last = (self.haplotypes[-1], self.haplotypes[-1])
+        for homozygote in [(self.haplotypes[0], self.haplotypes[0]), last]:
+            requested, parsed, errors = self.crawl(self.pruner(), broken=[homozygote])
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(parsed, self.without(self.crawl_all(), homozygote))
+            self.assertTrue(set(g for g in self.heterozygotes if homozygote[0] in g).issubset(requested))
+
+    def test_representative_failed(self):
+        pruner = self.pruner()
+        failed = []
+        def fail(request):
+            if failed == [] and getattr(request.errback, 'func', None) == pruner.representative_failed:
+                failed.append(request)
+                return True
+            return False
+        requested, parsed, errors = self.crawl(pruner, fail=fail)
+        self.assertEqual(len(failed), 1)
+        representative, genotypes = failed[0].errback.args
+        self.assertEqual(representative, failed[0].genotype)
+        self.assertGreater(len(genotypes), 0)
+        self.assertTrue(set(genotypes).issubset(requested))
+        self.assertEqual(parsed, self.without(self.crawl_all(), representative))
+        self.assertTrue(any("failed to request representative genotype" in msg for msg in pruner.logs))
+
+class test_function_class(unittest.TestCase):
+    def test_function_class(self):
+        def parsed(phenotype_genotype):
+            return [items.drug_recommendation(drug_name='d'), items.genotype_phenotype(phenotype_genotype=phenotype_genotype)]
+        self.assertEqual(Gene.function_class(parsed('An individual carrying two non-functional alleles')), 'non-functional')
+        self.assertIsNone(Gene.function_class(parsed('An individual carrying two functional alleles or two reduced-function alleles')))
+        self.assertIsNone(Gene.function_class(parsed('Something else')))
+        self.assertIsNone(Gene.function_class(parsed(None)))
+        self.assertIsNone(Gene.function_class([]))
+
+class test_rebind_genotype(unittest.TestCase):
+    def test_rebind_genotype(self):
+        parsed = list(Spider({'PA1': 'functional', 'PA2': 'functional'}, ('*1', 'PA1'), ('*2', 'PA2')).parse(None))
+        rebound = Gene.rebind_genotype(parsed, ('*3', 'PA3'), ('*4', 'PA4'))
+        self.assertEqual([type(item) for item in rebound], [type(item) for item in parsed])
+        for item, original in zip(rebound, parsed):
+            if isinstance(item, items.unused_genotype_data):
+                self.assertEqual(item['source'], {'annotationId': '1', 'allele1': 'PA3', 'allele2': 'PA4'})
+                self.assertEqual(original['source'], {'annotationId': '1', 'allele1': 'PA1', 'allele2': 'PA2'})
+                self.assertEqual(item['values'], original['values'])
+            else:
+                self.assertEqual((item['haplotype_name1'], item['haplotype_name2']), ('*3', '*4'))
+                self.assertEqual((original['haplotype_name1'], original['haplotype_name2']), ('*1', '*2'))
+                self.assertEqual(dict(item, haplotype_name1='*1', haplotype_name2='*2'), dict(original))
+
+if __name__ == '__main__':
+    unittest.main()
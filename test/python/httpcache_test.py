@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb import httpcache
+from scrapy.settings import Settings
+from scrapy.http import FormRequest, HtmlResponse
+from scrapy.contrib.httpcache import DbmCacheStorage
+import shutil
+import tempfile
+import time
+
+class Spider(object):
+    name = 'test'
+
+class test_sqlite_cache_storage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spider = Spider()
+        self.request = FormRequest('http://www.pharmgkb.org/views/alleleGuidelines.action', formdata={'allele1': 'PA1'})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _storage(self, **settings):
+        settings['HTTPCACHE_DIR'] = self.directory
+        storage = httpcache.SqliteCacheStorage(Settings(settings))
+        storage.open_spider(self.spider)
+        return storage
+
+    def test_round_trip(self):
+        """
+        Stored responses are retrieved (by a later crawl) with the same url, status, headers and body.
+        """
+        storage = self._storage()
+        self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+        storage.store_response(self.spider, self.request, HtmlResponse(self.request.url, status=200,
+            body='<html><body><dl></dl></body></html>', headers={'Content-Type': 'text/html;charset=UTF-8'}))
+        storage.close_spider(self.spider)
+
+        storage = self._storage()
+        response = storage.retrieve_response(self.spider, self.request)
+        storage.close_spider(self.spider)
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual(response.url, self.request.url)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/html;charset=UTF-8')
+        self.assertEqual(response.body, '<html><body><dl></dl></body></html>')
+
+    def test_expiration(self):
+        """
+        Expired responses are missing, and deleted on compaction.
+        """
+        storage = self._storage(HTTPCACHE_EXPIRATION_SECS=60)
+        storage.store_response(self.spider, self.request, HtmlResponse(self.request.url, body='<html></html>'))
+        storage.db.execute("UPDATE response SET timestamp = ?", (time.time() - 120,))
+        self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+        self.assertEqual(httpcache.compact(storage.db, storage.expiration_secs), 1)
+        storage.close_spider(self.spider)
+
+    def test_migrate_dbm(self):
+        """
+        A new database starts out with the responses of the spider's dbm cache.
+        """
+        dbm_storage = DbmCacheStorage(Settings({'HTTPCACHE_DIR': self.directory}))
+        dbm_storage.open_spider(self.spider)
+        dbm_storage.store_response(self.spider, self.request, HtmlResponse(self.request.url, status=200,
+            body='<html><body><dl></dl></body></html>', headers={'Content-Type': 'text/html;charset=UTF-8'}))
+        dbm_storage.close_spider(self.spider)
+
+        storage = self._storage()
+        response = storage.retrieve_response(self.spider, self.request)
+        self.assertEqual(response.body, '<html><body><dl></dl></body></html>')
+        self.assertEqual(response.headers['Content-Type'], 'text/html;charset=UTF-8')
+        self.assertAlmostEqual(storage.db.execute("SELECT timestamp FROM response").fetchone()[0], time.time(), delta=60)
+        # only once: responses since deleted from the database stay deleted
+        storage.db.execute("DELETE FROM response")
+        storage.close_spider(self.spider)
+        storage = self._storage()
+        self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+        storage.close_spider(self.spider)
+
+if __name__ == '__main__':
+    unittest.main()
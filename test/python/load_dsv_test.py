@@ -4,10 +4,13 @@ from testutil import DatabaseTestMixin, tmp_dir, create_files, rows_to_dsv
 import oursql
 from load_dsv import *
 import os.path
+import StringIO
+import bulkload
 
 class test_load_dsv(unittest.TestCase, DatabaseTestMixin):
     db = 'load_dsv_test'
     schema_file = "src/sql/mysql/haplorec.sql"
+    local_infile = True
 
     drop_after_test = True
 
@@ -15,7 +18,7 @@ class test_load_dsv(unittest.TestCase, DatabaseTestMixin):
         if self.drop_after_test:
             self.drop()
 
-    def _load_dsv_test(self, schema=None, files=None, assertion=None, *args, **kwargs):
+    def _load_dsv_test(self, schema=None, files=None, assertion=None, load=load_dsv, *args, **kwargs):
         self.schema = schema 
         self.connect()
         with tmp_dir() as directory:
@@ -25,7 +28,7 @@ class test_load_dsv(unittest.TestCase, DatabaseTestMixin):
             for filename, rows in files:
                 files_to_create[filename] = rows_to_dsv(rows)
             create_files(files_to_create, directory=directory)
-            load_dsv(self.connection, [filepath(f[0]) for f in files], *args, delim="\t", **kwargs)
+            load(self.connection, [filepath(f[0]) for f in files], *args, delim="\t", **kwargs)
             assertion()
 
     def test_dump(self):
@@ -151,5 +154,604 @@ class test_load_dsv(unittest.TestCase, DatabaseTestMixin):
             mapping_strings=['R_1: x => T'],
         )
 
+    def test_id_batched(self):
+        """
+        Test mapping back to a single auto_increment table whose rows are inserted using multi-row 
+        INSERT's (where the last batch is only partially filled).
+        """
+        def assertion():
+            self.assertEqual(
+                self.select(table='T', columns=["id", "x", "y"]), 
+                [
+                    ( 1, "x1", "y1" ),
+                    ( 2, "x2", "y2" ),
+                    ( 3, "x3", "y3" ),
+                ]
+            )
+            self.assertEqual(
+                self.select(table='R_1', columns=["z", "T_id"]), 
+                [
+                    ( "z1", 1 ),
+                    ( "z3", 3 ),
+                ]
+            )
+        self._load_dsv_test(
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint auto_increment primary key, 
+                    x text, 
+                    y text
+                );
+                CREATE TABLE R_1 ( 
+                    z text, 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id)
+                );
+            """,
+            files=[
+                ['T.dsv', [
+                    [ "x",  "y" ],
+                    [ "x1", "y1" ],
+                    [ "x2", "y2" ],
+                    [ "x3", "y3" ],
+                ]],
+                ['R_1.dsv', [
+                    [ "z",  "x" ],
+                    [ "z1", "x1" ],
+                    [ "z3", "x3" ],
+                ]],
+            ],
+            assertion=assertion,
+            ignore_strings=['R_1.x'],
+            mapping_strings=['R_1: x => T'],
+            batch_size=2,
+        )
+
+    def test_id_spilled(self):
+        """
+        Test mapping back to a single auto_increment table when the resolved ids don't all fit in 
+        memory.
+        """
+        def assertion():
+            self.assertEqual(
+                self.select(table='R_1', columns=["z", "T_id"]), 
+                [
+                    ( "z1", 1 ),
+                    ( "z2", 2 ),
+                    ( "z3", 3 ),
+                ]
+            )
+        self._load_dsv_test(
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint auto_increment primary key, 
+                    x text
+                );
+                CREATE TABLE R_1 ( 
+                    z text, 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id)
+                );
+            """,
+            files=[
+                ['T.dsv', [
+                    [ "x" ],
+                    [ "x1" ],
+                    [ "x2" ],
+                    [ "x3" ],
+                ]],
+                ['R_1.dsv', [
+                    [ "z",  "x" ],
+                    [ "z1", "x1" ],
+                    [ "z2", "x2" ],
+                    [ "z3", "x3" ],
+                ]],
+            ],
+            assertion=assertion,
+            ignore_strings=['R_1.x'],
+            mapping_strings=['R_1: x => T'],
+            max_fk_ids=1,
+        )
+
+    def test_id_load_data(self):
+        """
+        Test mapping back to auto_increment tables when loading files with LOAD DATA INFILE into 
+        staging tables (including a mapping through multiple columns, and an auto_increment table 
+        that itself references another).
+        """
+        def assertion():
+            self.assertEqual(
+                self.select(table='T', columns=["id", "x", "y"]), 
+                [
+                    ( 1, None, "y1" ),
+                    ( 2, None, "y2" ),
+                ]
+            )
+            self.assertEqual(
+                self.select(table='S', columns=["id", "w", "T_id"]), 
+                [
+                    ( 1, "w1", 2 ),
+                ]
+            )
+            self.assertEqual(
+                self.select(table='R_1', columns=["z", "T_id", "S_id"]), 
+                [
+                    ( "z1", 1, 1 ),
+                    ( "z2", 2, 1 ),
+                ]
+            )
+        self._load_dsv_test(
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint auto_increment primary key, 
+                    x text, 
+                    y text
+                );
+                CREATE TABLE S ( 
+                    id bigint auto_increment primary key, 
+                    w text, 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id)
+                );
+                CREATE TABLE R_1 ( 
+                    z text, 
+                    T_id bigint, 
+                    S_id bigint, 
+                    foreign key (T_id) references T(id),
+                    foreign key (S_id) references S(id)
+                );
+            """,
+            files=[
+                ['T.dsv', [
+                    [ "x",  "y" ],
+                    [ "x1", "y1" ],
+                    [ "x2", "y2" ],
+                ]],
+                ['S.dsv', [
+                    [ "w",  "x",  "y" ],
+                    [ "w1", "x2", "y2" ],
+                ]],
+                ['R_1.dsv', [
+                    [ "z",  "x",  "y",  "w" ],
+                    [ "z1", "x1", "y1", "w1" ],
+                    [ "z2", "x2", "y2", "w1" ],
+                ]],
+            ],
+            assertion=assertion,
+            ignore_strings=['T.x', 'S.x', 'S.y', 'R_1.x', 'R_1.y', 'R_1.w'],
+            mapping_strings=['S: x, y => T', 'R_1: x, y => T', 'R_1: w => S'],
+            load_data=True,
+        )
+
+    def test_duplicate_mapping(self):
+        """
+        Test that mapping column values that occur more than once in an auto_increment table's file
+        are rejected, whether or not the files are loaded with LOAD DATA INFILE.
+        """
+        for load_data in [False, True]:
+            self.assertRaises(RuntimeError, self._load_dsv_test,
+                schema="""
+                    CREATE TABLE T (
+                        id bigint auto_increment primary key,
+                        x text,
+                        y text
+                    );
+                    CREATE TABLE R_1 (
+                        z text,
+                        T_id bigint,
+                        foreign key (T_id) references T(id)
+                    );
+                """,
+                files=[
+                    ['T.dsv', [
+                        [ "x",  "y" ],
+                        [ "x1", "y1" ],
+                        [ "x1", "y2" ],
+                    ]],
+                    ['R_1.dsv', [
+                        [ "z",  "x" ],
+                        [ "z1", "x1" ],
+                    ]],
+                ],
+                assertion=lambda: None,
+                ignore_strings=['R_1.x'],
+                mapping_strings=['R_1: x => T'],
+                load_data=load_data,
+            )
+
+    def test_dependency_order(self):
+        """
+        Test that tables are loaded after the tables they depend on (through foreign keys or 
+        mappings), regardless of the order their files are given in, when loading tables in 
+        parallel.
+        """
+        def assertion():
+            self.assertEqual(
+                self.select(table='U', columns=["u"]), 
+                [
+                    ( "u1", ),
+                ]
+            )
+            self.assertEqual(
+                self.select(table='R_1', columns=["z", "T_id"]), 
+                [
+                    ( "z1", 2 ),
+                ]
+            )
+        def connect():
+            return oursql.connect(host=self.host, port=self.port, user=self.user, passwd=self.passwd, db=self.db)
+        self._load_dsv_test(
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint auto_increment primary key, 
+                    x text
+                );
+                CREATE TABLE R_1 ( 
+                    z text, 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id)
+                );
+                CREATE TABLE U ( 
+                    u text
+                );
+            """,
+            files=[
+                ['R_1.dsv', [
+                    [ "z",  "x" ],
+                    [ "z1", "x2" ],
+                ]],
+                ['U.dsv', [
+                    [ "u" ],
+                    [ "u1" ],
+                ]],
+                ['T.dsv', [
+                    [ "x" ],
+                    [ "x1" ],
+                    [ "x2" ],
+                ]],
+            ],
+            assertion=assertion,
+            ignore_strings=['R_1.x'],
+            mapping_strings=['R_1: x => T'],
+            jobs=2,
+            connect=connect,
+        )
+
+    def test_resume_checkpoint(self):
+        """
+        Test resuming a load that failed part way through a file from its checkpoint (which a load 
+        of different files refuses).
+        """
+        self._resume_checkpoint_test(commit_every=2, committed_R_1_rows=2)
+
+    def test_resume_checkpoint_whole_file(self):
+        """
+        Test resuming a load from its checkpoint when files are committed whole (without 
+        commit_every), so that the rows of the file that failed are rolled back.
+        """
+        self._resume_checkpoint_test(commit_every=None, committed_R_1_rows=0)
+
+    def _resume_checkpoint_test(self, commit_every, committed_R_1_rows):
+        self.schema = """
+            CREATE TABLE T ( 
+                id bigint auto_increment primary key, 
+                x text
+            ) ENGINE=InnoDB;
+            CREATE TABLE R_1 ( 
+                z text, 
+                T_id bigint, 
+                foreign key (T_id) references T(id)
+            ) ENGINE=InnoDB;
+        """
+        self.connect()
+        T_rows = [
+            [ "x" ],
+            [ "x1" ],
+            [ "x2" ],
+        ]
+        R_1_rows = [
+            [ "z",  "x" ],
+            [ "z1", "x1" ],
+            [ "z2", "x2" ],
+            # no such T.x
+            [ "z3", "x3" ],
+        ]
+        def count(table, where=''):
+            self.cursor.execute("SELECT COUNT(*) FROM {table} {where}".format(table=table, where=where))
+            return self.cursor.fetchone()[0]
+        with tmp_dir() as directory:
+            files = [os.path.join(directory, f) for f in ['T.dsv', 'R_1.dsv']]
+            def load():
+                load_dsv(self.connection, files, delim="\t",
+                    ignore_strings=['R_1.x'],
+                    mapping_strings=['R_1: x => T'],
+                    commit_every=commit_every,
+                    checkpoint_name='test')
+
+            create_files({'T.dsv': rows_to_dsv(T_rows), 'R_1.dsv': rows_to_dsv(R_1_rows)}, directory=directory)
+            self.assertRaises(KeyError, load)
+            # only the rows recorded by the checkpoint were committed
+            self.assertEqual(count('T'), 2)
+            self.assertEqual(count('R_1'), committed_R_1_rows)
+            self.assertEqual(count('load_dsv_checkpoint', "WHERE name = 'test'"), 1)
+            # the connection's autocommit is left as it was
+            self.cursor.execute("SELECT @@autocommit")
+            self.assertEqual(self.cursor.fetchone()[0], 1)
+            # a load of different files can't resume from the checkpoint
+            self.assertRaises(RuntimeError, load_dsv, self.connection, files[:1], delim="\t",
+                commit_every=commit_every,
+                checkpoint_name='test')
+
+            R_1_rows[-1] = [ "z3", "x2" ]
+            create_files({'R_1.dsv': rows_to_dsv(R_1_rows)}, directory=directory)
+            load()
+            self.assertEqual(count('load_dsv_checkpoint', "WHERE name = 'test'"), 0)
+            self.assertEqual(count('load_dsv_checkpoint_fk_id', "WHERE name = 'test'"), 0)
+
+        self.assertEqual(
+            self.select(table='T', columns=["id", "x"]), 
+            [
+                ( 1, "x1" ),
+                ( 2, "x2" ),
+            ]
+        )
+        self.assertEqual(
+            self.select(table='R_1', columns=["z", "T_id"]), 
+            [
+                ( "z1", 1 ),
+                ( "z2", 2 ),
+                ( "z3", 2 ),
+            ]
+        )
+
+    def test_delta(self):
+        """
+        Test that a delta load only updates changed rows (keeping their auto_increment ids), inserts 
+        new rows, and deletes rows no longer present.
+        """
+        self.schema = """
+            CREATE TABLE drug_recommendation ( 
+                id bigint auto_increment primary key, 
+                drug_name text, 
+                recommendation text
+            );
+            CREATE TABLE genotype_drug_recommendation ( 
+                gene_name text, 
+                haplotype_name1 text, 
+                haplotype_name2 text, 
+                drug_recommendation_id bigint, 
+                foreign key (drug_recommendation_id) references drug_recommendation(id)
+            );
+        """
+        self.connect()
+        with tmp_dir() as directory:
+            def load(drug_recommendation_rows, genotype_drug_recommendation_rows):
+                create_files({
+                    'drug_recommendation.dsv': rows_to_dsv([[ "drug_name", "recommendation", "gene_name", "haplotype_name1", "haplotype_name2" ]] + drug_recommendation_rows),
+                    'genotype_drug_recommendation.dsv': rows_to_dsv([[ "gene_name", "haplotype_name1", "haplotype_name2", "drug_name" ]] + genotype_drug_recommendation_rows),
+                }, directory=directory)
+                load_dsv(self.connection, 
+                    [os.path.join(directory, f) for f in ['drug_recommendation.dsv', 'genotype_drug_recommendation.dsv']], 
+                    delim="\t",
+                    mapping_strings=["genotype_drug_recommendation: gene_name, haplotype_name1, haplotype_name2, drug_name => drug_recommendation"],
+                    ignore_strings=[
+                        "genotype_drug_recommendation.drug_name",
+                        "drug_recommendation.gene_name",
+                        "drug_recommendation.haplotype_name1",
+                        "drug_recommendation.haplotype_name2",
+                    ],
+                    delta=True)
+            load(
+                [
+                    [ "d1", "r1", "G", "*1", "*1" ],
+                    [ "d1", "r2", "G", "*1", "*2" ],
+                    [ "d1", "r3", "G", "*2", "*2" ],
+                ],
+                [
+                    [ "G", "*1", "*1", "d1" ],
+                    [ "G", "*1", "*2", "d1" ],
+                    [ "G", "*2", "*2", "d1" ],
+                ])
+            load(
+                [
+                    [ "d1", "r1", "G", "*1", "*1" ],
+                    [ "d1", "r2 changed", "G", "*1", "*2" ],
+                    [ "d1", "r4", "G", "*1", "*3" ],
+                ],
+                [
+                    [ "G", "*1", "*1", "d1" ],
+                    [ "G", "*1", "*2", "d1" ],
+                    [ "G", "*1", "*3", "d1" ],
+                ])
+        self.assertEqual(
+            self.select(table='drug_recommendation', columns=["id", "drug_name", "recommendation"]), 
+            [
+                ( 1, "d1", "r1" ),
+                ( 2, "d1", "r2 changed" ),
+                ( 4, "d1", "r4" ),
+            ]
+        )
+        self.assertEqual(
+            sorted(self.select(table='genotype_drug_recommendation', columns=["gene_name", "haplotype_name1", "haplotype_name2", "drug_recommendation_id"])), 
+            [
+                ( "G", "*1", "*1", 1 ),
+                ( "G", "*1", "*2", 2 ),
+                ( "G", "*1", "*3", 4 ),
+            ]
+        )
+
+    def test_delta_existing_rows(self):
+        """
+        Test that the first delta load of tables loaded without --delta takes over the rows whose 
+        values are unchanged (keeping their auto_increment ids), and replaces the others.
+        """
+        self.schema = """
+            CREATE TABLE drug_recommendation ( 
+                id bigint auto_increment primary key, 
+                drug_name text, 
+                recommendation text
+            );
+            CREATE TABLE genotype_drug_recommendation ( 
+                gene_name varchar(64), 
+                haplotype_name1 varchar(64), 
+                haplotype_name2 varchar(64), 
+                drug_recommendation_id bigint, 
+                primary key (gene_name, haplotype_name1, haplotype_name2, drug_recommendation_id),
+                foreign key (drug_recommendation_id) references drug_recommendation(id)
+            );
+        """
+        self.connect()
+        with tmp_dir() as directory:
+            def load(drug_recommendation_rows, genotype_drug_recommendation_rows, delta):
+                create_files({
+                    'drug_recommendation.dsv': rows_to_dsv([[ "drug_name", "recommendation", "gene_name", "haplotype_name1", "haplotype_name2" ]] + drug_recommendation_rows),
+                    'genotype_drug_recommendation.dsv': rows_to_dsv([[ "gene_name", "haplotype_name1", "haplotype_name2", "drug_name" ]] + genotype_drug_recommendation_rows),
+                }, directory=directory)
+                load_dsv(self.connection, 
+                    [os.path.join(directory, f) for f in ['drug_recommendation.dsv', 'genotype_drug_recommendation.dsv']], 
+                    delim="\t",
+                    mapping_strings=["genotype_drug_recommendation: gene_name, haplotype_name1, haplotype_name2, drug_name => drug_recommendation"],
+                    ignore_strings=[
+                        "genotype_drug_recommendation.drug_name",
+                        "drug_recommendation.gene_name",
+                        "drug_recommendation.haplotype_name1",
+                        "drug_recommendation.haplotype_name2",
+                    ],
+                    batch_size=2,
+                    delta=delta)
+            load(
+                [
+                    [ "d1", "r1", "G", "*1", "*1" ],
+                    [ "d1", "r2", "G", "*1", "*2" ],
+                    [ "d1", "r3", "G", "*2", "*2" ],
+                ],
+                [
+                    [ "G", "*1", "*1", "d1" ],
+                    [ "G", "*1", "*2", "d1" ],
+                    [ "G", "*2", "*2", "d1" ],
+                ],
+                delta=False)
+            for i in xrange(2):
+                load(
+                    [
+                        [ "d1", "r1", "G", "*1", "*1" ],
+                        [ "d1", "r2 changed", "G", "*1", "*2" ],
+                        [ "d1", "r4", "G", "*1", "*3" ],
+                    ],
+                    [
+                        [ "G", "*1", "*1", "d1" ],
+                        [ "G", "*1", "*2", "d1" ],
+                        [ "G", "*1", "*3", "d1" ],
+                    ],
+                    delta=True)
+                self.assertEqual(
+                    self.select(table='drug_recommendation', columns=["id", "drug_name", "recommendation"]), 
+                    [
+                        ( 1, "d1", "r1" ),
+                        ( 4, "d1", "r2 changed" ),
+                        ( 5, "d1", "r4" ),
+                    ]
+                )
+                self.assertEqual(
+                    sorted(self.select(table='genotype_drug_recommendation', columns=["gene_name", "haplotype_name1", "haplotype_name2", "drug_recommendation_id"])), 
+                    [
+                        ( "G", "*1", "*1", 1 ),
+                        ( "G", "*1", "*2", 4 ),
+                        ( "G", "*1", "*3", 5 ),
+                    ]
+                )
+
+    def test_bulk(self):
+        """
+        Test that secondary indexes dropped for a bulk load are rebuilt afterwards, keeping their 
+        type, prefix lengths and comments.
+        """
+        def index_metadata():
+            cursor = self.connection.cursor()
+            cursor.execute("""
+                SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME, SUB_PART, INDEX_TYPE, INDEX_COMMENT
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+            """)
+            return cursor.fetchall()
+        indexes = []
+        def assertion():
+            self.assertEqual(
+                self.select(table='R_1', columns=["z", "T_id"]), 
+                [
+                    ( "z1", 2 ),
+                ]
+            )
+            self.assertEqual(index_metadata(), indexes)
+            self.assertIn(('T', 'x_fulltext', 1, 1, 'x', None, 'FULLTEXT', ''), indexes)
+            self.assertIn(('T', 'x_prefix', 1, 1, 'x', 5, 'BTREE', 'prefix'), indexes)
+        def load(db, files, *args, **kwargs):
+            indexes.extend(index_metadata())
+            with bulkload.bulk_session(db, ['T', 'R_1'], log=StringIO.StringIO()):
+                load_dsv(db, files, *args, **kwargs)
+        self._load_dsv_test(
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint auto_increment primary key, 
+                    x text,
+                    fulltext index x_fulltext (x),
+                    index x_prefix (x(5)) comment 'prefix'
+                ) ENGINE=InnoDB;
+                CREATE TABLE R_1 ( 
+                    z varchar(10), 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id),
+                    index z_idx (z)
+                ) ENGINE=InnoDB;
+            """,
+            files=[
+                ['T.dsv', [
+                    [ "x" ],
+                    [ "x1" ],
+                    [ "x2" ],
+                ]],
+                ['R_1.dsv', [
+                    [ "z",  "x" ],
+                    [ "z1", "x2" ],
+                ]],
+            ],
+            assertion=assertion,
+            ignore_strings=['R_1.x'],
+            mapping_strings=['R_1: x => T'],
+            load=load,
+        )
+
+    def test_bulk_invalid_foreign_key(self):
+        """
+        Test that rows violating foreign keys (unchecked during a bulk load) are reported afterwards.
+        """
+        def load(db, files, *args, **kwargs):
+            with bulkload.bulk_session(db, ['T', 'R_1'], log=StringIO.StringIO()):
+                load_dsv(db, files, *args, **kwargs)
+        self.assertRaises(RuntimeError, self._load_dsv_test,
+            schema="""
+                CREATE TABLE T ( 
+                    id bigint primary key
+                ) ENGINE=InnoDB;
+                CREATE TABLE R_1 ( 
+                    T_id bigint, 
+                    foreign key (T_id) references T(id)
+                ) ENGINE=InnoDB;
+            """,
+            files=[
+                ['T.dsv', [
+                    [ "id" ],
+                    [ "1" ],
+                ]],
+                ['R_1.dsv', [
+                    [ "T_id" ],
+                    [ "2" ],
+                ]],
+            ],
+            assertion=lambda: None,
+            load=load,
+        )
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,51 @@
 #!/usr/bin/env python
 import unittest
 from matrix_row_keys import *
+import collections
+import random
 
 def row_names(n):
     return ['y' + str(i) for i in xrange(1, n+1)]
 def column_names(n):
     return ['x' + str(i) for i in xrange(1, n+1)]
 
+def greedy_panel(column_names, rows):
+    """
+    The greedy panel of tag_columns, as it was first implemented: the counts of all columns are 
+    recomputed at each step, and a column is redundant if the rest of the panel splits every group 
+    of rows apart.
+    """
+    codes, values = encode(rows, len(column_names))
+    distinct = collections.OrderedDict()
+    for i in xrange(len(rows)):
+        distinct.setdefault(tuple(codes[i]), i)
+    distinct_codes, distinct_values = encode(distinct.keys(), len(column_names))
+    partitions = collections.OrderedDict()
+    for c, masks in enumerate(value_masks(distinct_codes, distinct_values)):
+        if len(masks) > 1:
+            partitions.setdefault(tuple(sorted(masks)), c)
+    columns = [(c, list(masks)) for masks, c in partitions.iteritems()]
+
+    def split(groups, masks):
+        return [G & M for G in groups for M in masks if bin(G & M).count('1') > 1]
+
+    def pairs(groups):
+        return sum(bin(G).count('1') * (bin(G).count('1') - 1) // 2 for G in groups)
+
+    start = [(1 << len(distinct)) - 1] if len(distinct) > 1 else []
+    panel = []
+    groups = start
+    while groups != []:
+        j = max(xrange(len(columns)), key=lambda j: (pairs(groups) - pairs(split(groups, columns[j][1])), -j))
+        panel.append(j)
+        groups = split(groups, columns[j][1])
+    def tells_apart(panel):
+        return reduce(lambda groups, j: split(groups, columns[j][1]), panel, start) == []
+    for j in list(panel):
+        if tells_apart([i for i in panel if i != j]):
+            panel.remove(j)
+    return [column_names[columns[j][0]] for j in sorted(panel, key=lambda j: columns[j][0])]
+
 class test_matrix_row_keys(unittest.TestCase):
     def _matrix_row_keys_test(self, expect, *args, **kwargs):
         self.assertEqual(matrix_row_keys(*args, **kwargs), expect)
@@ -111,6 +150,212 @@ class test_matrix_row_keys(unittest.TestCase):
             }
         )
 
+    def test_minimal_keys(self):
+        """
+        4x4 matrix where a row has a key that is a superset of another one of its keys (only the 
+        smaller key should be kept).
+        """
+        got = matrix_row_keys(column_names(4), row_names(4), [
+            [2, 2, 2, 1],
+            [2, 1, 1, 2],
+            [2, 1, 2, 2],
+            [1, 1, 2, 1],
+        ])
+        self.assertEqual(got['y3'], set([
+            frozenset([('x1', 2), ('x2', 1), ('x3', 2)]),
+            frozenset([('x3', 2), ('x4', 2)]),
+        ]))
+
+    def test_max_key_size(self):
+        """
+        Keys with more than max_key_size columns aren't returned.
+        """
+        got = matrix_row_keys(column_names(4), row_names(5), [
+            [1, 2, 3, 4],
+            [2, 2, 3, 4],
+            [1, 2, 3, 5],
+            [2, 2, 3, 5],
+            [2, 3, 3, 5],
+        ], max_key_size=2)
+        self.assertEqual(got['y4'], set())
+        self.assertEqual(got['y1'], set([
+            frozenset([('x1', 1), ('x4', 4)]),
+        ]))
+
+    def test_duplicate_rows(self):
+        """
+        Identical rows have no keys.
+        """
+        self.assertEqual(
+            matrix_row_keys(column_names(2), row_names(3), [
+                [1, 2],
+                [1, 2],
+                [2, 2],
+            ]), 
+            {
+                'y1': set(),
+                'y2': set(),
+                'y3': set([
+                    frozenset([('x1', 2)]),
+                ]),
+            }
+        )
+
+    def test_greedy(self):
+        """
+        Greedy keys are one of each row's minimal keys (and rows identical to another row have 
+        none).
+        """
+        rows = [
+            [1, 2, 3, 4],
+            [2, 2, 3, 4],
+            [1, 2, 3, 5],
+            [2, 2, 3, 5],
+            [2, 3, 3, 5],
+            [2, 3, 3, 5],
+        ]
+        got = greedy_row_keys(column_names(4), row_names(6), rows)
+        expect = matrix_row_keys(column_names(4), row_names(6), rows)
+        for y in row_names(6):
+            self.assertTrue(got[y].issubset(expect[y]))
+            self.assertEqual(len(got[y]), len(expect[y]) and 1)
+
+    def test_greedy_without_numpy(self):
+        """
+        The pure python greedy keys are the same as the vectorized ones.
+        """
+        import matrix_row_keys
+        rows = [
+            [1, 2, 1, 2],
+            [1, 2, 3, 4],
+            [3, 4, 1, 2],
+            [3, 2, 1, 4],
+        ]
+        got = greedy_row_keys(column_names(4), row_names(4), rows)
+        numpy = matrix_row_keys.numpy
+        matrix_row_keys.numpy = None
+        try:
+            self.assertEqual(greedy_row_keys(column_names(4), row_names(4), rows), got)
+        finally:
+            matrix_row_keys.numpy = numpy
+
+    def test_jobs(self):
+        """
+        Finding keys in worker processes gives the same keys.
+        """
+        rows = [
+            [1, 2, 1, 2],
+            [1, 2, 3, 4],
+            [3, 4, 1, 2],
+            [3, 2, 1, 4],
+        ]
+        self.assertEqual(
+            matrix_row_keys(column_names(4), row_names(4), rows, jobs=2),
+            matrix_row_keys(column_names(4), row_names(4), rows))
+        self.assertEqual(
+            greedy_row_keys(column_names(4), row_names(4), rows, jobs=2),
+            greedy_row_keys(column_names(4), row_names(4), rows))
+
+    def _update_row_keys_test(self, old_row_names, old_rows, new_row_names, new_rows):
+        K = matrix_row_keys(column_names(3), old_row_names, old_rows)
+        self.assertEqual(
+            update_row_keys(K, column_names(3), old_row_names, old_rows, new_row_names, new_rows),
+            matrix_row_keys(column_names(3), new_row_names, new_rows))
+
+    def test_update_added_row(self):
+        """
+        Adding a row that matches another row's key.
+        """
+        self._update_row_keys_test(
+            row_names(3), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [2, 3, 3],
+            ],
+            row_names(4), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [2, 3, 3],
+                [1, 3, 4],
+            ])
+
+    def test_update_removed_row(self):
+        """
+        Removing the last row that kept a smaller key from distinguishing another row.
+        """
+        self._update_row_keys_test(
+            row_names(4), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [2, 3, 3],
+                [1, 3, 4],
+            ],
+            row_names(3), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [2, 3, 3],
+            ])
+
+    def test_update_changed_row(self):
+        """
+        Changing a row's values.
+        """
+        self._update_row_keys_test(
+            row_names(3), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [2, 3, 3],
+            ],
+            row_names(3), [
+                [1, 2, 3],
+                [1, 3, 3],
+                [1, 2, 4],
+            ])
+
+    def test_tag_columns(self):
+        """
+        The greedy panel may be larger than the smallest one, which the exact search finds.
+        """
+        # greedy takes x1 first (it tells apart the most pairs), but x3 and x4 are enough
+        rows = [
+            [2, 1, 1, 1],
+            [2, 3, 2, 1],
+            [2, 3, 1, 3],
+            [1, 1, 1, 2],
+            [3, 1, 3, 1],
+        ]
+        greedy, lower_bound = tag_columns(column_names(4), rows)
+        self.assertEqual(lower_bound, 2)
+        self.assertEqual(greedy, ['x1', 'x2', 'x3'])
+        self.assertEqual(tag_columns(column_names(4), rows, exact=True), (['x3', 'x4'], 2))
+
+    def test_tag_columns_greedy_regression(self):
+        """
+        The greedy panel (recounted lazily, with redundant columns found by hashing) is the one found 
+        by recounting every column at each step and rechecking the panel without each column.
+        """
+        rand = random.Random(0)
+        for i in xrange(200):
+            n = rand.randint(1, 30)
+            m = rand.randint(1, 12)
+            values = rand.randint(2, 4)
+            # mostly reference (1) values, with some exact duplicate rows
+            rows = [[rand.randint(1, values) if rand.random() < 0.3 else 1 for c in xrange(m)] for r in xrange(n)]
+            rows.extend(list(rand.choice(rows)) for r in xrange(rand.randint(0, 3)))
+            self.assertEqual(tag_columns(column_names(m), rows)[0], greedy_panel(column_names(m), rows), rows)
+
+    def test_tag_columns_duplicate_rows(self):
+        """
+        Identical rows don't need to be told apart.
+        """
+        self.assertEqual(
+            tag_columns(column_names(3), [
+                [1, 1, 1],
+                [1, 1, 1],
+                [1, 2, 1],
+            ]),
+            (['x2'], 1))
+
     # can we have two equally sized non-mutually exclusive keys?
 
 if __name__ == '__main__':
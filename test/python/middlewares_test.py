@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb.middlewares import OfflineReplayMiddleware, EndpointThrottleMiddleware, EndpointThrottle
+from scrapy.http import Request, FormRequest, HtmlResponse
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.settings import Settings, CrawlerSettings
+from scrapy import signals
+from pharmgkb import settings as project_settings
+import collections
+import os
+import os.path
+import shutil
+import tempfile
+
+class Stats(object):
+    def __init__(self):
+        self.values = collections.Counter()
+
+    def inc_value(self, key, spider=None):
+        self.values[key] += 1
+
+    def set_value(self, key, value, spider=None):
+        self.values[key] = value
+
+class Crawler(object):
+    """
+    Stands in for a scrapy Crawler, with a downloader that only has slots.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.stats = Stats()
+        self.signals = Signals()
+        self.engine = Engine()
+
+class Signals(object):
+    def __init__(self):
+        self.connected = []
+
+    def connect(self, receiver, signal):
+        self.connected.append((receiver, signal))
+
+class Engine(object):
+    def __init__(self):
+        self.downloader = Downloader()
+
+class Downloader(object):
+    def __init__(self):
+        self.slots = {}
+
+class test_offline_replay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for filename, body in [
+                ('www.pharmgkb.org/gene/PA128', '<html><body>CYP2D6</body></html>'),
+                ('www.pharmgkb.org/views/alleleGuidelines.action?allele1=PA1&allele2=PA2&annotationId=827848453&location=CYP2D6', '<html><body><dl></dl></body></html>'),
+                ('www.pharmgkb.org/views/ajaxGuidelinePickerData.action?annotationId=827848453.html', '{"results":[]}'),
+                ]:
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(body)
+        self.stats = Stats()
+        self.middleware = OfflineReplayMiddleware(self.directory, self.stats)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_mirror(self):
+        """
+        Requests (including form requests, whose parameters are in a different order than the
+        mirrored url's) are served from the mirror, from either the directory wget was run in or
+        the host directory.
+        """
+        response = self.middleware.process_request(Request('http://www.pharmgkb.org/gene/PA128'), None)
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual(response.body, '<html><body>CYP2D6</body></html>')
+        form_request = FormRequest('http://www.pharmgkb.org/views/alleleGuidelines.action', formdata=[
+            ('location', 'CYP2D6'), ('annotationId', '827848453'), ('allele2', 'PA2'), ('allele1', 'PA1')])
+        self.assertEqual(self.middleware.process_request(form_request, None).body, '<html><body><dl></dl></body></html>')
+        self.assertEqual(self.middleware.process_request(FormRequest('http://www.pharmgkb.org/views/ajaxGuidelinePickerData.action',
+            formdata={'annotationId': '827848453'}), None).body, '{"results":[]}')
+        host_middleware = OfflineReplayMiddleware(os.path.join(self.directory, 'www.pharmgkb.org'), self.stats)
+        self.assertEqual(host_middleware.process_request(Request('http://localhost:8010/gene/PA128'), None).body, '<html><body>CYP2D6</body></html>')
+        self.assertEqual(self.stats.values['offline/mirror'], 4)
+
+    def test_missing(self):
+        """
+        Requests missing from the mirror are dropped.
+        """
+        for request in [
+                Request('http://www.pharmgkb.org/gene/PA124'),
+                FormRequest('http://www.pharmgkb.org/views/alleleGuidelines.action', formdata={'allele1': 'PA1'})]:
+            self.assertRaises(IgnoreRequest, lambda: self.middleware.process_request(request, None))
+        self.assertEqual(self.stats.values['offline/ignored'], 2)
+
+class test_endpoint_throttle(unittest.TestCase):
+    def test_throttle(self):
+        """
+        Successful responses shorten the delay down to min_delay, then raise the concurrency up to 
+        max_concurrency, one round of responses at a time; errors halve the concurrency and double the 
+        delay, and hold the pace until they're within the error budget.
+        """
+        throttle = EndpointThrottle(start_delay=1., min_delay=0.5, max_concurrency=3, error_budget=0.01, budget_responses=100)
+        paces = []
+        for i in xrange(10):
+            throttle.record(0.1, False)
+            paces.append((throttle.concurrency, throttle.delay))
+        self.assertEqual(paces[:6], [(1, 0.75), (1, 0.5625), (1, 0.5), (2, 0.5), (2, 0.5), (3, 0.5)])
+        self.assertEqual(paces[-1], (3, 0.5))
+        throttle.record(None, True)
+        self.assertEqual((throttle.concurrency, throttle.delay), (1, 1.))
+        # another error would be over budget until 200 responses
+        for i in xrange(100):
+            throttle.record(0.1, False)
+        self.assertEqual((throttle.concurrency, throttle.delay), (1, 1.))
+        for i in xrange(100):
+            throttle.record(0.1, False)
+        self.assertEqual((throttle.concurrency, throttle.delay), (3, 0.5))
+
+    def test_latency(self):
+        """
+        Rising latency drops concurrent requests.
+        """
+        throttle = EndpointThrottle(start_delay=0., max_concurrency=2)
+        throttle.record(0.1, False)
+        self.assertEqual(throttle.concurrency, 2)
+        for i in xrange(10):
+            throttle.record(1., False)
+        self.assertEqual(throttle.concurrency, 1)
+
+    def test_from_crawler(self):
+        """
+        The middleware is only enabled by ENDPOINT_THROTTLE_ENABLED, and gives each endpoint of 
+        ENDPOINT_THROTTLE_ENDPOINTS a throttle with the default limits, overridden by its own.
+        """
+        def crawler(**overrides):
+            crawler_settings = CrawlerSettings(project_settings)
+            crawler_settings.overrides.update(overrides)
+            return Crawler(crawler_settings)
+        self.assertRaises(NotConfigured, EndpointThrottleMiddleware.from_crawler, crawler(ENDPOINT_THROTTLE_ENABLED=False))
+        c = crawler(ENDPOINT_THROTTLE_ENABLED=True, ENDPOINT_THROTTLE_START_DELAY=2, ENDPOINT_THROTTLE_MAX_CONCURRENCY=3)
+        middleware = EndpointThrottleMiddleware.from_crawler(c)
+        self.assertEqual(c.signals.connected, [(middleware.spider_closed, signals.spider_closed)])
+        self.assertEqual([name for name, pattern, throttle in middleware.endpoints], ['gene', 'guideline_picker', 'allele_guidelines'])
+        self.assertEqual([(throttle.max_concurrency, throttle.delay, throttle.min_delay, throttle.error_budget) for name, pattern, throttle in middleware.endpoints], [
+            (1, 2., 0.25, 0.01),
+            (2, 2., 0.25, 0.01),
+            (4, 2., 0.25, 0.01),
+        ])
+        self.assertEqual(middleware.error_codes, set([429, 500, 502, 503, 504]))
+        self.assertIs(middleware.stats, c.stats)
+
+    def test_slot_recreated(self):
+        """
+        An endpoint's slot is created with its throttle's pace, and recreated with its current pace 
+        once the downloader drops it.
+        """
+        c = Crawler(Settings({'RANDOMIZE_DOWNLOAD_DELAY': False}))
+        middleware = EndpointThrottleMiddleware(c, [
+            ('gene', r'/gene/PA\d+', EndpointThrottle(start_delay=2., min_delay=0.5, max_concurrency=2)),
+            ], Stats())
+        gene = Request('http://www.pharmgkb.org/gene/PA128')
+        middleware.process_request(gene, None)
+        slot = c.engine.downloader.slots['www.pharmgkb.org gene']
+        self.assertEqual((slot.concurrency, slot.delay), (1, 2.))
+        # an existing slot is kept
+        middleware.process_request(Request('http://www.pharmgkb.org/gene/PA124'), None)
+        self.assertIs(c.engine.downloader.slots['www.pharmgkb.org gene'], slot)
+        gene.meta['download_latency'] = 0.1
+        for i in xrange(2):
+            middleware.process_response(gene, HtmlResponse(gene.url), None)
+        self.assertEqual((slot.concurrency, slot.delay), (1, 1.125))
+        # the downloader drops idle slots
+        del c.engine.downloader.slots['www.pharmgkb.org gene']
+        middleware.process_request(Request('http://www.pharmgkb.org/gene/PA356'), None)
+        recreated = c.engine.downloader.slots['www.pharmgkb.org gene']
+        self.assertIsNot(recreated, slot)
+        self.assertEqual((recreated.concurrency, recreated.delay), (1, 1.125))
+        # requests for other hosts get their own slot
+        middleware.process_request(Request('http://localhost/gene/PA128'), None)
+        self.assertEqual(sorted(c.engine.downloader.slots), ['localhost gene', 'www.pharmgkb.org gene'])
+
+    def test_middleware(self):
+        """
+        Requests for each endpoint are downloaded in their own slot, whose pace follows the 
+        endpoint's responses; other requests, and responses that weren't downloaded, are left alone.
+        """
+        c = Crawler(Settings({'RANDOMIZE_DOWNLOAD_DELAY': False}))
+        stats = Stats()
+        middleware = EndpointThrottleMiddleware(c, [
+            ('gene', r'/gene/PA\d+', EndpointThrottle(start_delay=1., min_delay=0.5, max_concurrency=2)),
+            ('allele_guidelines', r'/views/alleleGuidelines\.action', EndpointThrottle(start_delay=1., min_delay=0.5, max_concurrency=4)),
+            ], stats)
+        gene = Request('http://www.pharmgkb.org/gene/PA128')
+        guideline = FormRequest('http://www.pharmgkb.org/views/alleleGuidelines.action', formdata={'allele1': 'PA1'})
+        other = Request('http://www.pharmgkb.org/views/ajaxGuidelinePickerData.action')
+        for request in [gene, guideline, other]:
+            middleware.process_request(request, None)
+        self.assertEqual(gene.meta['download_slot'], 'www.pharmgkb.org gene')
+        self.assertEqual(guideline.meta['download_slot'], 'www.pharmgkb.org allele_guidelines')
+        self.assertNotIn('download_slot', other.meta)
+        slot = c.engine.downloader.slots['www.pharmgkb.org gene']
+        self.assertEqual((slot.concurrency, slot.delay), (1, 1.))
+
+        gene.meta['download_latency'] = 0.1
+        middleware.process_response(gene, HtmlResponse(gene.url), None)
+        self.assertEqual((slot.concurrency, slot.delay), (1, 0.75))
+        middleware.process_response(guideline, HtmlResponse(guideline.url), None)
+        middleware.process_exception(gene, IOError(), None)
+        self.assertEqual((slot.concurrency, slot.delay), (1, 1.5))
+        self.assertEqual(stats.values['endpoint_throttle/gene/responses'], 2)
+        self.assertEqual(stats.values['endpoint_throttle/gene/errors'], 1)
+        self.assertEqual(stats.values['endpoint_throttle/allele_guidelines/responses'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
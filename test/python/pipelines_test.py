@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import unittest
+from pharmgkb import pipelines
+from pharmgkb import items
+import dcsv
+import csv
+import os.path
+import sqlite3
+import shutil
+import tempfile
+from StringIO import StringIO
+
+class test_collapse_by_key(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _collapse(self, rows, max_memory_rows, use_dcsv=False):
+        filename = os.path.join(self.directory, 'genotype_phenotype' + ('.dcsv' if use_dcsv else '.csv'))
+        with open(filename, 'wb') as f:
+            writer = dcsv.writer(f) if use_dcsv else csv.writer(f)
+            writer.writerow(['gene_name', 'haplotype_name1', 'haplotype_name2', 'phenotype_name', 'phenotype_genotype'])
+            writer.writerows(rows)
+            if use_dcsv:
+                writer.flush()
+        output = StringIO()
+        pipelines.collapse_by_key(filename, output, max_memory_rows=max_memory_rows, dcsv_output=use_dcsv)
+        output.seek(0)
+        return [[r[f] for f in ['gene_name', 'haplotype_name1', 'haplotype_name2', 'phenotype_name']]
+                for r in (dcsv.DictReader(output) if use_dcsv else csv.DictReader(output))]
+
+    def test_collapse(self):
+        """
+        Rows with the same primary key are collapsed using genotype_phenotype_collapser, whether or
+        not they fit in memory.
+        """
+        rows = [
+            ['CYP2D6', '*2', '*2', 'Extensive metabolizer', 'x'],
+            ['CYP2D6', '*1', '*2', 'Poor metabolizers', 'x'],
+            ['CYP2C19', '*1', '*1', 'Extensive metabolizer', 'x'],
+            ['CYP2D6', '*1', '*2', 'Poor metabolizer', 'x'],
+            ['CYP2D6', '*2', '*2', 'Extensive metabolizer', 'x'],
+        ]
+        expected = [
+            ['CYP2C19', '*1', '*1', 'Extensive metabolizer'],
+            ['CYP2D6', '*1', '*2', 'Poor metabolizer'],
+            ['CYP2D6', '*2', '*2', 'Extensive metabolizer'],
+        ]
+        for max_memory_rows in [1, 2, 100]:
+            self.assertEqual(self._collapse(rows, max_memory_rows), expected)
+            self.assertEqual(self._collapse(rows, max_memory_rows, use_dcsv=True), expected)
+
+class test_database_pipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = os.path.join(self.directory, 'haplorec.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def select(self, query):
+        db = sqlite3.connect(self.db)
+        rows = sorted(db.execute(query).fetchall())
+        db.close()
+        return rows
+
+    def test_sqlite(self):
+        """
+        Rows with the same primary key are collapsed across batches, and genotype_drug_recommendation 
+        references the drug_recommendation of the same genotype and drug.
+        """
+        pipeline = pipelines.DatabasePipeline(engine='sqlite', db=self.db, batch_size=1)
+        genotypes = [('*1', '*1', 'Poor metabolizers'), ('*1', '*2', 'Extensive metabolizer'), ('*1', '*1', 'Poor metabolizer')]
+        for haplotype_name1, haplotype_name2, phenotype_name in genotypes:
+            genotype = dict(gene_name='CYP2D6', haplotype_name1=haplotype_name1, haplotype_name2=haplotype_name2)
+            for item in [
+                    items.genotype_phenotype(phenotype_name=phenotype_name, phenotype_genotype='x', **genotype),
+                    items.drug_recommendation(drug_name='codeine', implications=phenotype_name, recommendation='r', classification='Strong', **genotype),
+                    items.genotype_drug_recommendation(drug_name='codeine', **genotype),
+                    items.unused_genotype_data(values={}, source={})]:
+                self.assertIs(pipeline.process_item(item, None), item)
+        pipeline.close_spider(None)
+        self.assertEqual(self.select("SELECT haplotype_name1, haplotype_name2, phenotype_name FROM genotype_phenotype"), [
+            ('*1', '*1', 'Poor metabolizer'),
+            ('*1', '*2', 'Extensive metabolizer'),
+        ])
+        drug_recommendations = self.select("SELECT id, implications, recommendation, classification, diplotype_egs FROM drug_recommendation")
+        self.assertEqual([r[0] for r in drug_recommendations], [1, 2])
+        self.assertEqual(drug_recommendations[1][1:], ('Extensive metabolizer', 'r', 'Strong', ''))
+        self.assertEqual(set(drug_recommendations[0][1].split('. ')), set(['Poor metabolizers', 'Poor metabolizer']))
+        self.assertEqual(self.select("SELECT haplotype_name1, haplotype_name2, drug_recommendation_id FROM genotype_drug_recommendation"), [
+            ('*1', '*1', 1),
+            ('*1', '*2', 2),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
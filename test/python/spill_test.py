@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import unittest
+from spill import *
+import os.path
+
+class test_spill_dict(unittest.TestCase):
+    def test_in_memory(self):
+        """
+        Entries stay in memory while there are at most max_memory_items of them.
+        """
+        d = SpillDict(max_memory_items=2)
+        d[('R', 'T', ('x1',))] = 1
+        d[('R', 'T', ('x2',))] = 2
+        self.assertFalse(d.spilled)
+        self.assertEqual(d[('R', 'T', ('x1',))], 1)
+        self.assertRaises(KeyError, lambda: d[('R', 'T', ('x3',))])
+        d.close()
+
+    def test_spilled(self):
+        """
+        Entries are still found (and can be overwritten) after being spilled to disk.
+        """
+        d = SpillDict(max_memory_items=2)
+        for i in xrange(10):
+            d[('x', i)] = i
+        self.assertTrue(d.spilled)
+        self.assertTrue(len(d.memory) <= 2)
+        d[('x', 0)] = 100
+        self.assertEqual([d[('x', i)] for i in xrange(10)], [100] + range(1, 10))
+        self.assertEqual(len(d), 10)
+        self.assertTrue(('x', 9) in d)
+        self.assertFalse(('x', 10) in d)
+        path = d.path
+        d.close()
+        self.assertFalse(os.path.exists(path))
+
+class test_spill_set(unittest.TestCase):
+    def test_spilled(self):
+        """
+        Strings are still found after being spilled to disk, including ones that collide in the 
+        bloom filter.
+        """
+        s = SpillSet(max_memory_items=3, bloom_bits=16)
+        for i in xrange(20):
+            s.add('x{i}'.format(i=i))
+        s.add('x0')
+        self.assertTrue(s.spilled)
+        self.assertTrue(len(s.memory) <= 3)
+        self.assertEqual(len(s), 20)
+        self.assertTrue(all('x{i}'.format(i=i) in s for i in xrange(20)))
+        self.assertFalse(any('y{i}'.format(i=i) in s for i in xrange(20)))
+        path = s.path
+        s.close()
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
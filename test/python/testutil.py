@@ -14,6 +14,7 @@ class DatabaseTestMixin(object):
     port = 3306
     user = 'root'
     passwd = ''
+    local_infile = False
     db = None
     schema_file = None
     schema = None
@@ -41,6 +42,7 @@ class DatabaseTestMixin(object):
             user=self.user,
             passwd=self.passwd,
             db=self.db,
+            local_infile=self.local_infile,
         )
         self.cursor = self.connection.cursor()
 